@@ -0,0 +1,3 @@
+"""
+服务器性能基准测试脚本
+"""
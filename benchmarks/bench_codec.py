@@ -0,0 +1,314 @@
+"""
+消息编解码基准测试
+对每种消息类型按真实大小的样例消息测量三项吞吐量：
+- encode：NetworkMessage -> 帧（encode_message）
+- decode：帧 -> NetworkMessage（decode_message）
+- framing：FrameDecoder 从连续字节流中切出帧
+另外按服务器实际流量比例测量混合消息的完整往返（编码、分帧、解码）。
+
+比较的编码：json（当前文本格式）、binary（紧凑二进制格式），
+以及已安装时的 orjson / ujson（仅作对比，替换JSON文本编码的实现，线格式不变）。
+
+结果以“相对校准循环的吞吐量”保存，在不同机器上也可以比较。
+--check 时按 编码/项目 分组，组内各消息与基准之比的几何平均低于 (1 - 容差) 即以非零状态退出。
+
+用法：
+    python -m benchmarks.bench_codec                     # 只输出结果
+    python -m benchmarks.bench_codec --check             # 与基准比较，性能回退时失败
+    python -m benchmarks.bench_codec --save-baseline     # 更新基准文件
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.protocol import NetworkMessage, MessageType, MESSAGE_TYPES_BY_VALUE
+from network.codec import CODEC_JSON, CODEC_BINARY
+from network.framing import FrameDecoder, encode_message, decode_message, encode_frame
+from network.state_sync import StateTracker
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'codec_baseline.json')
+DEFAULT_TOLERANCE = 0.3  # 每组（编码/项目）几何平均允许低于基准的比例
+ITEM_TOLERANCE = 0.5  # 单项低于基准该比例时只给出警告（单项计时噪声较大）
+BUILTIN_CODECS = (CODEC_JSON, CODEC_BINARY)  # 基准只覆盖内置编码，可选后端未必安装
+
+# 混合流量中各类消息的比例（来自 load_test 统计的服务器收发比例）
+MIXED_PROFILE = {
+    'game_state_delta': 30,
+    'state_ack': 25,
+    'dice_roll': 12,
+    'effect_dice_roll': 5,
+    'ping': 10,
+    'pong': 10,
+    'game_state_keyframe': 3,
+    'player_joined': 2,
+    'join_room': 1,
+    'join_success': 1,
+    'ai_takeover': 1,
+}
+
+def sample_players() -> List[dict]:
+    return [{'id': f'player_{i:016x}', 'name': f'玩家{i + 1}', 'slot': i, 'is_host': i == 0}
+            for i in range(4)]
+
+def sample_states() -> Tuple[dict, dict]:
+    """生成真实的关键帧和增量 GAME_STATE 数据"""
+    state = {
+        'players': {str(i): {'name': f'玩家{i + 1}', 'position': i * 3, 'money': 1000, 'is_ai': i >= 2}
+                    for i in range(4)},
+        'current_player': 0,
+        'game_over': False,
+        'winner': None
+    }
+    tracker = StateTracker()
+    tracker.commit(state)
+    keyframe = tracker.build_update(None)
+    state = json.loads(json.dumps(state))
+    state['players']['0']['position'] = 5
+    state['players']['0']['money'] = 1200
+    state['current_player'] = 1
+    tracker.commit(state)
+    delta = tracker.build_update(1)
+    return keyframe, delta
+
+def sample_messages() -> Dict[str, NetworkMessage]:
+    """每种消息类型一条真实大小的样例（房间广播带有序号）"""
+    keyframe, delta = sample_states()
+    token = 'x' * 22
+    messages = {
+        'join_room': NetworkMessage(MessageType.JOIN_ROOM, {
+            'player_name': '玩家1', 'room_id': 'default', 'version': '1.0.0',
+            'codecs': ['binary', 'json'], 'authoritative': True}),
+        'join_success': NetworkMessage(MessageType.JOIN_SUCCESS, {
+            'player_id': 'player_0000000000000000', 'slot': 0, 'is_host': True, 'players': sample_players(),
+            'codec': 'binary', 'session_token': token, 'seq': 12}),
+        'join_failed': NetworkMessage(MessageType.JOIN_FAILED, {'reason': '游戏已经开始，无法加入'}),
+        'player_joined': NetworkMessage(MessageType.PLAYER_JOINED, {
+            'player_id': 'player_0000000000000001', 'player_name': '玩家2', 'slot': 1}, seq=3),
+        'player_left': NetworkMessage(MessageType.PLAYER_LEFT, {'player_id': 'player_0000000000000001'}, seq=4),
+        'player_disconnected': NetworkMessage(MessageType.PLAYER_DISCONNECTED, {
+            'player_id': 'player_0000000000000001', 'player_slot': 1, 'player_name': '玩家2',
+            'reason': '连接断开'}, seq=5),
+        'ai_takeover': NetworkMessage(MessageType.AI_TAKEOVER, {'player_slot': 1, 'player_name': '玩家2'}, seq=6),
+        'player_resumed': NetworkMessage(MessageType.PLAYER_RESUMED, {
+            'player_id': 'player_0000000000000001', 'player_slot': 1, 'player_name': '玩家2'}, seq=7),
+        'ai_turn_start': NetworkMessage(MessageType.AI_TURN_START, {'player_slot': 2}, seq=8),
+        'start_game': NetworkMessage(MessageType.START_GAME),
+        'game_started': NetworkMessage(MessageType.GAME_STARTED, {
+            'players': sample_players(), 'authoritative': True}, seq=9),
+        'game_state_keyframe': NetworkMessage(MessageType.GAME_STATE, keyframe),
+        'game_state_delta': NetworkMessage(MessageType.GAME_STATE, delta),
+        'state_ack': NetworkMessage(MessageType.STATE_ACK, {'version': 1234}),
+        'player_move': NetworkMessage(MessageType.PLAYER_MOVE, {'player_slot': 1, 'steps': 4, 'position': 17}, seq=10),
+        'dice_roll': NetworkMessage(MessageType.DICE_ROLL, {
+            'dice_result': 4, 'player_id': 'player_0000000000000000', 'player_slot': 0}, seq=11),
+        'effect_dice_roll': NetworkMessage(MessageType.EFFECT_DICE_ROLL, {
+            'effect_result': 2, 'player_id': 'player_0000000000000000', 'player_slot': 0}, seq=12),
+        'turn_change': NetworkMessage(MessageType.TURN_CHANGE, {'current_player': 2}, seq=13),
+        'game_over': NetworkMessage(MessageType.GAME_OVER, {'results': [
+            {'name': f'玩家{i + 1}', 'money': 1000 + i * 250, 'rank': 4 - i} for i in range(4)]}, seq=14),
+        'ping': NetworkMessage(MessageType.PING, {'t0': 81234.567891}),
+        'pong': NetworkMessage(MessageType.PONG, {'t0': 81234.567891, 't1': 93120.001234, 't2': 93120.001301}),
+    }
+    covered = {message.type for message in messages.values()}
+    missing = set(MessageType) - covered
+    if missing:
+        raise RuntimeError(f"缺少样例消息: {sorted(t.value for t in missing)}")
+    return messages
+
+def optional_json_backends() -> Dict[str, Tuple[Callable, Callable]]:
+    """已安装的第三方JSON库：(编码为帧, 从帧解码)"""
+    backends = {}
+
+    def make(dumps: Callable, loads: Callable):
+        def encode(message: NetworkMessage) -> bytes:
+            payload = {'type': message.type.value, 'data': message.data, 'player_id': message.player_id}
+            if message.seq is not None:
+                payload['seq'] = message.seq
+            encoded = dumps(payload)
+            return encode_frame(encoded if isinstance(encoded, bytes) else encoded.encode('utf-8'))
+
+        def decode(frame: bytes) -> Optional[NetworkMessage]:
+            data = loads(frame)
+            return NetworkMessage(MESSAGE_TYPES_BY_VALUE[data['type']], data.get('data', {}), data.get('player_id'),
+                                  data.get('seq'))
+        return encode, decode
+
+    try:
+        import orjson
+        backends['orjson'] = make(orjson.dumps, orjson.loads)
+    except ImportError:
+        pass
+    try:
+        import ujson
+        backends['ujson'] = make(ujson.dumps, ujson.loads)
+    except ImportError:
+        pass
+    return backends
+
+def measure(func: Callable[[], None], min_time: float, repeat: int) -> float:
+    """返回 func 每秒可执行的次数（取多次测量中最快的一次）"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 4:
+            break
+        loops *= 4
+    loops = max(1, int(loops * min_time / max(elapsed, 1e-9)))
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return loops / best
+
+def calibrate(min_time: float, repeat: int) -> float:
+    """校准循环：与编解码无关的纯Python工作量，用于抵消机器速度差异"""
+    items = list(range(64))
+
+    def work():
+        total = 0
+        for value in items:
+            total += value * 3 // 2
+        return {'total': total, 'text': str(total)}
+    return measure(work, min_time, repeat)
+
+def run_suite(min_time: float, repeat: int, codecs: Optional[List[str]] = None) -> Dict[str, float]:
+    """运行全部测试，返回 '编码/项目/消息' -> 每秒次数"""
+    messages = sample_messages()
+    backends = {codec: (lambda m, c=codec: encode_message(m, c), decode_message) for codec in BUILTIN_CODECS}
+    backends.update(optional_json_backends())
+    if codecs:
+        backends = {name: backend for name, backend in backends.items() if name in codecs}
+
+    results = {}
+    for codec, (encode, decode) in backends.items():
+        frames = {name: encode(message) for name, message in messages.items()}
+        for name, message in messages.items():
+            frame = frames[name]
+            results[f'{codec}/encode/{name}'] = measure(lambda: encode(message), min_time, repeat)
+            results[f'{codec}/decode/{name}'] = measure(lambda: decode(frame), min_time, repeat)
+
+            # 分帧：一次喂入64帧的字节流
+            stream = frame * 64
+            decoder = FrameDecoder()
+            results[f'{codec}/framing/{name}'] = 64 * measure(lambda: decoder.feed(stream), min_time, repeat)
+
+        # 混合流量：按比例排列的消息完整往返
+        mixed = [messages[name] for name, weight in MIXED_PROFILE.items() for _ in range(weight)]
+        decoder = FrameDecoder()
+
+        def round_trip():
+            stream = b''.join([encode(message) for message in mixed])
+            for frame in decoder.feed(stream):
+                decode(frame)
+        results[f'{codec}/mixed/roundtrip'] = len(mixed) * measure(round_trip, min_time, repeat)
+    return results
+
+def compare(results: Dict[str, float], calibration: float, baseline: dict,
+            tolerance: float) -> Tuple[List[str], List[str]]:
+    """
+    与基准比较（按校准值归一化）
+
+    Returns:
+        tuple: (回退的组, 单项警告)；组为 编码/项目，按组内各消息与基准之比的几何平均判断
+    """
+    groups: Dict[str, List[float]] = {}
+    warnings = []
+    for key, base_score in baseline['scores'].items():
+        if key not in results:
+            continue
+        ratio = results[key] / calibration / base_score
+        codec, kind, _ = key.split('/', 2)
+        groups.setdefault(f'{codec}/{kind}', []).append(ratio)
+        if ratio < 1 - ITEM_TOLERANCE:
+            warnings.append(f"{key}: 基准的 {ratio:.0%}")
+
+    regressions = []
+    for group, ratios in sorted(groups.items()):
+        mean = math.exp(sum(math.log(r) for r in ratios) / len(ratios))
+        if mean < 1 - tolerance:
+            regressions.append(f"{group}: 基准的 {mean:.0%}")
+    return regressions, warnings
+
+def print_results(results: Dict[str, float], baseline: Optional[dict], calibration: float):
+    """按 编码 x 项目 输出表格"""
+    codecs = sorted({key.split('/')[0] for key in results}, key=lambda c: (c not in BUILTIN_CODECS, c))
+    rows = sorted({tuple(key.split('/')[1:]) for key in results}, key=lambda r: (r[0], r[1]))
+    header = f"{'项目':<40}" + ''.join(f"{codec:>14}" for codec in codecs)
+    if baseline:
+        header += f"{'json基准比':>12}"
+    print(header)
+    for kind, name in rows:
+        line = f"{kind + '/' + name:<40}"
+        for codec in codecs:
+            value = results.get(f'{codec}/{kind}/{name}')
+            line += f"{value:>14,.0f}" if value is not None else f"{'-':>14}"
+        if baseline:
+            base = baseline['scores'].get(f'json/{kind}/{name}')
+            value = results.get(f'json/{kind}/{name}')
+            if base and value:
+                line += f"{value / calibration / base:>12.2f}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="消息编解码基准测试")
+    parser.add_argument('--time', type=float, default=0.1, help="每项测量的最短时间（秒）")
+    parser.add_argument('--repeat', type=int, default=3, help="每项重复测量次数（取最快）")
+    parser.add_argument('--codecs', nargs='+', default=None, help="只测试指定的编码")
+    parser.add_argument('--check', action='store_true', help="与基准比较，性能回退时以状态1退出")
+    parser.add_argument('--save-baseline', action='store_true', help="把本次结果保存为基准")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="基准文件路径")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="允许低于基准的比例")
+    args = parser.parse_args()
+
+    # 校准在测试前后各做一次取较快值，降低机器负载波动的影响
+    calibration = calibrate(args.time * 4, args.repeat * 3)
+    results = run_suite(args.time, args.repeat, args.codecs)
+    calibration = max(calibration, calibrate(args.time * 4, args.repeat * 3))
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print(f"Python {platform.python_version()}，校准循环 {calibration:,.0f} 次/秒，单位：次/秒")
+    print_results(results, baseline, calibration)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'calibration': calibration,
+                'scores': {key: value / calibration for key, value in sorted(results.items())
+                           if key.split('/')[0] in BUILTIN_CODECS}
+            }, f, indent=2, sort_keys=True)
+        print(f"基准已保存到 {args.baseline}")
+
+    if args.check:
+        if baseline is None:
+            print(f"没有基准文件 {args.baseline}，请先运行 --save-baseline")
+            sys.exit(2)
+        regressions, warnings = compare(results, calibration, baseline, args.tolerance)
+        for line in warnings:
+            print(f"  警告 {line}")
+        if regressions:
+            print(f"性能回退（低于基准 {1 - args.tolerance:.0%}）:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("所有项目均未低于基准")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+消息分发基准测试
+测量一条已解码的消息从进入分发到调用处理器的开销（处理器本身为空操作）：
+- server/legacy：原来的方式，每条消息按标签拼接计数器键、以枚举为键查找延迟直方图、
+  计时，再经过观战者判断和 if/elif 链找到处理器
+- server/router：MessageRouter 按类型编号查表，计数、校验、观战者和延迟是预先合并的钩子，
+  以该连接的 client_info 为上下文调用
+两种方式都不包含操作超时定时器（现在由 dispatch_frame 记录 last_seen，不在分发路径中），
+差距只来自分发方式本身。
+- client/legacy：以 MessageType 为键的字典查找处理器
+- client/router：MessageRouter 查表
+消息按服务器实际收到的比例混合（STATE_ACK 最多，其次是心跳和掷骰）。
+
+用法：
+    python -m benchmarks.bench_routing
+    python -m benchmarks.bench_routing --check       # 分发表比原来的方式慢时以状态1退出
+"""
+
+import argparse
+import os
+import platform
+import socket
+import sys
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_codec import measure
+from network.protocol import NetworkMessage, MessageType
+from network.routing import MessageRouter
+from network.server import GameServer
+
+# 客户端发给服务器的消息比例
+SERVER_PROFILE = {
+    MessageType.STATE_ACK: 50,
+    MessageType.PING: 20,
+    MessageType.DICE_ROLL: 15,
+    MessageType.EFFECT_DICE_ROLL: 10,
+    MessageType.AI_TURN_START: 5,
+}
+# 服务器发给客户端的消息比例
+CLIENT_PROFILE = {
+    MessageType.GAME_STATE: 55,
+    MessageType.PONG: 20,
+    MessageType.DICE_ROLL: 12,
+    MessageType.EFFECT_DICE_ROLL: 8,
+    MessageType.PLAYER_JOINED: 3,
+    MessageType.AI_TAKEOVER: 2,
+}
+BATCH = 100  # 每次测量分发的消息数
+
+def message_mix(profile: Dict[MessageType, int]) -> List[NetworkMessage]:
+    """按比例生成 BATCH 条消息（交错排列，避免同类型连续出现）"""
+    total = sum(profile.values())
+    pool = []
+    for msg_type, weight in profile.items():
+        pool += [NetworkMessage(msg_type, {'version': 1, 'player_id': 'player_0'})
+                 for _ in range(BATCH * weight // total)]
+    return pool[::2] + pool[1::2]
+
+class BenchServer(GameServer):
+    """处理器全部为空操作的服务器，只测量分发本身"""
+
+    def handle_join_room(self, client_socket, player_id, data):
+        pass
+
+    def handle_start_game(self, player_id):
+        pass
+
+    def handle_dice_roll(self, player_id, data):
+        pass
+
+    def handle_effect_dice_roll(self, player_id, data):
+        pass
+
+    def handle_ai_turn_start(self, player_id, data):
+        pass
+
+    def handle_state_ack(self, client_socket, player_id, data):
+        pass
+
+    def handle_ping(self, client_socket, data):
+        pass
+
+def legacy_server_dispatch(server: GameServer, latencies: dict) -> Callable:
+    """原来的分发方式（与改用分发表之前的 dispatch_frame/process_message 相同的步骤）"""
+    def dispatch(client_socket, player_id, message):
+        msg_type = message.type
+        server.metrics.inc('messages_in', type=msg_type.value)
+        latency = latencies.get(msg_type)
+        if latency is None:
+            latency = latencies[msg_type] = server.metrics.histogram('handler_latency_seconds', type=msg_type.value)
+        start = time.perf_counter()
+        try:
+            data = message.data
+            player_id = server.resolve_player_id(client_socket, player_id)
+            client_info = server.clients.get(client_socket)
+            if client_info and client_info['spectating']:
+                return
+            if msg_type == MessageType.JOIN_ROOM:
+                server.handle_join_room(client_socket, player_id, data)
+            elif msg_type == MessageType.START_GAME:
+                server.handle_start_game(player_id)
+            elif msg_type == MessageType.DICE_ROLL:
+                server.handle_dice_roll(player_id, data)
+            elif msg_type == MessageType.EFFECT_DICE_ROLL:
+                server.handle_effect_dice_roll(player_id, data)
+            elif msg_type == MessageType.AI_TURN_START:
+                server.handle_ai_turn_start(player_id, data)
+            elif msg_type == MessageType.STATE_ACK:
+                server.handle_state_ack(client_socket, player_id, data)
+            elif msg_type == MessageType.PING:
+                server.handle_ping(client_socket, data)
+        finally:
+            latency.observe(time.perf_counter() - start)
+    return dispatch
+
+def run_suite(min_time: float, repeat: int) -> Dict[str, float]:
+    """返回 '端/方式' -> 每条消息的耗时（纳秒）"""
+    results = {}
+    server = BenchServer('127.0.0.1', 0)
+    client_socket, peer = socket.socketpair()
+    player_id = server.register_client(client_socket, ('127.0.0.1', 0))
+    server_messages = message_mix(SERVER_PROFILE)
+
+    legacy = legacy_server_dispatch(server, {})
+    def server_legacy():
+        for message in server_messages:
+            legacy(client_socket, player_id, message)
+
+    process_message = server.process_message
+    def server_router():
+        for message in server_messages:
+            process_message(client_socket, player_id, message)
+
+    # 客户端：处理器为空操作
+    client_messages = message_mix(CLIENT_PROFILE)
+    noop = lambda data: None
+    handlers = {msg_type: noop for msg_type in CLIENT_PROFILE}
+    router = MessageRouter()
+    for msg_type in CLIENT_PROFILE:
+        router.register(msg_type, noop)
+
+    def client_legacy():
+        for message in client_messages:
+            handler = handlers.get(message.type)
+            if handler:
+                handler(message.data)
+
+    route = router.dispatch
+    def client_router():
+        for message in client_messages:
+            route(message)
+
+    cases = (('server/legacy', server_legacy, len(server_messages)),
+             ('server/router', server_router, len(server_messages)),
+             ('client/legacy', client_legacy, len(client_messages)),
+             ('client/router', client_router, len(client_messages)))
+    # 各方式轮流测量，机器负载的波动对两种方式的影响相同
+    for _ in range(repeat):
+        for name, func, count in cases:
+            elapsed = 1e9 / (measure(func, min_time, 1) * count)
+            results[name] = min(results.get(name, elapsed), elapsed)
+
+    server.scheduler.clear()
+    client_socket.close()
+    peer.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="消息分发基准测试")
+    parser.add_argument('--time', type=float, default=0.2, help="每项测量的最短时间（秒）")
+    parser.add_argument('--repeat', type=int, default=5, help="每项重复测量次数（取最快）")
+    parser.add_argument('--check', action='store_true', help="分发表比原来的方式慢时以状态1退出")
+    args = parser.parse_args()
+
+    results = run_suite(args.time, args.repeat)
+    print(f"Python {platform.python_version()}，单位：纳秒/条消息")
+    print(f"{'':<10}{'legacy':>12}{'router':>12}{'加速':>10}")
+    slower = []
+    for side in ('server', 'client'):
+        legacy, router = results[f'{side}/legacy'], results[f'{side}/router']
+        print(f"{side:<10}{legacy:>12.0f}{router:>12.0f}{legacy / router:>9.2f}x")
+        if router > legacy:
+            slower.append(side)
+
+    if args.check and slower:
+        print(f"分发表比原来的方式慢: {', '.join(slower)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+多进程房间分片基准测试
+按不同的工作进程数启动 start_server.py，由多个客户端进程同时进行4人房间对局：
+每个房间所有玩家加入、房主开始游戏、每名玩家轮流发送若干次骰子消息，
+直到每条骰子消息都被其余3名玩家收到为止。输出每种工作进程数下每秒完成的房间数。
+
+用法：
+    python -m benchmarks.bench_sharding --workers 1 2 4 --rooms 200
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.protocol import NetworkMessage, MessageType
+from network.codec import SUPPORTED_CODECS
+from network.framing import FrameDecoder, encode_message, decode_message
+
+PLAYERS_PER_ROOM = 4
+
+class BenchClient:
+    """最小化的阻塞客户端"""
+
+    def __init__(self, port: int):
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.decoder = FrameDecoder()
+        self.pending = []
+        self.codec = 'json'
+
+    def send(self, message: NetworkMessage):
+        self.sock.sendall(encode_message(message, self.codec))
+
+    def receive(self) -> NetworkMessage:
+        while not self.pending:
+            frames = self.decoder.recv_from(self.sock)
+            if frames is None:
+                raise ConnectionError("服务器关闭了连接")
+            self.pending.extend(frames)
+        return decode_message(self.pending.pop(0))
+
+    def wait_for(self, msg_type: MessageType) -> NetworkMessage:
+        while True:
+            message = self.receive()
+            if message and message.type == msg_type:
+                return message
+
+    def close(self):
+        self.sock.close()
+
+def play_room(port: int, room_id: str, rolls: int):
+    """完成一个房间的对局"""
+    clients = []
+    for index in range(PLAYERS_PER_ROOM):
+        client = BenchClient(port)
+        client.send(NetworkMessage(MessageType.JOIN_ROOM, {
+            'player_name': f'bench{index}',
+            'room_id': room_id,
+            'version': '1.0.0',
+            'codecs': SUPPORTED_CODECS
+        }))
+        joined = client.wait_for(MessageType.JOIN_SUCCESS)
+        client.codec = joined.data.get('codec', 'json')
+        client.player_id = joined.data['player_id']
+        client.slot = joined.data['slot']
+        clients.append(client)
+
+    clients[0].send(NetworkMessage(MessageType.START_GAME))
+    for client in clients:
+        client.wait_for(MessageType.GAME_STARTED)
+
+    for _ in range(rolls):
+        for sender in clients:
+            sender.send(NetworkMessage(MessageType.DICE_ROLL, {
+                'dice_result': 3,
+                'player_id': sender.player_id,
+                'player_slot': sender.slot
+            }))
+            for receiver in clients:
+                if receiver is not sender:
+                    receiver.wait_for(MessageType.DICE_ROLL)
+
+    for client in clients:
+        client.close()
+
+def run_client_process(port: int, process_index: int, rooms: int, rolls: int):
+    """客户端进程：依次完成分配给它的房间"""
+    for room_index in range(rooms):
+        play_room(port, f'bench_{process_index}_{room_index}', rolls)
+
+def wait_for_port(port: int, timeout: float = 10.0):
+    """等待服务器开始监听"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"服务器没有在 {timeout} 秒内启动")
+
+def bench(workers: int, port: int, rooms: int, rolls: int, client_processes: int) -> float:
+    """按指定工作进程数运行一次测试，返回每秒完成的房间数"""
+    server_script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'start_server.py')
+    server = subprocess.Popen([sys.executable, server_script, '--mode', 'eventloop',
+                               '--workers', str(workers), '--port', str(port),
+                               '--no-rate-limit', '--accept-rate', 'off'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        rooms_per_process = max(1, rooms // client_processes)
+        processes = [multiprocessing.Process(target=run_client_process,
+                                             args=(port, index, rooms_per_process, rolls))
+                     for index in range(client_processes)]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+        failed = sum(1 for process in processes if process.exitcode != 0)
+        if failed:
+            print(f"  警告: {failed} 个客户端进程异常退出")
+        return rooms_per_process * client_processes / elapsed
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程房间分片基准测试")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="要测试的工作进程数")
+    parser.add_argument('--rooms', type=int, default=200, help="每次测试的房间总数")
+    parser.add_argument('--rolls', type=int, default=20, help="每名玩家发送的骰子消息数")
+    parser.add_argument('--clients', type=int, default=os.cpu_count() or 4, help="客户端进程数")
+    parser.add_argument('--port', type=int, default=29288, help="测试使用的起始端口")
+    args = parser.parse_args()
+
+    print(f"CPU核心数: {os.cpu_count()}，房间数: {args.rooms}，每人骰子数: {args.rolls}，"
+          f"客户端进程数: {args.clients}")
+    baseline = None
+    for offset, workers in enumerate(args.workers):
+        rate = bench(workers, args.port + offset, args.rooms, args.rolls, args.clients)
+        baseline = baseline or rate
+        print(f"工作进程 {workers}: {rate:.1f} 房间/秒 (相对加速 {rate / baseline:.2f}x)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,476 @@
+"""
+无界面压力测试
+在一个进程里用单个 selectors 事件循环驱动大量协议机器人（每个机器人只是一个非阻塞socket和少量状态，
+不创建线程）。机器人加入房间、房主开始游戏、轮到自己时发送 DICE_ROLL / EFFECT_DICE_ROLL，
+并定期发送心跳。默认在子进程中启动本地服务器（start_server.py），以便单独测量服务器内存。
+
+输出：
+- 连接容量：成功加入房间的机器人数、连接失败数、加入耗时
+- 每秒收发消息数
+- 心跳往返延迟和操作延迟（发送骰子请求到收到服务器广播结果）的 p50 / p99
+- 服务器常驻内存（RSS，仅Linux；分片模式包含所有工作进程）
+
+用法：
+    python -m benchmarks.load_test --bots 2000 --duration 30 --mode eventloop
+    python -m benchmarks.load_test --bots 500 --workers 2 --json result.json
+    python -m benchmarks.load_test --port 29188 --server-pid 1234   # 测试已经运行的服务器
+"""
+
+import argparse
+import errno
+import heapq
+import itertools
+import json
+import os
+import random
+import selectors
+import socket
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.protocol import NetworkMessage, MessageType
+from network.codec import CODEC_JSON, SUPPORTED_CODECS
+from network.framing import FrameDecoder, FrameError, encode_message, decode_message
+from network.state_sync import StateReceiver
+from network.server import SERVER_VERSION
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+class Bot:
+    """单个协议机器人"""
+
+    def __init__(self, index: int, room_id: str):
+        self.index = index
+        self.name = f'bot{index}'
+        self.room_id = room_id
+        self.sock: Optional[socket.socket] = None
+        self.decoder = FrameDecoder()
+        self.outbuf = bytearray()
+        self.events = 0
+        self.codec = CODEC_JSON
+        self.connected = False
+        self.joined = False
+        self.closed = False
+        self.player_id: Optional[str] = None
+        self.slot: Optional[int] = None
+        self.is_host = False
+        self.connect_started = 0.0
+        self.receiver = StateReceiver()
+        self.current_player: Optional[int] = None
+        self.game_over = False
+        self.rolled = False  # 本回合已投过移动骰子，下一步是效果骰子
+        self.action_pending = False  # 已安排或已发送本回合的操作
+        self.action_sent_at: Optional[float] = None
+        self.ping_sent_at: Optional[float] = None
+
+class LoadGenerator:
+    """驱动所有机器人的事件循环"""
+
+    def __init__(self, host: str, port: int, bots: int, room_size: int, connect_rate: float,
+                 think_time: float, ping_interval: float, duration: float):
+        self.host = host
+        self.port = port
+        self.room_size = room_size
+        self.connect_rate = connect_rate
+        self.think_time = think_time
+        self.ping_interval = ping_interval
+        self.duration = duration
+        self.selector = selectors.DefaultSelector()
+        self.timers = []  # (时间, 序号, 回调, 参数)
+        self.sequence = itertools.count()
+        self.bots: List[Bot] = [Bot(i, f'load_{i // room_size}') for i in range(bots)]
+        self.rooms = {}  # room_id -> 已加入的机器人列表
+
+        self.connect_failures = 0
+        self.connect_errors = {}  # 错误名 -> 次数
+        self.join_failures = 0
+        self.disconnects = 0
+        self.join_times: List[float] = []
+        self.ping_rtts: List[float] = []
+        self.action_latencies: List[float] = []
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.bytes_received = 0
+        self.per_second = []  # (秒, 收到的消息数, 发出的消息数)
+        self.rss_samples: List[int] = []
+
+    # ---- 定时任务 ----
+
+    def call_later(self, delay: float, callback, *args):
+        heapq.heappush(self.timers, (time.monotonic() + delay, next(self.sequence), callback, args))
+
+    def run_timers(self, now: float):
+        while self.timers and self.timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self.timers)
+            callback(*args)
+
+    # ---- 连接和发送 ----
+
+    def connect(self, bot: Bot):
+        """发起非阻塞连接"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        bot.sock = sock
+        bot.connect_started = time.perf_counter()
+        result = sock.connect_ex((self.host, self.port))
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.fail_connect(bot, errno.errorcode.get(result, str(result)))
+            return
+        bot.events = selectors.EVENT_WRITE
+        self.selector.register(sock, bot.events, bot)
+
+    def fail_connect(self, bot: Bot, reason: str):
+        self.connect_failures += 1
+        self.connect_errors[reason] = self.connect_errors.get(reason, 0) + 1
+        self.close_bot(bot)
+
+    def on_connected(self, bot: Bot):
+        error = bot.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            self.fail_connect(bot, errno.errorcode.get(error, str(error)))
+            return
+        bot.connected = True
+        self.send(bot, NetworkMessage(MessageType.JOIN_ROOM, {
+            'player_name': bot.name,
+            'room_id': bot.room_id,
+            'version': SERVER_VERSION,
+            'codecs': SUPPORTED_CODECS,
+            'authoritative': True
+        }))
+        self.update_events(bot)
+
+    def send(self, bot: Bot, message: NetworkMessage):
+        if bot.closed:
+            return
+        bot.outbuf += encode_message(message, bot.codec)
+        self.messages_sent += 1
+        self.flush(bot)
+
+    def flush(self, bot: Bot):
+        try:
+            while bot.outbuf:
+                sent = bot.sock.send(bot.outbuf)
+                del bot.outbuf[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self.lose_bot(bot)
+            return
+        self.update_events(bot)
+
+    def update_events(self, bot: Bot):
+        if bot.closed or not bot.connected:
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if bot.outbuf else 0)
+        if events != bot.events:
+            self.selector.modify(bot.sock, events, bot)
+            bot.events = events
+
+    def close_bot(self, bot: Bot):
+        if bot.closed:
+            return
+        bot.closed = True
+        if bot.sock:
+            try:
+                self.selector.unregister(bot.sock)
+            except (KeyError, ValueError):
+                pass
+            bot.sock.close()
+
+    def lose_bot(self, bot: Bot):
+        """连接意外断开"""
+        if not bot.closed:
+            self.disconnects += 1
+            self.close_bot(bot)
+
+    # ---- 接收和协议处理 ----
+
+    def on_readable(self, bot: Bot):
+        try:
+            frames = bot.decoder.recv_from(bot.sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, FrameError):
+            frames = None
+        if frames is None:
+            self.lose_bot(bot)
+            return
+        for frame in frames:
+            self.bytes_received += len(frame)
+            message = decode_message(frame)
+            if message:
+                self.messages_received += 1
+                self.handle_message(bot, message)
+
+    def handle_message(self, bot: Bot, message: NetworkMessage):
+        msg_type = message.type
+        data = message.data
+        if msg_type == MessageType.JOIN_SUCCESS:
+            bot.joined = True
+            bot.player_id = data['player_id']
+            bot.slot = data['slot']
+            bot.codec = data.get('codec', CODEC_JSON)
+            bot.is_host = data['is_host']
+            self.join_times.append(time.perf_counter() - bot.connect_started)
+            members = self.rooms.setdefault(bot.room_id, [])
+            members.append(bot)
+            if len(members) == self.room_size:
+                for member in members:
+                    if member.is_host:
+                        self.send(member, NetworkMessage(MessageType.START_GAME))
+            self.call_later(random.uniform(0, self.ping_interval), self.ping, bot)
+        elif msg_type == MessageType.JOIN_FAILED:
+            self.join_failures += 1
+            self.close_bot(bot)
+        elif msg_type == MessageType.PONG:
+            if bot.ping_sent_at is not None:
+                self.ping_rtts.append(time.perf_counter() - bot.ping_sent_at)
+                bot.ping_sent_at = None
+        elif msg_type == MessageType.GAME_STATE:
+            state = bot.receiver.apply(data)
+            version = data.get('version') if state is not None else None
+            self.send(bot, NetworkMessage(MessageType.STATE_ACK, {'version': version}))
+            if state is not None:
+                self.on_state(bot, state)
+        elif msg_type in (MessageType.DICE_ROLL, MessageType.EFFECT_DICE_ROLL):
+            if data.get('player_slot') == bot.slot and bot.action_sent_at is not None:
+                self.action_latencies.append(time.perf_counter() - bot.action_sent_at)
+                bot.action_sent_at = None
+                bot.action_pending = False
+                bot.rolled = msg_type == MessageType.DICE_ROLL
+
+    def on_state(self, bot: Bot, state: dict):
+        """根据服务器状态决定是否轮到自己操作"""
+        bot.game_over = state.get('game_over', False)
+        current = state.get('current_player')
+        if current != bot.current_player:
+            bot.current_player = current
+            bot.rolled = False
+            bot.action_pending = False
+        if current == bot.slot and not bot.game_over and not bot.action_pending:
+            bot.action_pending = True
+            self.call_later(self.think_time, self.act, bot)
+
+    def act(self, bot: Bot):
+        """发送移动骰子或效果骰子请求（点数由服务器决定）"""
+        if bot.closed or bot.game_over or bot.current_player != bot.slot:
+            return
+        msg_type = MessageType.EFFECT_DICE_ROLL if bot.rolled else MessageType.DICE_ROLL
+        bot.action_sent_at = time.perf_counter()
+        self.send(bot, NetworkMessage(msg_type, {'player_id': bot.player_id, 'player_slot': bot.slot}))
+
+    def ping(self, bot: Bot):
+        if bot.closed:
+            return
+        if bot.ping_sent_at is None:
+            bot.ping_sent_at = time.perf_counter()
+            self.send(bot, NetworkMessage(MessageType.PING))
+        self.call_later(self.ping_interval, self.ping, bot)
+
+    # ---- 主循环 ----
+
+    def run(self, rss_reader=None):
+        """建立连接并运行到测试时间结束"""
+        interval = 1.0 / self.connect_rate if self.connect_rate > 0 else 0.0
+        for order, bot in enumerate(self.bots):
+            self.call_later(order * interval, self.connect, bot)
+
+        started = time.monotonic()
+        deadline = started + self.duration
+        next_sample = started + 1.0
+        last_received, last_sent = 0, 0
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            timeout = min(deadline, next_sample) - now
+            if self.timers:
+                timeout = min(timeout, max(0.0, self.timers[0][0] - now))
+            for key, mask in self.selector.select(timeout):
+                bot = key.data
+                if bot.closed:
+                    continue
+                if not bot.connected:
+                    self.on_connected(bot)
+                    continue
+                if mask & selectors.EVENT_WRITE:
+                    self.flush(bot)
+                if mask & selectors.EVENT_READ and not bot.closed:
+                    self.on_readable(bot)
+            now = time.monotonic()
+            self.run_timers(now)
+            if now >= next_sample:
+                self.per_second.append((int(now - started), self.messages_received - last_received,
+                                        self.messages_sent - last_sent))
+                last_received, last_sent = self.messages_received, self.messages_sent
+                if rss_reader:
+                    rss = rss_reader()
+                    if rss is not None:
+                        self.rss_samples.append(rss)
+                next_sample += 1.0
+
+        for bot in self.bots:
+            self.close_bot(bot)
+        self.selector.close()
+
+    def report(self) -> dict:
+        """汇总结果"""
+        joined = sum(1 for bot in self.bots if bot.joined)
+        # 跳过连接阶段，按稳定阶段计算每秒消息数
+        steady = self.per_second[len(self.per_second) // 4:] or self.per_second
+        return {
+            'bots': len(self.bots),
+            'joined': joined,
+            'connect_failures': self.connect_failures,
+            'connect_errors': self.connect_errors,
+            'join_failures': self.join_failures,
+            'disconnects': self.disconnects,
+            'join_time_p50_ms': percentile(self.join_times, 50) * 1000,
+            'join_time_p99_ms': percentile(self.join_times, 99) * 1000,
+            'messages_received_per_second': sum(r for _, r, _ in steady) / max(1, len(steady)),
+            'messages_sent_per_second': sum(s for _, _, s in steady) / max(1, len(steady)),
+            'messages_received': self.messages_received,
+            'messages_sent': self.messages_sent,
+            'bytes_received': self.bytes_received,
+            'ping_rtt_p50_ms': percentile(self.ping_rtts, 50) * 1000,
+            'ping_rtt_p99_ms': percentile(self.ping_rtts, 99) * 1000,
+            'action_latency_p50_ms': percentile(self.action_latencies, 50) * 1000,
+            'action_latency_p99_ms': percentile(self.action_latencies, 99) * 1000,
+            'actions': len(self.action_latencies),
+            'server_rss_peak_mb': max(self.rss_samples) / 1024 / 1024 if self.rss_samples else None,
+            'server_rss_final_mb': self.rss_samples[-1] / 1024 / 1024 if self.rss_samples else None
+        }
+
+def percentile(values: List[float], p: float) -> float:
+    """最近秩法计算百分位数（没有数据时返回0）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def read_rss(pid: int) -> Optional[int]:
+    """读取进程及其子进程（分片工作进程）的常驻内存字节数，仅支持Linux"""
+    total = 0
+    pids = [pid]
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    for process_id in pids:
+        try:
+            with open(f'/proc/{process_id}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            if process_id == pid:
+                return None
+    return total
+
+def raise_fd_limit(wanted: int):
+    """尽量提高打开文件数限制（每个机器人一个socket）"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+    if soft != resource.RLIM_INFINITY and soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
+
+def wait_for_port(host: str, port: int, timeout: float = 10.0):
+    """等待服务器开始监听"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"服务器没有在 {timeout} 秒内启动")
+
+def start_local_server(args) -> subprocess.Popen:
+    """在子进程中启动本地服务器"""
+    server_script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'start_server.py')
+    command = [sys.executable, server_script, '--mode', args.mode, '--port', str(args.port),
+               '--workers', str(args.workers), '--accept-rate', 'off']
+    # 服务器进程同样需要足够的文件描述符
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              preexec_fn=(lambda: raise_fd_limit(args.bots + 1024)) if resource else None)
+    wait_for_port('127.0.0.1', args.port)
+    return server
+
+def print_report(result: dict):
+    errors = f" {result['connect_errors']}" if result['connect_errors'] else ''
+    print(f"机器人: {result['bots']}，成功加入: {result['joined']}，连接失败: {result['connect_failures']}{errors}"
+          f"，加入失败: {result['join_failures']}，意外断开: {result['disconnects']}")
+    print(f"加入耗时: p50 {result['join_time_p50_ms']:.1f}ms, p99 {result['join_time_p99_ms']:.1f}ms")
+    print(f"消息/秒: 接收 {result['messages_received_per_second']:.0f}, 发送 {result['messages_sent_per_second']:.0f}"
+          f"（共接收 {result['messages_received']} 条, {result['bytes_received']} 字节）")
+    print(f"心跳往返: p50 {result['ping_rtt_p50_ms']:.2f}ms, p99 {result['ping_rtt_p99_ms']:.2f}ms")
+    print(f"操作延迟: p50 {result['action_latency_p50_ms']:.2f}ms, p99 {result['action_latency_p99_ms']:.2f}ms"
+          f"（{result['actions']} 次操作）")
+    if result['server_rss_peak_mb'] is not None:
+        print(f"服务器内存: 峰值 {result['server_rss_peak_mb']:.1f}MB, 结束时 {result['server_rss_final_mb']:.1f}MB")
+    else:
+        print("服务器内存: 不可用（需要Linux并提供服务器进程）")
+
+def main():
+    parser = argparse.ArgumentParser(description="无界面压力测试")
+    parser.add_argument('--bots', type=int, default=1000, help="机器人数量")
+    parser.add_argument('--room-size', type=int, default=4, choices=[1, 2, 3, 4],
+                        help="每个房间的机器人数（其余槽位由服务器AI填充）")
+    parser.add_argument('--duration', type=float, default=30.0, help="测试时长（秒，包含连接阶段）")
+    parser.add_argument('--connect-rate', type=float, default=500.0, help="每秒发起的连接数")
+    parser.add_argument('--think-time', type=float, default=0.05, help="轮到机器人后等待多久再操作（秒）")
+    parser.add_argument('--ping-interval', type=float, default=5.0, help="心跳间隔（秒）")
+    parser.add_argument('--mode', choices=['thread', 'eventloop'], default='eventloop', help="本地服务器模式")
+    parser.add_argument('--workers', type=int, default=1, help="本地服务器工作进程数")
+    parser.add_argument('--host', default='127.0.0.1', help="服务器地址")
+    parser.add_argument('--port', type=int, default=29388, help="服务器端口")
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help="测试已运行的服务器时提供其进程号以测量内存（不再启动本地服务器）")
+    parser.add_argument('--external', action='store_true', help="连接已运行的服务器，不启动本地服务器")
+    parser.add_argument('--json', default=None, help="把结果写入JSON文件，便于比较不同版本")
+    args = parser.parse_args()
+
+    raise_fd_limit(args.bots + 1024)
+    server = None
+    server_pid = args.server_pid
+    if server_pid is None and not args.external:
+        server = start_local_server(args)
+        server_pid = server.pid
+
+    print(f"服务器: {args.host}:{args.port}，机器人: {args.bots}，每房间 {args.room_size} 人，"
+          f"时长 {args.duration:.0f} 秒")
+    generator = LoadGenerator(args.host, args.port, args.bots, args.room_size, args.connect_rate,
+                              args.think_time, args.ping_interval, args.duration)
+    try:
+        generator.run((lambda: read_rss(server_pid)) if server_pid else None)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    result = generator.report()
+    result['config'] = vars(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,6 @@
 游戏棋盘逻辑
 """
 
-import pygame
 import math
 from models.game_cell import GameCell
 from models.constants import GRID_SIZE, WINDOW_WIDTH, WINDOW_HEIGHT
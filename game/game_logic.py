@@ -3,7 +3,6 @@
 """
 
 import random
-import pygame
 from models.player import Player
 from models.constants import WINNING_MONEY
 
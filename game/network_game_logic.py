@@ -16,6 +16,7 @@ class NetworkGameLogic(GameLogic):
         self.network_client = network_client
         self.player_slot = player_slot  # 本地玩家的槽位
         self.network_players = {}  # slot -> network_id 映射
+        self.authoritative = False  # 服务器权威模式：骰子和AI回合由服务器决定
         
     def setup_network_players(self, room_players):
         """根据房间玩家信息设置网络玩家"""
@@ -59,7 +60,9 @@ class NetworkGameLogic(GameLogic):
     
     def should_ai_act_locally(self):
         """判断AI是否应该在本地执行操作"""
-        # 只有房主才执行AI操作
+        # 服务器权威模式下AI由服务器执行；否则只有房主才执行AI操作
+        if self.authoritative:
+            return False
         if self.is_host():
             # 房主判断当前回合是否是AI
             current_player = self.get_current_player()
@@ -94,11 +97,18 @@ class NetworkGameLogic(GameLogic):
     
     def sync_game_state(self, game_state):
         """同步游戏状态"""
+        players = game_state.get('players', [])
+        # 服务器的状态以槽位字符串为键
+        if isinstance(players, dict):
+            players = [players[key] for key in sorted(players, key=int)]
+        
         # 更新玩家位置和金币
-        for i, player_data in enumerate(game_state.get('players', [])):
+        for i, player_data in enumerate(players):
             if i < len(self.players):
                 self.players[i].position = player_data['position']
                 self.players[i].money = player_data['money']
+                if 'is_ai' in player_data:
+                    self.players[i].is_ai = player_data['is_ai']
         
         # 更新当前玩家
         self.current_player = game_state.get('current_player', 0)
@@ -129,7 +139,7 @@ class NetworkGameLogic(GameLogic):
         super().next_turn()  # 调用父类的next_turn来切换current_player
 
         # 在网络模式下，如果轮到AI玩家且本地是房主，通知服务器
-        if self.network_client and self.is_host():
+        if self.network_client and self.is_host() and not self.authoritative:
             current_player_obj = self.get_current_player()
             if current_player_obj.is_ai:
                 # 发送消息给服务器，指示AI回合开始
@@ -0,0 +1,183 @@
+"""
+服务器端游戏逻辑
+在服务器上为每个房间运行无界面的游戏规则：骰子、格子效果、回合切换和AI回合都由服务器决定，
+客户端只发送操作意图，并按服务器广播的结果播放动画。
+"""
+
+from .game_logic import GameLogic
+from .board import Board
+from models.player import Player
+
+# 与客户端动画节奏对应的时间（秒），服务器据此安排AI的下一步操作，
+# 使AI不会在客户端还在播放上一步动画时就行动
+AI_THINK_DELAY = 1.0  # 回合开始到AI投骰子
+MOVE_STEP_TIME = 0.85  # 每移动一格的动画时间
+AFTER_MOVE_DELAY = 0.8  # 移动结束到投效果骰子或切换回合
+AFTER_EFFECT_DELAY = 2.0  # 效果骰子结算后到切换回合
+
+class ServerGameLogic(GameLogic):
+    """服务器端权威游戏逻辑"""
+
+    def __init__(self):
+        """初始化服务器端游戏逻辑"""
+        super().__init__()
+        self.board = Board()
+        self.slot_players = {}  # slot -> player_id（真实玩家）
+        self.turn = 0  # 已进行的回合数（房间消息日志按回合建立索引）
+
+    def setup_players(self, room_players):
+        """
+        根据房间玩家信息设置玩家，空余槽位由AI填充
+
+        Args:
+            room_players (list): 房间玩家信息列表（包含 id、name、slot）
+        """
+        by_slot = {info['slot']: info for info in room_players}
+        self.players = []
+        self.slot_players = {}
+        for i in range(4):
+            if i in by_slot:
+                player = Player(i, is_ai=False)
+                player.name = by_slot[i]['name']
+                player.network_id = by_slot[i]['id']
+                self.slot_players[i] = by_slot[i]['id']
+            else:
+                player = Player(i, is_ai=True)
+            self.players.append(player)
+
+    def next_turn(self):
+        """切换到下一个玩家并累计回合数"""
+        if not self.game_over:
+            self.turn += 1
+        super().next_turn()
+
+    def is_waiting_for_move(self, slot):
+        """是否正在等待该槽位投移动骰子"""
+        return not self.game_over and not self.effect_type and slot == self.current_player
+
+    def is_waiting_for_effect(self, slot):
+        """是否正在等待该槽位投效果骰子"""
+        return not self.game_over and bool(self.effect_type) and slot == self.current_player
+
+    def is_ai_turn(self):
+        """当前回合是否由服务器代为操作"""
+        return not self.game_over and self.get_current_player().is_ai
+
+    def set_player_ai(self, slot):
+        """由AI接管指定槽位的玩家"""
+        if 0 <= slot < len(self.players):
+            self.players[slot].is_ai = True
+
+    def set_player_human(self, slot):
+        """重连的玩家从AI手中收回槽位"""
+        if 0 <= slot < len(self.players):
+            self.players[slot].is_ai = False
+
+    def roll_move(self):
+        """
+        为当前玩家投移动骰子、移动并结算到达的格子
+
+        Returns:
+            tuple: (dice_result, effect_type) 骰子点数和到达格子的效果类型
+        """
+        player = self.get_current_player()
+        self.clear_dice_results()
+        dice_result = self.dice_result = self.roll_dice()
+        player.move(dice_result)
+
+        effect_type, self.message = self.handle_cell_effect(player, self.board)
+        if effect_type in ('reward', 'penalty'):
+            # 奖励和丢弃格都需要再投效果骰子（AI也由服务器等待后代投）
+            self.waiting_for_effect_dice = True
+        else:
+            self.effect_type = ""
+            self.next_turn()  # 会清除 dice_result
+        return dice_result, effect_type
+
+    def roll_effect(self):
+        """
+        为当前玩家投效果骰子、结算效果并切换到下一回合
+
+        Returns:
+            int: 效果骰子点数
+        """
+        effect_result = self.roll_effect_dice()
+        self.next_turn()
+        return effect_result
+
+    def get_game_state(self):
+        """获取当前游戏状态（玩家以槽位字符串为键，便于增量同步）"""
+        return {
+            'players': {
+                str(p.id): {'name': p.name, 'position': p.position, 'money': p.money, 'is_ai': p.is_ai}
+                for p in self.players
+            },
+            'current_player': self.current_player,
+            'game_over': self.game_over,
+            'winner': self.winner.id if self.winner else None
+        }
+
+    def export_state(self):
+        """导出恢复游戏所需的全部状态（可直接序列化为JSON，用于服务器崩溃后恢复房间）"""
+        return {
+            'players': [{
+                'name': p.name,
+                'position': p.position,
+                'money': p.money,
+                'is_ai': p.is_ai,
+                'network_id': p.network_id
+            } for p in self.players],
+            'current_player': self.current_player,
+            'game_over': self.game_over,
+            'winner': self.winner.id if self.winner else None,
+            'dice_result': self.dice_result,
+            'effect_dice_result': self.effect_dice_result,
+            'waiting_for_effect_dice': self.waiting_for_effect_dice,
+            'effect_type': self.effect_type,
+            'message': self.message,
+            'turn': self.turn,
+            'slot_players': {str(slot): player_id for slot, player_id in self.slot_players.items()}
+        }
+
+    @classmethod
+    def from_state(cls, saved):
+        """从 export_state 导出的状态重建游戏逻辑"""
+        game = cls()
+        game.players = []
+        for slot, info in enumerate(saved['players']):
+            player = Player(slot, is_ai=info['is_ai'])
+            player.name = info['name']
+            player.position = info['position']
+            player.money = info['money']
+            player.network_id = info.get('network_id')
+            game.players.append(player)
+        game.current_player = saved['current_player']
+        game.game_over = saved['game_over']
+        winner = saved.get('winner')
+        game.winner = game.players[winner] if winner is not None else None
+        game.dice_result = saved.get('dice_result', 0)
+        game.effect_dice_result = saved.get('effect_dice_result', 0)
+        game.waiting_for_effect_dice = saved.get('waiting_for_effect_dice', False)
+        game.effect_type = saved.get('effect_type', "")
+        game.message = saved.get('message', "")
+        game.turn = saved.get('turn', 0)
+        game.slot_players = {int(slot): player_id for slot, player_id in saved.get('slot_players', {}).items()}
+        return game
+
+def ai_delay_after_move(dice_result, effect_type):
+    """
+    移动骰子之后，到服务器执行下一步AI操作的时间
+
+    Args:
+        dice_result (int): 移动步数
+        effect_type (str): 到达格子的效果类型
+    """
+    delay = dice_result * MOVE_STEP_TIME + AFTER_MOVE_DELAY
+    if effect_type not in ('reward', 'penalty'):
+        # 已切换到下一回合，下一位AI还需要思考时间
+        delay += AI_THINK_DELAY
+    return delay
+
+def ai_delay_after_effect():
+    """效果骰子之后，到下一位AI投骰子的时间"""
+    return AFTER_EFFECT_DELAY + AI_THINK_DELAY
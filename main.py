@@ -21,6 +21,7 @@ from ui.renderer import Renderer
 from ui.animations import AnimationManager
 from network.client import GameClient
 from network.protocol import MessageType
+from network.discovery import discover_servers, get_local_ip
 from utils.config_manager import config_manager
 
 class MonopolyGame:
@@ -74,10 +75,21 @@ class MonopolyGame:
         self.is_online_game = False
         self.server_process = None
         
+        # 服务器权威模式：服务器广播的骰子结果按顺序在本地空闲时播放
+        self.server_events: List[Dict] = []
+        self.intent_pending = False  # 已向服务器发送操作请求，等待结果
+        
+        # 网络状态浮层（F3切换）：往返延迟、抖动和时钟偏差
+        self.show_network_overlay = False
+        
         # 连接重试相关
         self.connecting_to_server = False
         self.connection_cancelled = False
         
+        # 局域网发现：加入房间界面每隔 DISCOVERY_REFRESH 秒刷新一次服务器列表
+        self.discovered_servers: List[Dict] = []
+        self.discovery_running = False
+        
         # 等待状态相关
         self.waiting_state = None
         self.wait_start_time = 0
@@ -149,7 +161,9 @@ class MonopolyGame:
                     self.handle_results_click(event.pos)
             
             elif event.type == pygame.KEYDOWN:
-                if self.game_state == GAME_STATE_LOBBY and self.input_active:
+                if event.key == pygame.K_F3:
+                    self.show_network_overlay = not self.show_network_overlay
+                elif self.game_state == GAME_STATE_LOBBY and self.input_active:
                     self.handle_text_input(event)
                 elif self.show_nickname_input and self.nickname_input_active:
                     self.handle_nickname_text_input(event)
@@ -201,6 +215,7 @@ class MonopolyGame:
                 self.room_state = "joining"
                 self.input_active = True
                 self.input_text = ""
+                self.start_lan_discovery()
         
         elif self.room_state == "hosting":
             # 如果正在连接服务器，显示取消按钮
@@ -221,6 +236,12 @@ class MonopolyGame:
             connect_button = pygame.Rect(WINDOW_WIDTH//2 - 100, 360, 200, 60)
             if connect_button.collidepoint(pos) and self.input_text:
                 self.connect_to_host(self.input_text)
+            
+            # 局域网中发现的服务器和房间
+            for row_rect, server, room_id, joinable in self.get_lan_server_rows():
+                if row_rect.collidepoint(pos) and joinable:
+                    self.connect_to_host(server['host'], server['port'], room_id)
+                    break
         
         elif self.room_state == "waiting":
             # 开始游戏按钮（仅房主）
@@ -363,27 +384,14 @@ class MonopolyGame:
             self.network_client = None
 
         # 创建网络客户端
-        self.network_client = GameClient()
-        
-        # 获取本机IP地址
-        import socket
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            # 连接到一个公共DNS服务器以获取本机在局域网中的IP
-            # 这不会真的发送数据，只是为了获取getsockname()
-            s.connect(("8.8.8.8", 80)) 
-            local_ip = s.getsockname()[0]
-            s.close()
-        except OSError: # 更具体的异常捕获
-            local_ip = "localhost" # 备选方案
-        except Exception as e: # 其他未知异常
-            print(f"获取IP地址时发生错误: {e}")
-            local_ip = "localhost"
+        self.network_client = GameClient(use_inbox=True)
         
+        # 本机IP仅用于显示；房主总是通过回环地址连接自己启动的服务器
+        local_ip = get_local_ip()
         print(f"start_hosting: 本机IP识别为: {local_ip}")
 
         # 首先尝试直接连接（可能服务器已由其他方式启动或未正确关闭）
-        if self.network_client.connect(local_ip, 29188):
+        if self.network_client.connect("127.0.0.1", 29188):
             print("start_hosting: 直接连接服务器成功。")
             self.network_client.join_room(config_manager.get_nickname(), GAME_VERSION)
             self.is_host = True
@@ -403,8 +411,8 @@ class MonopolyGame:
                 # 创建新的客户端实例用于连接到新启动的服务器
                 if self.network_client: # 再次确保之前的实例已清理
                     self.network_client.disconnect()
-                self.network_client = GameClient()
-                self.attempt_server_connection(local_ip) # 使用新的实例去连接
+                self.network_client = GameClient(use_inbox=True)
+                self.attempt_server_connection("127.0.0.1") # 使用新的实例去连接
             else:
                 print("start_hosting: 启动服务器进程失败。")
                 self.room_state = "menu"
@@ -430,7 +438,7 @@ class MonopolyGame:
                 try:
                     self.network_client.disconnect()
                 except: pass # 忽略可能的错误
-            self.network_client = GameClient()
+            self.network_client = GameClient(use_inbox=True)
             
         # 持有 connection_thread 将要使用的客户端实例引用
         # 防止 self.network_client 在 MonopolyGame 主类中被意外修改
@@ -438,79 +446,67 @@ class MonopolyGame:
         client_for_this_connection_attempt = self.network_client
 
         def connection_thread():
-            max_attempts = 15
-            attempt_interval = 0.5 
+            # 用局域网发现探测等待服务器就绪：服务器开始监听后才会应答，
+            # 就绪后几十毫秒内即可连接，不再每隔0.5秒建立一次TCP连接探测端口
+            max_wait = 7.5
+            probe_timeout = 0.1
+            start_time = time.time()
             
-            print(f"attempt_server_connection: 开始连接线程 (最多 {max_attempts} 次尝试)")
-
-            for attempt in range(max_attempts):
-                if self.connection_cancelled:
-                    print("attempt_server_connection: 连接被用户取消。")
-                    self.connecting_to_server = False
-                    # 如果是因为取消而失败，确保client_for_this_connection_attempt被清理
-                    if client_for_this_connection_attempt:
-                        client_for_this_connection_attempt.disconnect()
-                    # 如果此线程中使用的客户端实例正是 self.network_client，则也清空它
-                    if self.network_client == client_for_this_connection_attempt:
-                        self.network_client = None 
+            print(f"attempt_server_connection: 开始连接线程 (最多等待 {max_wait} 秒)")
+            
+            def cancelled():
+                if not self.connection_cancelled:
+                    return False
+                print("attempt_server_connection: 连接被用户取消。")
+                self.connecting_to_server = False
+                # 如果是因为取消而失败，确保client_for_this_connection_attempt被清理
+                if client_for_this_connection_attempt:
+                    client_for_this_connection_attempt.disconnect()
+                # 如果此线程中使用的客户端实例正是 self.network_client，则也清空它
+                if self.network_client == client_for_this_connection_attempt:
+                    self.network_client = None
+                return True
+            
+            def try_connect():
+                # 使用为此连接尝试保留的客户端实例
+                if not client_for_this_connection_attempt.connect(local_ip, 29188):
+                    # 连接失败时确保断开，下一次 connect 会重新创建socket
+                    client_for_this_connection_attempt.disconnect()
+                    return False
+                print("attempt_server_connection: 连接成功！")
+                # 只有成功连接后，才把这个client实例正式赋值给self.network_client
+                self.network_client = client_for_this_connection_attempt
+                self.network_client.join_room(config_manager.get_nickname(), GAME_VERSION)
+                self.is_host = True
+                self.room_state = "waiting"
+                self.connecting_to_server = False
+                self.setup_network_handlers()
+                self.error_message = "" # 清除连接进度消息
+                return True
+            
+            while time.time() - start_time < max_wait:
+                if cancelled():
                     return
                 
-                progress_msg = f"正在连接服务器... ({attempt + 1}/{max_attempts})"
-                self.show_error_message(progress_msg)
+                elapsed = time.time() - start_time
+                self.show_error_message(f"正在连接服务器... ({elapsed:.1f}/{max_wait:.0f}秒)")
                 
-                # 每次循环都检查端口，因为服务器可能需要时间启动
-                if self.check_server_port(local_ip, 29188):
-                    print(f"attempt_server_connection (尝试 {attempt+1}): 端口 {local_ip}:29188 可用，尝试连接...")
-                    # 再次检查是否已取消
-                    if self.connection_cancelled:
-                        # ... (处理同上)
-                        print("attempt_server_connection: 连接在端口检查后被用户取消。")
-                        self.connecting_to_server = False
-                        if client_for_this_connection_attempt:
-                            client_for_this_connection_attempt.disconnect()
-                        if self.network_client == client_for_this_connection_attempt:
-                             self.network_client = None
-                        return
-                    
-                    # 使用为此连接尝试保留的客户端实例
-                    if client_for_this_connection_attempt.connect(local_ip, 29188):
-                        print(f"attempt_server_connection (尝试 {attempt+1}): 连接成功！")
-                        # 只有成功连接后，才把这个client实例正式赋值给self.network_client
-                        # (虽然在当前逻辑下它们应该是同一个对象，但这样做更明确)
-                        self.network_client = client_for_this_connection_attempt
-                        self.network_client.join_room(config_manager.get_nickname(), GAME_VERSION)
-                        self.is_host = True
-                        self.room_state = "waiting"
-                        self.connecting_to_server = False
-                        self.setup_network_handlers()
-                        self.error_message = "" # 清除连接进度消息
-                        return
-                    else:
-                        print(f"attempt_server_connection (尝试 {attempt+1}): 连接失败，但端口可用。可能服务器仍在初始化。")
-                        # 连接失败，此client_for_this_connection_attempt实例可能已损坏，
-                        # 下次循环前理论上应该创建新的，但当前GameClient.connect已有内部清理。
-                        # 为保险起见，确保它被断开，以便下次循环时connect方法会重新创建socket
-                        client_for_this_connection_attempt.disconnect() 
-                        # 然后为了下一次尝试，需要一个新的GameClient实例
-                        # 但我们是在循环中，所以直接寄希望于下一次 connect 会处理好
-                        # 或者，严格来说，这里应该创建一个新的 client_for_this_connection_attempt
-                        # 但考虑到 GameClient.connect 现在会处理自己的socket，暂时不在此处重新创建
-                        # 只需要确保它调用了 disconnect
-                else:
-                    print(f"attempt_server_connection (尝试 {attempt+1}): 端口 {local_ip}:29188 不可用。")
+                servers = discover_servers(timeout=probe_timeout, hosts=[local_ip])
+                if not any(server['port'] == 29188 for server in servers):
+                    time.sleep(0.05)  # 服务器尚未应答（回环地址上端口未打开时探测会立即失败）
+                    continue
                 
-                # 等待一段时间后重试
-                for _ in range(int(attempt_interval * 10)):
-                    if self.connection_cancelled:
-                        # ... (处理同上)
-                        print("attempt_server_connection: 连接在等待间隔中被用户取消。")
-                        self.connecting_to_server = False
-                        if client_for_this_connection_attempt:
-                            client_for_this_connection_attempt.disconnect()
-                        if self.network_client == client_for_this_connection_attempt:
-                            self.network_client = None
-                        return
-                    time.sleep(0.1)
+                print(f"attempt_server_connection: 服务器已应答发现探测 ({elapsed:.2f}秒)，尝试连接...")
+                if cancelled():
+                    return
+                if try_connect():
+                    return
+                print("attempt_server_connection: 连接失败，可能服务器仍在初始化。")
+                time.sleep(0.1)
+            
+            # 发现服务可能被禁用或端口被占用：放弃前直接尝试连接一次
+            if cancelled() or try_connect():
+                return
             
             # 所有尝试都失败了
             print("attempt_server_connection: 所有连接尝试失败。")
@@ -532,25 +528,51 @@ class MonopolyGame:
         thread.daemon = True
         thread.start()
     
-    def check_server_port(self, host, port):
-        """检查服务器端口是否可用"""
-        try:
-            import socket
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1)  # 1秒超时
-            result = sock.connect_ex((host, port))
-            sock.close()
-            return result == 0
-        except:
-            return False
+    def start_lan_discovery(self):
+        """在后台线程中周期性地发现局域网服务器（仅在加入房间界面运行）"""
+        if self.discovery_running:
+            return
+        self.discovery_running = True
+        self.discovered_servers = []
+        
+        def discovery_thread():
+            refresh_interval = 2.0
+            try:
+                while self.running and self.game_state == GAME_STATE_LOBBY and self.room_state == "joining":
+                    try:
+                        self.discovered_servers = discover_servers()
+                    except OSError as e:
+                        print(f"局域网发现失败: {e}")
+                    # 等待下一次刷新，离开加入界面后尽快退出
+                    for _ in range(int(refresh_interval * 10)):
+                        if self.room_state != "joining":
+                            break
+                        time.sleep(0.1)
+            finally:
+                self.discovery_running = False
+        
+        thread = threading.Thread(target=discovery_thread)
+        thread.daemon = True
+        thread.start()
+    
+    def get_lan_server_rows(self):
+        """局域网服务器列表的每一行：(区域, 服务器, 房间ID, 是否可加入)"""
+        rows = []
+        for server in self.discovered_servers:
+            rooms = server['rooms'] or [{'room_id': 'default', 'players': 0, 'max_players': 4, 'started': False}]
+            for room in rooms:
+                joinable = not room.get('started') and room.get('players', 0) < room.get('max_players', 4)
+                rows.append((server, room, joinable))
+        return [(pygame.Rect(WINDOW_WIDTH//2 - 250, 470 + i * 45, 500, 40), server, room['room_id'], joinable)
+                for i, (server, room, joinable) in enumerate(rows[:4])]
     
-    def connect_to_host(self, ip_address):
+    def connect_to_host(self, ip_address, port=29188, room_id='default'):
         """连接到主机"""
-        self.network_client = GameClient()
+        self.network_client = GameClient(use_inbox=True)
         
         # 尝试连接
-        if self.network_client.connect(ip_address, 29188):
-            self.network_client.join_room(config_manager.get_nickname(), GAME_VERSION)
+        if self.network_client.connect(ip_address, port):
+            self.network_client.join_room(config_manager.get_nickname(), GAME_VERSION, room_id)
             self.is_host = False
             self.room_state = "waiting"
             
@@ -559,7 +581,7 @@ class MonopolyGame:
         else:
             self.room_state = "joining"
             self.network_client = None
-            self.show_error_message(f"无法连接到 {ip_address}:29188")
+            self.show_error_message(f"无法连接到 {ip_address}:{port}")
     
     def setup_network_handlers(self):
         """设置网络消息处理器"""
@@ -570,6 +592,8 @@ class MonopolyGame:
             self.network_client.register_handler(MessageType.GAME_STATE, self.handle_game_state_update)
             self.network_client.register_handler(MessageType.JOIN_FAILED, self.handle_join_failed)
             self.network_client.register_handler(MessageType.AI_TAKEOVER, self.handle_ai_takeover)
+            self.network_client.register_handler(MessageType.PLAYER_RESUMED, self.handle_player_resumed)
+            self.network_client.resume_callback = self.handle_session_resumed
     
     def handle_join_failed(self, data):
         """处理加入失败消息"""
@@ -596,9 +620,25 @@ class MonopolyGame:
             # 设置网络玩家
             if isinstance(self.game_logic, NetworkGameLogic):
                 self.game_logic.setup_network_players(data['players'])
+                self.game_logic.authoritative = data.get('authoritative', False)
+        self.server_events = []
+        self.intent_pending = False
+    
+    def is_authoritative_game(self):
+        """当前是否为服务器权威模式的联机游戏"""
+        return (self.is_online_game and isinstance(self.game_logic, NetworkGameLogic) and
+                self.game_logic.authoritative)
     
     def handle_network_dice_roll(self, data):
         """处理网络骰子投掷"""
+        if self.is_authoritative_game():
+            # 服务器可能在本地动画结束前就广播下一步，排队等待本地空闲时播放
+            self.server_events.append({'type': MessageType.DICE_ROLL, 'data': data})
+            return
+        self.apply_network_dice_roll(data)
+    
+    def apply_network_dice_roll(self, data):
+        """播放骰子投掷结果"""
         if self.game_logic:
             # 获取投掷骰子的玩家槽位
             player_slot = data.get('player_slot')
@@ -622,6 +662,13 @@ class MonopolyGame:
     
     def handle_network_effect_dice(self, data):
         """处理网络效果骰子"""
+        if self.is_authoritative_game():
+            self.server_events.append({'type': MessageType.EFFECT_DICE_ROLL, 'data': data})
+            return
+        self.apply_network_effect_dice(data)
+    
+    def apply_network_effect_dice(self, data):
+        """播放效果骰子结果"""
         if self.game_logic:
             # 获取投掷骰子的玩家槽位
             player_slot = data.get('player_slot')
@@ -645,10 +692,42 @@ class MonopolyGame:
                 delay = 2000 if current_player.is_ai else 1500
                 self.start_wait('effect_completed', delay, self.complete_effect_dice_roll)
     
+    def update_server_events(self):
+        """本地没有动画和等待时，播放下一条服务器广播的结果"""
+        if not self.server_events or not self.game_logic or not self.animation_manager:
+            return
+        if self.animation_manager.is_any_animation_running() or self.waiting_state:
+            return
+        
+        event = self.server_events.pop(0)
+        data = event['data']
+        if event['type'] == MessageType.GAME_STATE:
+            # 本地已播放到与该状态相同的位置，以服务器状态修正可能的偏差
+            self.game_logic.sync_game_state(data)
+            return
+        
+        player_slot = data.get('player_slot')
+        if player_slot is not None and player_slot != self.game_logic.current_player:
+            # 本地回合推进与服务器不一致时以服务器为准
+            print(f"[同步] 本地回合 {self.game_logic.current_player} 与服务器 {player_slot} 不一致，已校正")
+            self.game_logic.current_player = player_slot
+        if player_slot == self.network_client.player_slot:
+            self.intent_pending = False
+        
+        if event['type'] == MessageType.DICE_ROLL:
+            self.game_logic.clear_dice_results()
+            self.apply_network_dice_roll(data)
+        else:
+            self.apply_network_effect_dice(data)
+    
     def handle_game_state_update(self, data):
         """处理游戏状态更新"""
-        # 同步游戏状态
-        pass
+        if not self.network_client:
+            return
+        # 还原增量状态并确认版本，按顺序排在骰子结果之后同步
+        state = self.network_client.receive_game_state(data)
+        if state is not None and self.is_authoritative_game():
+            self.server_events.append({'type': MessageType.GAME_STATE, 'data': state})
     
     def handle_ai_takeover(self, data):
         """处理AI接管通知"""
@@ -668,14 +747,33 @@ class MonopolyGame:
                     player.is_ai = True
                     player.name = f"AI{player_slot + 1}"
                     
-                    # 如果是当前回合的玩家，且是房主，则立即触发AI行动
+                    # 如果是当前回合的玩家，且是房主，则立即触发AI行动（服务器权威模式下由服务器执行）
                     current_player = self.game_logic.get_current_player()
-                    if self.is_host and current_player.id == player_slot:
+                    if self.is_host and current_player.id == player_slot and not self.is_authoritative_game():
                         print(f"[AI接管] 当前是掉线玩家的回合，立即触发AI行动")
                         # 设置一个短暂延迟，确保状态更新后再执行AI行动
                         self.start_wait('ai_takeover', 500, lambda: self.handle_ai_network_turn(player_slot))
                     break
     
+    def handle_player_resumed(self, data):
+        """处理掉线玩家重连：从AI手中收回槽位"""
+        player_slot = data.get('player_slot')
+        player_name = data.get('player_name', f'玩家{player_slot + 1}')
+        self.show_error_message(f"{player_name} 已重新连接")
+        
+        if self.game_logic and hasattr(self.game_logic, 'players'):
+            for player in self.game_logic.players:
+                if player.id == player_slot:
+                    player.is_ai = False
+                    player.name = player_name
+                    break
+    
+    def handle_session_resumed(self, data):
+        """本地客户端断线后恢复会话"""
+        # 断线前发出的操作请求可能已丢失，允许重新发送
+        self.intent_pending = False
+        self.show_error_message("已重新连接到服务器")
+    
     def leave_lobby(self):
         """离开大厅"""
         if self.network_client:
@@ -786,6 +884,13 @@ class MonopolyGame:
             if not self.game_logic.can_current_player_roll():
                 return
         
+        # 服务器权威模式只发送请求，点数由服务器广播
+        if self.is_authoritative_game():
+            if not self.intent_pending and self.network_client:
+                self.intent_pending = True
+                self.network_client.request_effect_dice_roll(self.game_logic.current_player)
+            return
+        
         # 投掷效果骰子，这会设置 self.game_logic.effect_dice_result
         self.game_logic.roll_effect_dice()
 
@@ -975,6 +1080,13 @@ class MonopolyGame:
             if not self.game_logic.is_local_player_turn():
                 return
         
+        # 服务器权威模式只发送请求，移动在收到服务器广播的点数后进行
+        if self.is_authoritative_game():
+            if not self.intent_pending and self.network_client:
+                self.intent_pending = True
+                self.network_client.request_dice_roll(self.game_logic.current_player)
+            return
+        
         dice = self.game_logic.roll_dice()
         self.game_logic.dice_result = dice
         
@@ -1182,9 +1294,36 @@ class MonopolyGame:
             error_rect = error_text.get_rect(center=(WINDOW_WIDTH//2, WINDOW_HEIGHT - 100))
             self.screen.blit(error_text, error_rect)
         
+        # 绘制网络状态浮层
+        if self.show_network_overlay and self.network_client:
+            self.draw_network_overlay()
+        
         # 更新显示
         pygame.display.flip()
     
+    def draw_network_overlay(self):
+        """在左上角显示与服务器之间的往返延迟、抖动和时钟偏差"""
+        latency = self.network_client.latency
+        if latency.srtt is None:
+            lines = ["网络：等待心跳响应..."]
+        else:
+            lines = [
+                f"延迟 {latency.srtt * 1000:.1f} ms（最近 {latency.rtt * 1000:.1f}，最小 {latency.min_rtt * 1000:.1f}）",
+                f"抖动 {latency.jitter * 1000:.1f} ms",
+                f"时钟偏差 {latency.offset:+.3f} s",
+                f"样本 {latency.samples}"
+            ]
+        texts = [self.small_font.render(line, True, WHITE) for line in lines]
+        width = max(text.get_width() for text in texts) + 16
+        height = sum(text.get_height() for text in texts) + 12
+        background = pygame.Surface((width, height), pygame.SRCALPHA)
+        background.fill((0, 0, 0, 160))
+        self.screen.blit(background, (10, 10))
+        y = 16
+        for text in texts:
+            self.screen.blit(text, (18, y))
+            y += text.get_height()
+    
     def draw_start_screen(self):
         """绘制开始界面"""
         # 标题
@@ -1297,6 +1436,29 @@ class MonopolyGame:
             connect_text = self.font.render("连接", True, BLACK)
             connect_rect = connect_text.get_rect(center=connect_button.center)
             self.screen.blit(connect_text, connect_rect)
+            
+            # 局域网中发现的服务器，点击即可加入
+            rows = self.get_lan_server_rows()
+            if rows:
+                list_title = self.small_font.render("局域网中的房间（点击加入）", True, BLACK)
+            else:
+                list_title = self.small_font.render("正在搜索局域网中的服务器...", True, GRAY)
+            self.screen.blit(list_title, (WINDOW_WIDTH//2 - 250, 440))
+            for row_rect, server, room_id, joinable in rows:
+                room = next((room for room in server['rooms'] if room['room_id'] == room_id), None)
+                if room is None:
+                    occupancy = "空闲"
+                else:
+                    occupancy = f"{room['players']}/{room['max_players']}"
+                    if room.get('started'):
+                        occupancy += " 游戏中"
+                row_text = f"{server['name']} {server['host']}  房间 {room_id}  {occupancy}"
+                if server.get('version') != GAME_VERSION:
+                    row_text += f"  (版本 {server.get('version')})"
+                pygame.draw.rect(self.screen, LIGHT_BLUE if joinable else WHITE, row_rect)
+                pygame.draw.rect(self.screen, BLACK, row_rect, 1)
+                text = self.small_font.render(row_text, True, BLACK if joinable else GRAY)
+                self.screen.blit(text, (row_rect.x + 10, row_rect.y + 10))
         
         elif self.room_state == "hosting":
             # 如果正在连接服务器
@@ -1546,12 +1708,20 @@ class MonopolyGame:
             self.network_client.disconnect()
             self.network_client = None
     
+    def process_network_messages(self):
+        """处理接收线程放入收件箱的网络消息，每帧限定数量和耗时"""
+        if self.network_client:
+            self.network_client.drain_inbox()
+    
     def run(self):
         """运行游戏主循环"""
         while self.running:
             # 处理事件
             self.handle_events()
             
+            # 处理网络消息（在主线程中执行处理器）
+            self.process_network_messages()
+            
             # 更新错误消息状态
             self.update_error_message()
             
@@ -1563,6 +1733,9 @@ class MonopolyGame:
                 # 更新动画
                 self.update_animations()
                 
+                # 播放服务器广播的结果
+                self.update_server_events()
+                
                 # 更新AI逻辑
                 self.update_ai_logic()
             
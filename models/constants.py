@@ -2,8 +2,6 @@
 游戏常量定义
 """
 
-import pygame
-
 # 窗口设置
 WINDOW_WIDTH = 1280
 WINDOW_HEIGHT = 720
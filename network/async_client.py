@@ -0,0 +1,282 @@
+"""
+异步游戏客户端
+与 GameClient 相同的 register_handler / send_* 接口，但不创建任何线程：
+连接是 asyncio 事件循环中的一个 Protocol，收到数据时直接分帧并分发给处理器，
+心跳由事件循环的定时器触发，只在连接空闲时才发送。
+加入房间等请求/响应调用返回可等待的 future，不必注册处理器等待回调。
+
+在 asyncio 代码中直接使用：
+    client = AsyncGameClient()
+    await client.connect('127.0.0.1', 29188)
+    info = await client.join_room('bot1', '1.0.0', 'room1')
+
+在普通线程中使用时，所有客户端共用一个后台事件循环线程（ClientLoop.shared()），
+通过 call 在该线程中调用客户端的方法：
+    loop = ClientLoop.shared()
+    client = AsyncGameClient()
+    loop.call(client.connect, '127.0.0.1', 29188).result()
+    info = loop.call(client.join_room, 'bot1', '1.0.0').result(timeout=5)
+"""
+
+import asyncio
+import concurrent.futures
+import inspect
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from .protocol import NetworkMessage, MessageType
+from .framing import FrameDecoder, FrameError, encode_message, decode_message
+from .client import GameClient
+
+JOIN_TIMEOUT = 10.0  # 等待加入结果的最长时间（秒）
+
+class JoinRoomError(Exception):
+    """服务器拒绝加入房间"""
+
+class ClientLoop:
+    """运行异步客户端的后台事件循环线程（一个线程可以承载任意多个客户端）"""
+
+    _shared: Optional['ClientLoop'] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='client-loop')
+        self.thread.daemon = True
+        self.thread.start()
+
+    @classmethod
+    def shared(cls) -> 'ClientLoop':
+        """获取（或创建）进程内共用的事件循环线程"""
+        with cls._shared_lock:
+            if cls._shared is None or not cls._shared.thread.is_alive():
+                cls._shared = cls()
+            return cls._shared
+
+    def call(self, func: Callable, *args, **kwargs) -> concurrent.futures.Future:
+        """在事件循环线程中调用 func；func 返回可等待对象时，future 的结果为其最终结果"""
+        async def run():
+            result = func(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        return asyncio.run_coroutine_threadsafe(run(), self.loop)
+
+    def stop(self):
+        """停止事件循环线程"""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=1.0)
+
+class ClientProtocol(asyncio.Protocol):
+    """把连接事件转交给 AsyncGameClient"""
+
+    def __init__(self, client: 'AsyncGameClient'):
+        self.client = client
+        self.transport: Optional[asyncio.Transport] = None
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+
+    def data_received(self, data: bytes):
+        self.client.data_received(data)
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self.client.connection_lost(self.transport, exc)
+
+class AsyncGameClient(GameClient):
+    """
+    基于 asyncio 的游戏客户端
+
+    处理器在事件循环线程中调用，不能阻塞；协程函数注册为处理器时作为任务运行。
+    除 connect 和 ClientLoop.call 外，方法都应在事件循环线程中调用（send_* 可以在任何线程调用）。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread: Optional[int] = None  # 事件循环所在线程，其他线程发送时转交给该线程
+        self.transport: Optional[asyncio.Transport] = None
+        self.decoder = FrameDecoder()
+        self.heartbeat_timer: Optional[asyncio.TimerHandle] = None
+        self.pending_join: Optional[asyncio.Future] = None  # 等待 JOIN_SUCCESS / JOIN_FAILED
+        self.resume_task: Optional[asyncio.Task] = None
+
+    def register_handler(self, msg_type: MessageType, handler: Callable):
+        """注册消息处理器（替换该类型已有的处理器）；协程函数在收到消息时作为任务运行"""
+        if asyncio.iscoroutinefunction(handler):
+            coroutine_handler = handler
+            handler = lambda data: self.loop.create_task(coroutine_handler(data))
+        super().register_handler(msg_type, handler)
+
+    async def connect(self, host: str, port: int = 29188, timeout: float = 5.0) -> bool:
+        """连接到服务器（在调用方所在的事件循环中运行）"""
+        if self.connected:
+            self.disconnect()
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        try:
+            self.transport, _ = await asyncio.wait_for(
+                self.loop.create_connection(lambda: ClientProtocol(self), host, port), timeout)
+        except asyncio.TimeoutError:
+            print(f"连接超时: {host}:{port}")
+            return False
+        except OSError as e:
+            print(f"连接失败 ({type(e).__name__}): {host}:{port} - {e}")
+            return False
+        self.decoder = FrameDecoder()
+        self.server_address = (host, port)
+        self.connected = True
+        self.running = True
+        self.last_pong_time = time.time()
+        self.heartbeat_timer = self.loop.call_soon(self.heartbeat)
+        print(f"成功连接到 {host}:{port}")
+        return True
+
+    def heartbeat(self):
+        """心跳定时器：到了 next_ping_time 才发送心跳，期间发送过其他消息时只推后定时器"""
+        if not self.running or not self.connected:
+            return
+        now = time.monotonic()
+        if self.next_ping_time() <= now:
+            self.send_ping()
+        self.heartbeat_timer = self.loop.call_later(max(0.0, self.next_ping_time() - now), self.heartbeat)
+
+    def send_message(self, message: NetworkMessage):
+        """发送消息到服务器（可在任何线程调用，写入总在事件循环线程中进行）"""
+        if not self.connected or self.transport is None:
+            return
+        data = encode_message(message, self.codec)
+        self.last_sent = time.monotonic()
+        if threading.get_ident() == self.loop_thread:
+            self.transport.write(data)
+        else:
+            self.loop.call_soon_threadsafe(self.write, data)
+
+    def write(self, data: bytes):
+        if self.connected and self.transport is not None:
+            self.transport.write(data)
+
+    def data_received(self, data: bytes):
+        """分帧、解码并分发收到的消息"""
+        try:
+            frames = self.decoder.feed(data)
+        except FrameError as e:
+            print(f"消息分帧错误: {e}")
+            self.transport.close()
+            return
+        for frame in frames:
+            message = decode_message(frame)
+            if message:
+                try:
+                    self.process_message(message)
+                except Exception as e:
+                    print(f"处理消息错误 ({message.type.value}): {e}")
+
+    def connection_lost(self, transport: asyncio.Transport, exc: Optional[Exception]):
+        """连接断开：未完成的请求以 ConnectionError 结束，非主动断开时尝试恢复会话"""
+        if transport is not self.transport:
+            return  # 重新连接后旧连接才关闭完成，不影响新连接的状态
+        connection_lost = self.running
+        self.connected = False
+        self.running = False
+        self.transport = None
+        if self.heartbeat_timer:
+            self.heartbeat_timer.cancel()
+            self.heartbeat_timer = None
+        self.fail_pending_join(ConnectionError("与服务器的连接已断开"))
+        if connection_lost:
+            print("与服务器的连接已断开")
+            if self.auto_resume and self.session_token:
+                self.resume_task = self.loop.create_task(self.reconnect())
+
+    def disconnect(self):
+        """断开连接（可在任何线程调用）"""
+        if self.loop is None:
+            return
+        if threading.get_ident() != self.loop_thread:
+            self.loop.call_soon_threadsafe(self.disconnect)
+            return
+        self.running = False
+        self.connected = False
+        if self.resume_task:
+            self.resume_task.cancel()
+            self.resume_task = None
+        if self.heartbeat_timer:
+            self.heartbeat_timer.cancel()
+            self.heartbeat_timer = None
+        if self.transport:
+            self.transport.close()  # connection_lost 随后清理其余状态
+
+    async def reconnect(self) -> bool:
+        """重新连接服务器并凭会话令牌恢复原来的槽位"""
+        delay = 0.5
+        for attempt in range(self.resume_attempts):
+            print(f"正在尝试重新连接 ({attempt + 1}/{self.resume_attempts})...")
+            if await self.connect(*self.server_address):
+                self.resume_session()
+                return True
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5.0)
+        print("重新连接失败")
+        return False
+
+    def join_room(self, player_name: str, version: str, room_id: str = 'default') -> asyncio.Future:
+        """加入房间，返回的 future 在加入成功时得到 JOIN_SUCCESS 的数据，被拒绝时抛出 JoinRoomError"""
+        future = self.expect_join()
+        super().join_room(player_name, version, room_id)
+        return future
+
+    def spectate_room(self, player_name: str, version: str, room_id: str = 'default') -> asyncio.Future:
+        """以观战者身份进入房间，返回值同 join_room"""
+        future = self.expect_join()
+        super().spectate_room(player_name, version, room_id)
+        return future
+
+    def expect_join(self) -> asyncio.Future:
+        """创建等待加入结果的 future（超过 JOIN_TIMEOUT 秒未收到结果时抛出 TimeoutError）"""
+        self.fail_pending_join(JoinRoomError("已发出新的加入请求"))
+        future = self.pending_join = self.loop.create_future()
+        timer = self.loop.call_later(JOIN_TIMEOUT, self.fail_pending_join,
+                                     asyncio.TimeoutError("等待加入结果超时"), future)
+        future.add_done_callback(lambda _: timer.cancel())
+        return future
+
+    def fail_pending_join(self, error: Exception, future: Optional[asyncio.Future] = None):
+        """以异常结束等待中的加入请求（指定 future 时只在它仍在等待时结束）"""
+        pending = self.pending_join
+        if pending is None or (future is not None and future is not pending):
+            return
+        self.pending_join = None
+        if not pending.done():
+            pending.set_exception(error)
+
+    def resolve_pending_join(self, result: Any):
+        pending, self.pending_join = self.pending_join, None
+        if pending is not None and not pending.done():
+            pending.set_result(result)
+
+    def handle_join_success(self, data: dict):
+        """处理加入成功，并结束等待中的加入请求"""
+        super().handle_join_success(data)
+        self.resolve_pending_join(data)
+
+    def handle_join_failed(self, data: dict):
+        """处理加入失败，等待中的加入请求抛出 JoinRoomError"""
+        super().handle_join_failed(data)
+        self.fail_pending_join(JoinRoomError(data.get('reason', '未知原因')))
+
+async def test_async_clients(host: str = 'localhost', port: int = 29188, count: int = 100):
+    """测试：一个事件循环中的多个客户端各自加入一个房间"""
+    clients = [AsyncGameClient() for _ in range(count)]
+    connected = await asyncio.gather(*(client.connect(host, port) for client in clients))
+    results = await asyncio.gather(*(client.join_room(f"Bot{i}", "1.0.0", f"bots{i // 4}")
+                                     for i, client in enumerate(clients) if connected[i]),
+                                   return_exceptions=True)
+    joined = sum(1 for result in results if isinstance(result, dict))
+    print(f"连接成功 {sum(connected)}/{count}，加入房间 {joined}")
+    for client in clients:
+        client.disconnect()
+
+if __name__ == "__main__":
+    asyncio.run(test_async_clients())
@@ -7,28 +7,64 @@ import socket
 import threading
 import json
 import time
+import queue
 from typing import Optional, Callable, List, Dict
 
 from .protocol import NetworkMessage, MessageType, create_join_message, create_start_game_message
+from .framing import FrameDecoder, FrameError, encode_message, decode_message
+from .codec import CODEC_JSON, SUPPORTED_CODECS
+from .state_sync import StateReceiver
+from .routing import MessageRouter
+from .latency import LatencyEstimator
+
+# 主线程每次处理收件箱的上限：消息数和耗时（秒），突发的大量消息分摊到多帧，不会造成单帧卡顿
+INBOX_BATCH = 64
+INBOX_TIME_BUDGET = 0.004
 
 class GameClient:
     """游戏客户端类"""
     
-    def __init__(self):
+    def __init__(self, use_inbox: bool = False):
+        """
+        Args:
+            use_inbox: 为True时接收线程只把消息放入收件箱，处理器由主线程调用 drain_inbox 执行
+        """
         self.socket: Optional[socket.socket] = None
         self.connected = False
         self.running = False
         self.player_id: Optional[str] = None
         self.player_slot: Optional[int] = None
         self.is_host = False
+        self.is_spectator = False  # 以观战者身份进入房间（只读）
         self.room_players: List[Dict] = []
-        self.message_handlers: Dict[MessageType, Callable] = {}
+        self.router = MessageRouter()  # 按消息类型编号索引的处理器表
+        # 收件箱：处理器会修改界面正在渲染的游戏状态，交给主线程按帧处理；None 表示在接收线程直接处理
+        self.inbox: Optional[queue.SimpleQueue] = queue.SimpleQueue() if use_inbox else None
         self.receive_thread: Optional[threading.Thread] = None
+        self.codec = CODEC_JSON  # 加入房间成功后切换为服务器选定的编码
+        self.state_receiver = StateReceiver()  # 还原服务器发送的增量状态
+        
+        # 断线重连相关
+        self.server_address: Optional[tuple] = None
+        self.player_name = ''
+        self.version = ''
+        self.room_id = 'default'
+        self.session_token: Optional[str] = None  # 加入房间时服务器分配的会话令牌
+        self.last_seq = 0  # 已处理的最新房间广播序号
+        self.received_seq = 0  # 接收线程收到的最新房间广播序号（可能还在收件箱中等待处理）
+        self.auto_resume = True  # 连接意外断开时自动凭令牌重连
+        self.resume_attempts = 5
+        self.resume_callback: Optional[Callable[[dict], None]] = None  # 恢复会话成功后调用
         
-        # 心跳相关
+        # 心跳相关：服务器把收到的任何消息都当作心跳，只在连接空闲时才需要发送 PING
         self.heartbeat_thread: Optional[threading.Thread] = None
+        self.heartbeat_wakeup: Optional[threading.Event] = None  # 断开时置位，心跳线程立即退出
         self.last_pong_time = time.time()
-        self.heartbeat_interval = 5  # 5秒发送一次心跳
+        self.heartbeat_interval = 5  # 超过该时间没有发送任何消息才发送心跳（加入房间时采用服务器告知的值）
+        self.latency_probe_interval = 30  # 即使一直有流量，也至少每隔该时间发送一次心跳以更新延迟估计；None 表示不发送
+        self.last_sent = 0.0  # 最后发送消息的时间（time.monotonic）
+        self.last_ping_sent = 0.0
+        self.latency = LatencyEstimator()  # 根据带时间戳的 PING/PONG 估计往返延迟、抖动和时钟偏差
         self.ai_turn_callback: Optional[Callable[[int], None]] = None # 新增：AI回合回调函数，添加类型提示
         
         # 注册默认消息处理器
@@ -41,6 +77,8 @@ class GameClient:
         self.register_handler(MessageType.PONG, self.handle_pong)
         self.register_handler(MessageType.AI_TAKEOVER, self.handle_ai_takeover)
         self.register_handler(MessageType.AI_TURN_START, self.handle_ai_turn_start) # 注册AI回合开始处理器
+        self.register_handler(MessageType.GAME_STATE, self.receive_game_state)
+        self.register_handler(MessageType.PLAYER_RESUMED, self.handle_player_resumed)
     
     def connect(self, host: str, port: int = 29188) -> bool:
         """连接到服务器"""
@@ -56,6 +94,7 @@ class GameClient:
             self.socket.connect((host, port))
             
             self.socket.settimeout(None) # 连接成功后，恢复为阻塞模式用于后续收发
+            self.server_address = (host, port)
             self.connected = True
             self.running = True
             
@@ -64,8 +103,9 @@ class GameClient:
             self.receive_thread.daemon = True
             self.receive_thread.start()
             
-            # 启动心跳线程
-            self.heartbeat_thread = threading.Thread(target=self.heartbeat_loop)
+            # 启动心跳线程（每条连接一个唤醒事件，重连后旧线程不会继续运行）
+            self.heartbeat_wakeup = threading.Event()
+            self.heartbeat_thread = threading.Thread(target=self.heartbeat_loop, args=(self.heartbeat_wakeup,))
             self.heartbeat_thread.daemon = True
             self.heartbeat_thread.start()
             
@@ -102,6 +142,8 @@ class GameClient:
         print("GameClient.disconnect: 正在断开连接...")
         self.running = False  # 命令线程停止
         self.connected = False
+        if self.heartbeat_wakeup:
+            self.heartbeat_wakeup.set()
         
         # 关闭socket
         if self.socket:
@@ -139,7 +181,7 @@ class GameClient:
 
     def receive_messages(self):
         """接收服务器消息"""
-        buffer = ""
+        decoder = FrameDecoder()
         while self.running and self.connected: # 确保socket有效且期望运行
             try:
                 if not self.socket: # Socket可能在别处被关闭
@@ -147,28 +189,23 @@ class GameClient:
                     break
                 # 设置短超时以便能周期性检查 self.running
                 self.socket.settimeout(1.0) 
-                data = self.socket.recv(4096)
+                frames = decoder.recv_from(self.socket)
                 self.socket.settimeout(None) # 恢复阻塞
 
-                if not data:
+                if frames is None:
                     print("receive_messages: 服务器断开连接（recv返回空）。")
                     break 
                 
-                decoded_data = data.decode('utf-8')
-                buffer += decoded_data
                 # 处理可能的多条消息
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    if line:
-                        message = NetworkMessage.from_json(line)
-                        if message:
-                            self.process_message(message)
+                for frame in frames:
+                    message = decode_message(frame)
+                    if message:
+                        self.deliver_message(message)
                             
             except socket.timeout: # recv超时，正常，继续循环检查self.running
                 continue
-            except UnicodeDecodeError as e:
-                print(f"receive_messages: 消息解码错误: {e} - buffer: {buffer}")
-                buffer = "" # 清理可能有问题的buffer
+            except FrameError as e:
+                print(f"receive_messages: 消息分帧错误: {e}")
             except ConnectionResetError:
                 print("receive_messages: 连接被服务器重置。")
                 break
@@ -178,35 +215,144 @@ class GameClient:
                 break # 遇到未知错误，退出循环
         
         print("receive_messages: 接收线程终止。")
+        # 非主动断开（running仍为True）时尝试恢复会话
+        connection_lost = self.running
         # 确保最终状态正确
         self.connected = False
         self.running = False # 如果是从循环中break出来的，确保running也为false
+        if self.heartbeat_wakeup:
+            self.heartbeat_wakeup.set()
+        
+        if connection_lost and self.auto_resume and self.session_token:
+            resume_thread = threading.Thread(target=self.reconnect)
+            resume_thread.daemon = True
+            resume_thread.start()
+    
+    def reconnect(self) -> bool:
+        """重新连接服务器并凭会话令牌恢复原来的槽位"""
+        if not self.server_address or not self.session_token:
+            return False
+        
+        old_socket = self.socket
+        if old_socket:
+            try:
+                old_socket.close()
+            except OSError:
+                pass
+        
+        delay = 0.5
+        for attempt in range(self.resume_attempts):
+            print(f"正在尝试重新连接 ({attempt + 1}/{self.resume_attempts})...")
+            if self.connect(*self.server_address):
+                self.resume_session()
+                return True
+            time.sleep(delay)
+            delay = min(delay * 2, 5.0)
+        print("重新连接失败")
+        return False
+    
+    def resume_session(self):
+        """发送带会话令牌的加入请求，服务器补发错过的消息"""
+        msg = NetworkMessage(MessageType.JOIN_ROOM, {
+            'player_name': self.player_name,
+            'room_id': self.room_id,
+            'version': self.version,
+            'codecs': SUPPORTED_CODECS,
+            'authoritative': True,
+            'session_token': self.session_token,
+            # 收件箱中尚未处理的消息也已收到，不需要服务器补发
+            'last_seq': max(self.received_seq, self.last_seq)
+        })
+        self.send_message(msg)
 
     def send_message(self, message: NetworkMessage):
         """发送消息到服务器"""
         if self.connected and self.socket:
             try:
-                self.socket.send((message.to_json() + '\n').encode('utf-8'))
+                self.socket.sendall(encode_message(message, self.codec))
+                self.last_sent = time.monotonic()
             except Exception as e:
                 print(f"发送消息失败: {e}")
                 self.connected = False
     
+    def deliver_message(self, message: NetworkMessage):
+        """接收线程收到消息：有收件箱时放入收件箱，否则直接处理"""
+        if message.type == MessageType.JOIN_SUCCESS and isinstance(message.data, dict) \
+                and not message.data.get('resumed'):
+            # 加入新房间时序号从房间当前的序号重新开始
+            self.received_seq = message.data.get('seq', 0)
+        elif message.seq is not None and message.seq > self.received_seq:
+            self.received_seq = message.seq
+        # 心跳响应只更新接收时间，不涉及游戏状态，在接收线程处理，主线程卡顿时也能及时记录
+        if self.inbox is None or message.type == MessageType.PONG:
+            self.process_message(message)
+        else:
+            self.inbox.put(message)
+    
+    def drain_inbox(self, max_messages: int = INBOX_BATCH, time_budget: float = INBOX_TIME_BUDGET) -> int:
+        """
+        在主线程中处理收件箱里的消息（每帧调用一次）
+
+        至少处理一条消息；处理满 max_messages 条或耗时超过 time_budget 秒后停止，剩余的留到下一帧。
+
+        Returns:
+            int: 本次处理的消息数
+        """
+        if self.inbox is None:
+            return 0
+        deadline = time.perf_counter() + time_budget
+        handled = 0
+        while handled < max_messages:
+            try:
+                message = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self.process_message(message)
+            except Exception as e:
+                print(f"处理消息错误 ({message.type.value}): {e}")
+            handled += 1
+            if time.perf_counter() >= deadline:
+                break
+        return handled
+    
     def process_message(self, message: NetworkMessage):
-        """处理接收到的消息"""
-        handler = self.message_handlers.get(message.type)
-        if handler:
-            handler(message.data)
+        """处理接收到的消息（序号不大于已处理序号的广播是重复补发的，直接丢弃）"""
+        if message.seq is not None:
+            if message.seq <= self.last_seq:
+                return
+            self.last_seq = message.seq
+        self.router.dispatch(message)
     
     def register_handler(self, msg_type: MessageType, handler: Callable):
-        """注册消息处理器"""
-        self.message_handlers[msg_type] = handler
+        """注册消息处理器（替换该类型已有的处理器）"""
+        self.router.register(msg_type, handler)
     
     def join_room(self, player_name: str, version: str, room_id: str = 'default'):
         """加入房间"""
+        self.player_name = player_name
+        self.version = version
+        self.room_id = room_id
         msg = NetworkMessage(MessageType.JOIN_ROOM, {
             'player_name': player_name,
             'room_id': room_id,
-            'version': version
+            'version': version,
+            'codecs': SUPPORTED_CODECS,
+            'authoritative': True  # 支持由服务器运行游戏规则
+        })
+        self.send_message(msg)
+    
+    def spectate_room(self, player_name: str, version: str, room_id: str = 'default'):
+        """以观战者身份进入房间：只接收状态和广播，不占用玩家槽位"""
+        self.player_name = player_name
+        self.version = version
+        self.room_id = room_id
+        msg = NetworkMessage(MessageType.JOIN_ROOM, {
+            'player_name': player_name,
+            'room_id': room_id,
+            'version': version,
+            'codecs': SUPPORTED_CODECS,
+            'spectate': True
         })
         self.send_message(msg)
     
@@ -232,6 +378,22 @@ class GameClient:
         })
         self.send_message(msg)
     
+    def request_dice_roll(self, player_slot: int):
+        """请求服务器投移动骰子（服务器权威模式，点数由服务器广播）"""
+        msg = NetworkMessage(MessageType.DICE_ROLL, {
+            'player_id': self.player_id,
+            'player_slot': player_slot
+        })
+        self.send_message(msg)
+    
+    def request_effect_dice_roll(self, player_slot: int):
+        """请求服务器投效果骰子（服务器权威模式）"""
+        msg = NetworkMessage(MessageType.EFFECT_DICE_ROLL, {
+            'player_id': self.player_id,
+            'player_slot': player_slot
+        })
+        self.send_message(msg)
+    
     def send_effect_dice_roll(self, effect_result: int):
         """发送效果骰子结果"""
         msg = NetworkMessage(MessageType.EFFECT_DICE_ROLL, {
@@ -254,6 +416,18 @@ class GameClient:
         msg = NetworkMessage(MessageType.GAME_STATE, game_state)
         self.send_message(msg)
     
+    def receive_game_state(self, data: dict) -> Optional[dict]:
+        """
+        还原服务器发送的状态并确认版本
+
+        Returns:
+            dict: 完整的游戏状态；缺少基准版本时返回None（已请求关键帧）
+        """
+        state = self.state_receiver.apply(data)
+        version = data.get('version') if state is not None else None
+        self.send_message(NetworkMessage(MessageType.STATE_ACK, {'version': version}))
+        return state
+    
     # 默认消息处理器
     def handle_join_success(self, data: dict):
         """处理加入成功"""
@@ -261,6 +435,23 @@ class GameClient:
         self.player_slot = data['slot']
         self.is_host = data['is_host']
         self.room_players = data['players']
+        self.codec = data.get('codec', CODEC_JSON)
+        self.session_token = data.get('session_token')
+        ping_interval = data.get('ping_interval')
+        if isinstance(ping_interval, (int, float)) and ping_interval > 0:
+            self.heartbeat_interval = ping_interval
+        self.is_spectator = bool(data.get('spectator'))
+        if self.is_spectator:
+            self.last_seq = data.get('seq', 0)
+            print(f"正在观战房间 {self.room_id}，玩家数: {len(self.room_players)}")
+            return
+        if data.get('resumed'):
+            # 错过的消息紧随其后补发，last_seq 随之更新
+            print(f"已恢复会话，玩家槽位: {self.player_slot}")
+            if self.resume_callback:
+                self.resume_callback(data)
+            return
+        self.last_seq = data.get('seq', 0)
         print(f"成功加入房间，玩家槽位: {self.player_slot}, 是否房主: {self.is_host}")
     
     def handle_join_failed(self, data: dict):
@@ -291,8 +482,12 @@ class GameClient:
         self.room_players = data['players']
     
     def handle_pong(self, data: dict):
-        """处理心跳响应"""
+        """处理心跳响应：服务器回带时间戳时更新往返延迟和时钟偏差的估计"""
+        received = time.monotonic()
         self.last_pong_time = time.time()
+        t0, t1, t2 = data.get('t0'), data.get('t1'), data.get('t2')
+        if t0 is not None and t1 is not None and t2 is not None:
+            self.latency.add_sample(t0, t1, t2, received)
     
     def handle_ai_takeover(self, data: dict):
         """处理AI接管通知"""
@@ -340,32 +535,40 @@ class GameClient:
                 print(f"[客户端] 不触发AI行动，原因: {', '.join(reason)}")
 
     def send_ping(self):
-        """发送心跳"""
-        self.send_message(NetworkMessage(MessageType.PING))
+        """发送心跳（携带发送时刻，用于计算往返延迟）"""
+        self.last_ping_sent = time.monotonic()
+        self.send_message(NetworkMessage(MessageType.PING, {'t0': self.last_ping_sent}))
+    
+    def next_ping_time(self) -> float:
+        """下一次需要发送心跳的时间（time.monotonic）：连接空闲 heartbeat_interval 后，或到了延迟探测的时间"""
+        due = self.last_sent + self.heartbeat_interval
+        if self.latency_probe_interval is not None:
+            due = min(due, self.last_ping_sent + self.latency_probe_interval)
+        return due
 
-    def heartbeat_loop(self):
-        """心跳循环"""
+    def heartbeat_loop(self, wakeup: threading.Event):
+        """心跳循环：睡眠到下一次需要发送心跳的时间，期间发送过其他消息就继续推后"""
         print("heartbeat_loop: 心跳线程启动。")
-        while self.running and self.connected:
+        while self.running and self.connected and not wakeup.is_set():
             try:
-                if not self.socket or not self.connected:
+                if not self.socket:
                     print("heartbeat_loop: socket无效或未连接，退出心跳。")
                     break
+                delay = self.next_ping_time() - time.monotonic()
+                if delay > 0:
+                    wakeup.wait(delay)
+                    continue
                 self.send_ping()
-                # time.sleep(self.heartbeat_interval)
-                # 改为更细粒度的sleep以更快响应self.running的变化
-                for _ in range(int(self.heartbeat_interval * 10)): # 假设interval是5s，则每0.1s检查一次
-                    if not self.running or not self.connected:
-                        break
-                    time.sleep(0.1)
-                if not self.running or not self.connected: #再次检查
-                    break
             except Exception as e:
                 if self.running: # 只在期望运行时打印错误
                     print(f"heartbeat_loop: 心跳错误 ({type(e).__name__}): {e}")
                 break # 遇到错误退出
         print("heartbeat_loop: 心跳线程终止。")
 
+    def handle_player_resumed(self, data: dict):
+        """处理掉线玩家重连"""
+        print(f"玩家 {data.get('player_name')}(槽位:{data.get('player_slot')}) 已重新连接")
+    
     def handle_player_disconnected(self, data: dict):
         """处理玩家断线通知"""
         player_id = data.get('player_id')
@@ -0,0 +1,147 @@
+"""
+消息编码格式
+- json: 原有的JSON文本格式，所有客户端都支持
+- binary: 紧凑的二进制格式，以 MessageType 数字编号为键，
+  常见的小消息（骰子、心跳等）使用 struct 打包，其余消息退回为JSON负载
+
+二进制负载布局：
+    类型编号(u8) | 标志(u8) | [序号(u32)] | 消息体
+标志 FLAG_SEQ 置位时头部之后是房间广播序号；标志 FLAG_COMPACT 置位时
+消息体按该类型的字段表打包，否则消息体为 JSON 编码的 [data, player_id]。
+"""
+
+import json
+import struct
+from typing import Optional
+
+from .protocol import NetworkMessage, MessageType, MESSAGE_TYPES_BY_ID
+
+CODEC_JSON = 'json'
+CODEC_BINARY = 'binary'
+SUPPORTED_CODECS = [CODEC_BINARY, CODEC_JSON]  # 按优先级排列
+
+FLAG_COMPACT = 0x01
+FLAG_SEQ = 0x02
+
+_HEADER = struct.Struct('!BB')
+_NULL_STRING = 0xFF  # 字符串长度字段为0xFF表示None
+_U32 = struct.Struct('!I')
+_F64 = struct.Struct('!d')
+
+# 紧凑字段表：字段名 -> 字段类型
+# 'u8' 为 0-255 的整数；'u32' 为无符号32位整数；'f64' 为双精度浮点数（时间戳）；
+# 'str' 为可空字符串（u8长度前缀，最长254字节）
+COMPACT_SCHEMAS = {
+    MessageType.DICE_ROLL: (('dice_result', 'u8'), ('player_id', 'str'), ('player_slot', 'u8')),
+    MessageType.EFFECT_DICE_ROLL: (('effect_result', 'u8'), ('player_id', 'str'), ('player_slot', 'u8')),
+    MessageType.AI_TURN_START: (('player_slot', 'u8'),),
+    MessageType.START_GAME: (),
+    MessageType.PING: (('t0', 'f64'),),
+    MessageType.PONG: (('t0', 'f64'), ('t1', 'f64'), ('t2', 'f64')),
+    MessageType.STATE_ACK: (('version', 'u32'),),
+}
+
+def choose_codec(client_codecs) -> str:
+    """根据客户端声明支持的编码选择双方都支持的最优编码"""
+    if isinstance(client_codecs, list):
+        for codec in client_codecs:
+            if codec in SUPPORTED_CODECS:
+                return codec
+    return CODEC_JSON
+
+def _pack_compact(schema, data: dict) -> Optional[bytes]:
+    """按字段表打包消息体，数据不符合字段表时返回None"""
+    if len(data) != len(schema):
+        return None
+
+    body = bytearray()
+    for name, kind in schema:
+        if name not in data:
+            return None
+        value = data[name]
+        if kind == 'u8':
+            if type(value) is not int or not 0 <= value <= 0xFF:
+                return None
+            body.append(value)
+        elif kind == 'u32':
+            if type(value) is not int or not 0 <= value <= 0xFFFFFFFF:
+                return None
+            body += _U32.pack(value)
+        elif kind == 'f64':
+            if type(value) is not float and type(value) is not int:
+                return None
+            body += _F64.pack(value)
+        else:
+            if value is None:
+                body.append(_NULL_STRING)
+                continue
+            if not isinstance(value, str):
+                return None
+            encoded = value.encode('utf-8')
+            if len(encoded) >= _NULL_STRING:
+                return None
+            body.append(len(encoded))
+            body += encoded
+    return bytes(body)
+
+def _unpack_compact(schema, body: bytes) -> dict:
+    """按字段表解包消息体"""
+    data = {}
+    offset = 0
+    for name, kind in schema:
+        if kind == 'u8':
+            data[name] = body[offset]
+            offset += 1
+        elif kind == 'u32':
+            data[name] = _U32.unpack_from(body, offset)[0]
+            offset += _U32.size
+        elif kind == 'f64':
+            data[name] = _F64.unpack_from(body, offset)[0]
+            offset += _F64.size
+        else:
+            length = body[offset]
+            offset += 1
+            if length == _NULL_STRING:
+                data[name] = None
+            else:
+                data[name] = body[offset:offset + length].decode('utf-8')
+                offset += length
+    if offset != len(body):
+        raise ValueError("紧凑消息体长度不匹配")
+    return data
+
+def encode_binary(message: NetworkMessage) -> bytes:
+    """将消息编码为二进制负载"""
+    type_id = message.type.type_id
+    flags = 0
+    seq = b''
+    if message.seq is not None:
+        flags |= FLAG_SEQ
+        seq = _U32.pack(message.seq)
+
+    schema = COMPACT_SCHEMAS.get(message.type)
+    if schema is not None and message.player_id is None:
+        body = _pack_compact(schema, message.data)
+        if body is not None:
+            return _HEADER.pack(type_id, flags | FLAG_COMPACT) + seq + body
+
+    body = json.dumps([message.data, message.player_id], separators=(',', ':')).encode('utf-8')
+    return _HEADER.pack(type_id, flags) + seq + body
+
+def decode_binary(payload: bytes) -> Optional[NetworkMessage]:
+    """从二进制负载解码消息，格式错误时返回None"""
+    try:
+        type_id, flags = _HEADER.unpack_from(payload)
+        msg_type = MESSAGE_TYPES_BY_ID[type_id]
+        offset = _HEADER.size
+        seq = None
+        if flags & FLAG_SEQ:
+            seq = _U32.unpack_from(payload, offset)[0]
+            offset += _U32.size
+        body = payload[offset:]
+        if flags & FLAG_COMPACT:
+            return NetworkMessage(msg_type, _unpack_compact(COMPACT_SCHEMAS[msg_type], body), seq=seq)
+        data, player_id = json.loads(body)
+        return NetworkMessage(msg_type, data, player_id, seq)
+    except (struct.error, KeyError, IndexError, ValueError, TypeError):
+        return None
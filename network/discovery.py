@@ -0,0 +1,248 @@
+"""
+局域网服务器发现
+服务器在 DISCOVERY_PORT 上监听UDP广播和组播探测包，回复自己的TCP端口、版本和房间占用情况；
+客户端发出一次探测后在几百毫秒内收集所有回复，不需要输入IP，也不需要逐个探测TCP端口。
+
+本机IP的获取不依赖外网：不再向 8.8.8.8 "连接" UDP socket，
+离线时（没有默认路由）也能从网卡地址中选出局域网地址。
+"""
+
+import json
+import secrets
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+DISCOVERY_PORT = 29189  # 发现服务的UDP端口（游戏服务器TCP端口 + 1）
+DISCOVERY_GROUP = '239.255.41.88'  # 本地管理范围的组播地址，不会被路由器转发出局域网
+DISCOVERY_SERVICE = 'fogmoe'
+PROBE_MAGIC = b'FOGMOE_DISCOVER'
+DISCOVERY_TIMEOUT = 0.3  # 客户端等待回复的默认时间（秒）
+MAX_REPLY_SIZE = 60 * 1024  # UDP回复的最大字节数，房间过多时只列出前面的房间
+
+def get_local_ips() -> List[str]:
+    """
+    获取本机的IPv4地址（不含回环地址），局域网私有地址排在前面
+
+    依次尝试：UDP socket "连接"到私有网段和广播地址（只查询路由表，不发送数据），
+    以及解析本机主机名。离线、没有默认路由时也能得到网卡地址。
+    """
+    addresses = []
+
+    def add(address):
+        if address and not address.startswith('127.') and address != '0.0.0.0' and address not in addresses:
+            addresses.append(address)
+
+    for target in ('10.255.255.255', '192.168.255.255', '172.31.255.255', '255.255.255.255'):
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                s.connect((target, DISCOVERY_PORT))
+                add(s.getsockname()[0])
+        except OSError:
+            pass
+
+    try:
+        for address in socket.gethostbyname_ex(socket.gethostname())[2]:
+            add(address)
+    except OSError:
+        pass
+
+    def is_private(address):
+        return (address.startswith('10.') or address.startswith('192.168.') or
+                any(address.startswith(f'172.{n}.') for n in range(16, 32)))
+
+    addresses.sort(key=lambda address: not is_private(address))
+    return addresses
+
+def get_local_ip() -> str:
+    """获取本机在局域网中的IP地址，找不到时返回 127.0.0.1"""
+    addresses = get_local_ips()
+    return addresses[0] if addresses else '127.0.0.1'
+
+class DiscoveryResponder:
+    """
+    发现服务应答方：收到探测包后回复服务器信息
+
+    线程模式服务器调用 start() 在独立线程中运行；
+    事件循环服务器把 socket 注册到 selector，可读时调用 handle_ready()。
+    """
+
+    def __init__(self, info_callback: Callable[[], dict], port: int = DISCOVERY_PORT,
+                 group: str = DISCOVERY_GROUP):
+        self.info_callback = info_callback  # 返回回复内容（端口、版本、房间等）
+        self.port = port
+        self.group = group
+        self.socket: Optional[socket.socket] = None
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+        self.probes = 0
+
+    def open(self) -> socket.socket:
+        """绑定发现端口并加入组播组"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # 允许同一台机器上的多个服务器（以及分片的各个工作进程）共用发现端口，广播和组播会送达每一个
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('', self.port))
+        try:
+            membership = socket.inet_aton(self.group) + socket.inet_aton('0.0.0.0')
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError as e:
+            # 离线或网卡不支持组播时仍可应答广播和单播探测
+            print(f"发现服务加入组播组失败: {e}")
+        self.socket = sock
+        self.running = True
+        print(f"局域网发现服务监听UDP端口 {self.port}")
+        return sock
+
+    def handle_ready(self, *args):
+        """发现socket可读：应答所有已到达的探测包"""
+        while self.socket:
+            try:
+                packet, address = self.socket.recvfrom(1024)
+            except (BlockingIOError, InterruptedError, socket.timeout):
+                return
+            except OSError:
+                return
+            self.answer(packet, address)
+
+    def answer(self, packet: bytes, address: Tuple[str, int]):
+        """回复一个探测包"""
+        if not packet.startswith(PROBE_MAGIC):
+            return
+        self.probes += 1
+        reply = dict(self.info_callback())
+        reply['service'] = DISCOVERY_SERVICE
+        reply['nonce'] = packet[len(PROBE_MAGIC):].decode('ascii', 'replace').strip()
+        payload = json.dumps(reply, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        while len(payload) > MAX_REPLY_SIZE and reply.get('rooms'):
+            reply['rooms'] = reply['rooms'][:len(reply['rooms']) // 2]
+            reply['truncated'] = True
+            payload = json.dumps(reply, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        try:
+            self.socket.sendto(payload, address)
+        except OSError as e:
+            print(f"发现服务回复 {address} 失败: {e}")
+
+    def start(self):
+        """在独立线程中应答探测（线程模式服务器使用）"""
+        self.open()
+        self.socket.settimeout(0.5)  # 定期检查 running，便于停止
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """应答线程主循环"""
+        while self.running:
+            try:
+                packet, address = self.socket.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                self.answer(packet, address)
+            except Exception as e:
+                print(f"发现服务错误: {e}")
+
+    def stop(self):
+        """关闭发现socket"""
+        self.running = False
+        sock, self.socket = self.socket, None
+        if sock:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        if self.thread and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2.0)
+
+def discover_servers(timeout: float = DISCOVERY_TIMEOUT, port: int = DISCOVERY_PORT,
+                     hosts: Optional[List[str]] = None) -> List[Dict]:
+    """
+    发现局域网中的游戏服务器
+
+    Args:
+        timeout: 等待回复的时间（秒）
+        port: 发现服务端口
+        hosts: 额外的单播探测目标；为 None 时发送广播、组播和本机回环探测
+
+    Returns:
+        List[Dict]: 服务器列表（按响应时间排序），每项包含 host、port、version、name、
+        rooms（每个房间的 room_id、players、max_players、started、spectators）、players、latency
+    """
+    nonce = secrets.token_hex(4)
+    probe = PROBE_MAGIC + b' ' + nonce.encode('ascii')
+    if hosts is None:
+        targets = ['255.255.255.255', DISCOVERY_GROUP, '127.0.0.1']
+        targets += [address.rsplit('.', 1)[0] + '.255' for address in get_local_ips()]
+    else:
+        targets = list(hosts)
+
+    servers: Dict[str, Dict] = {}  # server_id -> 合并后的服务器信息
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        except OSError:
+            pass
+        start = time.monotonic()
+        for target in targets:
+            try:
+                sock.sendto(probe, (target, port))
+            except OSError:
+                pass  # 离线时广播或组播可能不可用，其他目标仍可以应答
+
+        deadline = start + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                packet, address = sock.recvfrom(MAX_REPLY_SIZE + 1024)
+            except socket.timeout:
+                break
+            except OSError:
+                continue
+            try:
+                reply = json.loads(packet.decode('utf-8'))
+            except ValueError:
+                continue
+            if not isinstance(reply, dict) or reply.get('service') != DISCOVERY_SERVICE or reply.get('nonce') != nonce:
+                continue
+            merge_reply(servers, reply, address[0], time.monotonic() - start)
+
+    for server in servers.values():
+        del server['shards_seen']
+        server['players'] = sum(room.get('players', 0) for room in server['rooms'])
+    return sorted(servers.values(), key=lambda server: server['latency'])
+
+def merge_reply(servers: Dict[str, Dict], reply: dict, host: str, latency: float):
+    """
+    合并一条回复：同一服务器可能通过广播、组播、回环多次应答，
+    分片模式下每个工作进程各自应答自己的房间
+    """
+    server_id = str(reply.get('server_id') or f"{host}:{reply.get('port')}")
+    server = servers.get(server_id)
+    if server is None:
+        server = servers[server_id] = {
+            'server_id': server_id,
+            'host': host,
+            'port': reply.get('port'),
+            'version': reply.get('version'),
+            'name': reply.get('name', host),
+            'rooms': [],
+            'latency': latency,
+            'shards_seen': set()
+        }
+    elif server['host'].startswith('127.') and not host.startswith('127.'):
+        server['host'] = host  # 优先显示其他玩家也能连接的局域网地址
+
+    shard = reply.get('shard', 0)
+    if shard in server['shards_seen']:
+        return
+    server['shards_seen'].add(shard)
+    server['rooms'].extend(room for room in reply.get('rooms', []) if isinstance(room, dict))
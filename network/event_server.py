@@ -0,0 +1,243 @@
+"""
+事件循环游戏服务器
+单线程使用 selectors 复用所有客户端连接和定时任务，
+消息处理逻辑完全复用 GameServer.process_message；
+观战者分发队列在每轮事件处理之后分批发送，不使用单独的线程
+"""
+
+import selectors
+import socket
+import threading
+from typing import Dict, Optional
+
+from .server import GameServer
+from .outbound import OutboundQueue
+from .framing import FrameDecoder, FrameError, RECV_CHUNK_SIZE
+
+class EventLoopGameServer(GameServer):
+    """基于 selectors 的单线程事件循环服务器"""
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 29188):
+        super().__init__(host, port)
+        self.selector: Optional[selectors.BaseSelector] = None
+        self.connections: Dict[socket.socket, dict] = {}  # client_socket -> 连接缓冲区
+        self.loop_thread: Optional[threading.Thread] = None
+        self.recv_scratch = memoryview(bytearray(RECV_CHUNK_SIZE))  # 所有连接共用的接收缓冲区
+
+        # 用于从其他线程唤醒事件循环（例如 stop）
+        self._wakeup_recv: Optional[socket.socket] = None
+        self._wakeup_send: Optional[socket.socket] = None
+
+    def start(self):
+        """启动服务器（事件循环运行在单个后台线程中）"""
+        self.setup()
+        self.loop_thread = threading.Thread(target=self.serve_forever)
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+
+    def setup(self):
+        """创建监听socket和selector"""
+        self.setup_loop()
+
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(128)
+        self.server_socket.setblocking(False)
+        self.selector.register(self.server_socket, selectors.EVENT_READ, self.accept_ready)
+
+        print(f"服务器启动在 {self.host}:{self.port} (事件循环模式)")
+
+    def setup_loop(self):
+        """创建selector和唤醒socket"""
+        self.selector = selectors.DefaultSelector()
+
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ, self.wakeup_ready)
+
+        self.running = True
+        self.start_metrics()
+        self.start_journal()
+        self.start_store()
+
+        # 发现探测在事件循环中应答，读取房间信息无需跨线程
+        self.discovery = self.create_discovery()
+        if self.discovery is not None:
+            try:
+                discovery_socket = self.discovery.open()
+                discovery_socket.setblocking(False)
+                self.selector.register(discovery_socket, selectors.EVENT_READ, self.discovery.handle_ready)
+            except OSError as e:
+                print(f"局域网发现服务启动失败: {e}")
+                self.discovery.stop()
+                self.discovery = None
+
+    def serve_forever(self):
+        """事件循环主体"""
+        while self.running:
+            # 睡眠到最近的定时器截止时间；没有定时器时一直等待事件。
+            # 还有待分发的观战者帧时只检查不等待
+            timeout = 0 if self.fanout.has_pending() else self.scheduler.time_until_next()
+            try:
+                events = self.selector.select(timeout)
+            except OSError as e:
+                if self.running:
+                    print(f"事件循环select错误: {e}")
+                break
+
+            for key, mask in events:
+                callback = key.data
+                try:
+                    callback(key.fileobj, mask)
+                except Exception as e:
+                    print(f"事件处理错误: {e}")
+
+            # 定时任务：只处理已到期的超时定时器
+            self.scheduler.run_expired()
+
+            # 观战者优先级最低：处理完玩家消息和定时任务后才分批发送
+            self.fanout.drain()
+
+        self.close_all()
+
+    def accept_ready(self, server_socket: socket.socket, mask: int):
+        """监听socket可读：接受所有待处理连接"""
+        while True:
+            try:
+                client_socket, address = server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if self.running:
+                    print(f"接受连接错误: {e}")
+                return
+
+            reason = self.admission.admit(len(self.clients))
+            if reason:
+                self.reject_connection(client_socket, address, reason)
+                continue
+            print(f"新连接来自: {address}")
+            self.adopt_connection(client_socket, address)
+
+    def adopt_connection(self, client_socket: socket.socket, address) -> dict:
+        """登记连接并加入事件循环"""
+        player_id = self.register_client(client_socket, address)
+        conn = self.connections[client_socket] = {
+            'player_id': player_id,
+            'address': address,
+            'decoder': FrameDecoder(),
+            'outbox': self.clients[client_socket]['outbox'],
+            'events': selectors.EVENT_READ
+        }
+        self.selector.register(client_socket, selectors.EVENT_READ, self.client_ready)
+        return conn
+
+    def wakeup_ready(self, wakeup_socket: socket.socket, mask: int):
+        """清空唤醒socket"""
+        try:
+            wakeup_socket.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def client_ready(self, client_socket: socket.socket, mask: int):
+        """客户端socket可读或可写"""
+        conn = self.connections.get(client_socket)
+        if conn is None:
+            return
+
+        if mask & selectors.EVENT_WRITE:
+            try:
+                drained = conn['outbox'].flush(client_socket)
+            except OSError as e:
+                conn['outbox'].close()
+                self.handle_send_error(client_socket, e)
+                drained = True
+            if drained:
+                self.set_events(client_socket, conn, selectors.EVENT_READ)
+
+        if mask & selectors.EVENT_READ and client_socket in self.connections:
+            self.read_from_client(client_socket, conn)
+
+    def read_from_client(self, client_socket: socket.socket, conn: dict):
+        """读取数据并处理所有完整的消息"""
+        try:
+            frames = conn['decoder'].recv_from(client_socket, self.recv_scratch)
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, FrameError) as e:
+            print(f"客户端处理错误 {conn['address']}: {e}")
+            frames = None
+
+        if frames is None:
+            self.disconnect_client(client_socket, conn['player_id'])
+            return
+
+        self.handle_frames(client_socket, conn, frames)
+
+    def handle_frames(self, client_socket: socket.socket, conn: dict, frames):
+        """依次处理完整的消息帧"""
+        for frame in frames:
+            if client_socket not in self.connections:
+                break
+            self.dispatch_frame(client_socket, conn['player_id'], frame)
+
+    def watch_writable(self, client_socket: socket.socket, outbox: OutboundQueue):
+        """发送队列有积压时关注可写事件"""
+        conn = self.connections.get(client_socket)
+        if conn is not None:
+            self.set_events(client_socket, conn, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    def set_events(self, client_socket: socket.socket, conn: dict, events: int):
+        """仅在关注的事件变化时才修改selector，避免多余的系统调用"""
+        if conn['events'] == events:
+            return
+        try:
+            self.selector.modify(client_socket, events, self.client_ready)
+            conn['events'] = events
+        except (KeyError, ValueError):
+            pass
+
+    def forget_connection(self, client_socket: socket.socket):
+        """从selector和连接表中移除socket"""
+        if self.connections.pop(client_socket, None) is not None:
+            try:
+                self.selector.unregister(client_socket)
+            except (KeyError, ValueError):
+                pass
+
+    def close_client_socket(self, client_socket: socket.socket, client_info):
+        """先从selector注销再释放socket"""
+        self.forget_connection(client_socket)
+        super().close_client_socket(client_socket, client_info)
+
+    def close_all(self):
+        """关闭所有连接和selector"""
+        for client_socket in list(self.connections.keys()):
+            self.forget_connection(client_socket)
+            self.close_client_socket(client_socket, self.clients.pop(client_socket, None))
+
+        self.stop_discovery()
+        self.stop_journal()
+        self.stop_store()
+        for sock in (self.server_socket, self._wakeup_recv, self._wakeup_send):
+            if sock:
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+
+        if self.selector:
+            self.selector.close()
+
+    def stop(self):
+        """停止服务器"""
+        self.running = False
+        self.stop_metrics()
+        if self._wakeup_send:
+            try:
+                self._wakeup_send.send(b'\0')
+            except OSError:
+                pass
+        if self.loop_thread and self.loop_thread.is_alive() and self.loop_thread is not threading.current_thread():
+            self.loop_thread.join(timeout=2.0)
@@ -0,0 +1,125 @@
+"""
+消息分帧
+服务器和客户端共用的流式分帧编解码，同一条连接上可以混合两种帧：
+- JSON帧：一行JSON，以换行符结尾
+- 二进制帧：魔数字节 0xFB + u16长度 + 二进制负载（0xFB 不可能出现在UTF-8文本开头）
+解码器使用 bytearray 增量重组，一次 recv 中粘在一起的多条消息和
+跨多次 recv 的半条消息都能被正确还原，且总开销与字节数成正比。
+"""
+
+import socket
+import struct
+from typing import List, Optional
+
+from .protocol import NetworkMessage
+from .codec import CODEC_JSON, CODEC_BINARY, encode_binary, decode_binary
+
+FRAME_DELIMITER = b'\n'
+BINARY_MAGIC = 0xFB
+BINARY_HEADER = struct.Struct('!BH')
+MAX_BINARY_PAYLOAD = 0xFFFF
+RECV_CHUNK_SIZE = 65536
+MAX_FRAME_SIZE = 1024 * 1024  # 单帧最大1MB，防止恶意客户端撑爆缓冲区
+
+class FrameError(ValueError):
+    """帧格式错误（例如超过最大帧长度）"""
+
+def encode_frame(payload: bytes) -> bytes:
+    """将一段负载编码为一帧"""
+    return payload + FRAME_DELIMITER
+
+def encode_message(message: NetworkMessage, codec: str = CODEC_JSON) -> bytes:
+    """按指定编码将消息编码为一帧"""
+    if codec == CODEC_BINARY:
+        payload = encode_binary(message)
+        if len(payload) <= MAX_BINARY_PAYLOAD:
+            return BINARY_HEADER.pack(BINARY_MAGIC, len(payload)) + payload
+        # 超长消息退回JSON帧，解码端可以自动识别
+    return encode_frame(message.to_json().encode('utf-8'))
+
+def decode_message(frame: bytes) -> Optional[NetworkMessage]:
+    """将一帧解码为消息，格式错误时返回None"""
+    if frame[0] == BINARY_MAGIC:
+        return decode_binary(frame[BINARY_HEADER.size:])
+    try:
+        return NetworkMessage.from_json(frame.decode('utf-8'))
+    except UnicodeDecodeError:
+        return None
+
+class FrameDecoder:
+    """增量帧解码器"""
+
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+        self.scan_pos = 0  # 缓冲区中此位置之前已确认没有分隔符
+        self._scratch: Optional[memoryview] = None  # 按需分配的接收缓冲区
+
+    def feed(self, data) -> List[bytes]:
+        """追加收到的数据，返回其中所有完整的帧"""
+        self.buffer += data
+        return self.pop_frames()
+
+    def recv_from(self, sock: socket.socket, scratch: Optional[memoryview] = None) -> Optional[List[bytes]]:
+        """
+        从socket读取一次数据并返回完整的帧
+
+        Args:
+            sock (socket.socket): 要读取的socket
+            scratch (memoryview): 可选的共享接收缓冲区（事件循环中所有连接共用一块）
+
+        Returns:
+            list: 完整帧列表（可能为空）；对端关闭连接时返回None
+        """
+        if scratch is None:
+            if self._scratch is None:
+                self._scratch = memoryview(bytearray(RECV_CHUNK_SIZE))
+            scratch = self._scratch
+        received = sock.recv_into(scratch)
+        if received == 0:
+            return None
+        return self.feed(scratch[:received])
+
+    def pop_frames(self) -> List[bytes]:
+        """取出缓冲区中所有完整的帧"""
+        buffer = self.buffer
+        size = len(buffer)
+        frames = []
+        start = 0
+        pending_line = False
+        while start < size:
+            if buffer[start] == BINARY_MAGIC:
+                # 二进制帧：按长度前缀截取，帧内容保留头部以便解码时识别
+                if size - start < BINARY_HEADER.size:
+                    break
+                _, length = BINARY_HEADER.unpack_from(buffer, start)
+                end = start + BINARY_HEADER.size + length
+                if end > size:
+                    break
+                frames.append(bytes(buffer[start:end]))
+                start = end
+                continue
+
+            end = buffer.find(FRAME_DELIMITER, max(start, self.scan_pos))
+            if end < 0:
+                pending_line = True
+                break
+            if end > start:
+                frames.append(bytes(buffer[start:end]))
+            start = end + 1
+
+        # 每次只整体前移一次缓冲区，避免逐条切片带来的二次方开销
+        if start:
+            del buffer[:start]
+        # 只有剩余的半帧是文本行时，才记住已扫描过的位置
+        self.scan_pos = len(buffer) if pending_line else 0
+
+        if len(buffer) > self.max_frame_size:
+            self.reset()
+            raise FrameError(f"帧长度超过上限 {self.max_frame_size} 字节")
+        return frames
+
+    def reset(self):
+        """清空缓冲区"""
+        self.buffer.clear()
+        self.scan_pos = 0
@@ -0,0 +1,485 @@
+"""
+不停服升级：新旧服务器进程之间交接连接和房间状态
+服务器以 --handoff-socket PATH 启动时在该 Unix socket 上等待继任进程；
+用同样的参数启动新版本，新进程发现旧进程仍在运行，就连接该路径请求接管：
+
+1. 旧进程暂停事件循环，把观战者队列和发送队列尽量写完
+2. 通过 Unix socket 传递监听socket和所有客户端socket的文件描述符（SCM_RIGHTS），
+   连同序列化的 clients / GameRoom 状态（名单、会话、广播记录、状态版本、定时器剩余时间、
+   解码器中的半帧和发送队列中尚未写出的字节）
+3. 新进程重建状态后回复完成，旧进程关闭自己的后台服务（管理端口、发现、日志、状态持久化）并退出，
+   新进程随后启动这些服务并开始处理事件
+
+TCP连接从未断开，交接期间客户端发来的数据留在内核缓冲区中由新进程读取，玩家只会感到短暂的延迟。
+新进程在重建状态之前失败时，旧进程继续运行，不影响任何连接。
+
+只支持事件循环模式的单进程服务器；需要 socket.send_fds（Unix 平台，Python 3.9+）。
+"""
+
+import base64
+import json
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from .protocol import NetworkMessage
+from .event_server import EventLoopGameServer
+from .server import GameRoom, SERVER_VERSION
+from .outbound import OutboundQueue
+from .framing import FrameDecoder
+from .state_sync import StateTracker
+from game.server_game_logic import ServerGameLogic
+
+HANDOFF_SUPPORTED = hasattr(socket, 'send_fds') and hasattr(socket, 'AF_UNIX')
+
+HANDOFF_FORMAT = 1
+HANDOFF_TIMEOUT = 10.0  # 交接过程中等待对方的最长时间（秒）
+FD_BATCH = 200  # 每条消息携带的文件描述符数量（Linux 单条消息上限为253）
+COUNT = struct.Struct('<I')
+RECV_CHUNK = 65536
+
+# 控制字节
+HANDOFF_REQUEST = b'T'  # 新进程 -> 旧进程：请求接管
+HANDOFF_DONE = b'D'  # 新进程 -> 旧进程：状态已重建
+HANDOFF_CLOSED = b'C'  # 旧进程 -> 新进程：后台服务已关闭，可以启动
+
+def send_handoff(channel: socket.socket, state: dict, fds: List[int]):
+    """发送文件描述符（分批，每批前缀为数量，以数量0结束）和长度前缀的JSON状态"""
+    for start in range(0, len(fds), FD_BATCH):
+        batch = fds[start:start + FD_BATCH]
+        socket.send_fds(channel, [COUNT.pack(len(batch))], batch)
+    payload = json.dumps(state, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    channel.sendall(COUNT.pack(0) + COUNT.pack(len(payload)) + payload)
+
+def _recv_exact(channel: socket.socket, size: int, fds: List[int]) -> bytes:
+    """读取恰好 size 字节，途中收到的文件描述符追加到 fds"""
+    chunks = []
+    while size:
+        data, received, _, _ = socket.recv_fds(channel, min(size, RECV_CHUNK), FD_BATCH)
+        fds.extend(received)
+        if not data:
+            raise ConnectionError("交接通道被关闭")
+        chunks.append(data)
+        size -= len(data)
+    return b''.join(chunks)
+
+def recv_handoff(channel: socket.socket) -> Tuple[dict, List[int]]:
+    """接收 send_handoff 发送的状态和文件描述符"""
+    fds: List[int] = []
+    try:
+        expected = 0
+        while True:
+            count, = COUNT.unpack(_recv_exact(channel, COUNT.size, fds))
+            if count == 0:
+                break
+            expected += count
+        length, = COUNT.unpack(_recv_exact(channel, COUNT.size, fds))
+        state = json.loads(_recv_exact(channel, length, fds).decode('utf-8'))
+        if len(fds) != expected or state.get('socket_count') != expected:
+            raise ValueError(f"收到 {len(fds)} 个文件描述符，预期 {expected} 个")
+    except BaseException:
+        for fd in fds:
+            os.close(fd)
+        raise
+    return state, fds
+
+class HandoffGameServer(EventLoopGameServer):
+    """可以把连接交给新进程、也可以从旧进程接管连接的事件循环服务器"""
+
+    def __init__(self, handoff_path: str, host: str = '0.0.0.0', port: int = 29188):
+        super().__init__(host, port)
+        self.handoff_path = handoff_path
+        self.handoff_socket: Optional[socket.socket] = None  # 等待继任进程的Unix socket
+        self.handoff_inode: Optional[int] = None  # 用于判断路径是否仍指向本进程的socket
+        self.handed_off = False  # 连接已交给新进程
+
+    def setup(self):
+        """旧进程仍在运行时接管它的连接，否则正常启动；之后等待下一个继任进程"""
+        if not HANDOFF_SUPPORTED:
+            raise RuntimeError("当前平台不支持在进程间传递socket，无法使用不停服升级")
+        channel = self.connect_predecessor()
+        if channel is None:
+            super().setup()
+        else:
+            self.take_over(channel)
+        self.listen_for_successor()
+
+    def connect_predecessor(self) -> Optional[socket.socket]:
+        """连接旧进程的交接socket，没有旧进程在运行时返回None"""
+        channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            channel.connect(self.handoff_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            # 没有旧进程，或旧进程已崩溃留下了失效的路径
+            channel.close()
+            return None
+        return channel
+
+    def listen_for_successor(self):
+        """在交接路径上等待继任进程（先绑定临时路径再原子替换，路径始终可连接）"""
+        temp_path = f"{self.handoff_path}.{os.getpid()}"
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(temp_path)
+        # 接管者可以读取所有连接和房间，只允许同一用户连接
+        os.chmod(temp_path, 0o600)
+        listener.listen(1)
+        os.replace(temp_path, self.handoff_path)
+        self.handoff_inode = os.stat(self.handoff_path).st_ino
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, self.successor_ready)
+        self.handoff_socket = listener
+        print(f"不停服升级：用相同参数启动新进程即可接管 ({self.handoff_path})")
+
+    # ---- 旧进程：交出连接 ----
+
+    def successor_ready(self, listener: socket.socket, mask: int):
+        """继任进程请求接管：交出所有连接和状态，成功后停止事件循环"""
+        try:
+            channel, _ = listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        channel.settimeout(HANDOFF_TIMEOUT)
+        start = time.perf_counter()
+        try:
+            if channel.recv(1) != HANDOFF_REQUEST:
+                channel.close()
+                return
+            print("新进程请求接管，开始交接连接和房间状态")
+            while self.fanout.has_pending():
+                self.fanout.drain()
+            self.flush_outboxes()
+            state, sockets = self.export_handoff()
+            send_handoff(channel, state, [sock.fileno() for sock in sockets])
+            if channel.recv(1) != HANDOFF_DONE:
+                raise ConnectionError("新进程未完成接管")
+        except (OSError, ValueError) as e:
+            print(f"交接失败，继续运行: {e}")
+            channel.close()
+            return
+
+        clients, rooms = len(state['clients']), len(state['rooms'])
+        self.release_handed_off()
+        # 新进程启动管理端口、日志和状态持久化之前，本进程先关闭它们
+        self.stop_metrics()
+        self.stop_discovery()
+        self.stop_journal()
+        self.stop_store()
+        try:
+            channel.sendall(HANDOFF_CLOSED)
+        except OSError:
+            pass
+        channel.close()
+        self.handed_off = True
+        self.running = False
+        print(f"已把 {clients} 个连接、{rooms} 个房间交给新进程，"
+              f"用时 {(time.perf_counter() - start) * 1000:.0f} 毫秒")
+
+    def flush_outboxes(self):
+        """非阻塞地尽量写完所有发送队列，剩余的字节随交接状态转交"""
+        for client_socket, conn in list(self.connections.items()):
+            try:
+                conn['outbox'].flush(client_socket)
+            except OSError:
+                pass
+
+    def export_handoff(self) -> Tuple[dict, List[socket.socket]]:
+        """
+        导出交接状态（在事件循环线程中调用）
+
+        Returns:
+            tuple: (状态, socket列表)，状态中的socket以列表下标表示，下标0为监听socket
+        """
+        sockets = [self.server_socket]
+        indexes = {}
+        now = time.monotonic()
+
+        clients = []
+        for client_socket, client_info in self.clients.items():
+            conn = self.connections.get(client_socket)
+            if conn is None:
+                continue
+            indexes[client_socket] = len(sockets)
+            sockets.append(client_socket)
+            outbox = client_info['outbox']
+            clients.append({
+                'socket': indexes[client_socket],
+                'player_id': client_info['player_id'],
+                'address': list(client_info['address']),
+                'codec': client_info['codec'],
+                'slow': client_info['slow'],
+                'spectating': client_info['spectating'],
+                'high_water': outbox.high_water,
+                'buffered': base64.b64encode(bytes(conn['decoder'].buffer)).decode('ascii'),
+                'unsent': base64.b64encode(outbox.unsent()).decode('ascii')
+            })
+
+        rooms = []
+        for room in list(self.rooms.values()):
+            with room.lock:
+                if room.closed:
+                    continue
+                record = self.export_room(room)
+                tracker = room.state_tracker
+                record.update({
+                    'room_id': room.room_id,
+                    'current_player': room.current_player,
+                    'outbound_log': [[seq, message.to_json(), exclude]
+                                     for seq, message, exclude in room.outbound_log],
+                    'sockets': {pid: indexes.get(pinfo['socket']) for pid, pinfo in room.players.items()},
+                    'spectators': [{
+                        'id': info['id'],
+                        'name': info['name'],
+                        'codec': info['codec'],
+                        'socket': indexes[info['socket']]
+                    } for info in room.spectators.values() if info['socket'] in indexes],
+                    'tracker': {
+                        'version': tracker.version,
+                        'history': [[version, saved] for version, saved in tracker.history.items()],
+                        'acked': tracker.acked
+                    } if tracker else None,
+                    'timers': {
+                        'ai': self.scheduler.remaining(('ai', room), now),
+                        'restore': self.scheduler.remaining(('restore', room), now)
+                    }
+                })
+                rooms.append(record)
+
+        operation_timers = {}
+        for player_id in self.player_rooms:
+            remaining = self.scheduler.remaining(('operation', player_id), now)
+            if remaining is not None:
+                operation_timers[player_id] = remaining
+        session_timers = {}
+        for session_token in self.sessions:
+            remaining = self.scheduler.remaining(('session', session_token), now)
+            if remaining is not None:
+                session_timers[session_token] = remaining
+
+        state = {
+            'format': HANDOFF_FORMAT,
+            'version': SERVER_VERSION,
+            'discovery_id': self.discovery_id,
+            'socket_count': len(sockets),
+            'clients': clients,
+            'rooms': rooms,
+            'operation_timers': operation_timers,
+            'session_timers': session_timers
+        }
+        return state, sockets
+
+    def release_handed_off(self):
+        """交接完成：只关闭本进程持有的文件描述符（不能 shutdown，连接已属于新进程），清空所有状态"""
+        self.scheduler.clear()
+        for client_socket, conn in list(self.connections.items()):
+            conn['outbox'].close()
+            self.forget_connection(client_socket)
+            client_socket.close()
+        if self.server_socket:
+            try:
+                self.selector.unregister(self.server_socket)
+            except (KeyError, ValueError):
+                pass
+            self.server_socket.close()
+            self.server_socket = None
+        with self.lock:
+            for room in self.rooms.values():
+                room.closed = True
+            self.rooms.clear()
+            self.clients.clear()
+            self.player_rooms.clear()
+            self.sessions.clear()
+
+    # ---- 新进程：接管连接 ----
+
+    def take_over(self, channel: socket.socket):
+        """从旧进程接管监听socket、客户端连接和房间状态，然后启动事件循环的其余部分"""
+        channel.settimeout(HANDOFF_TIMEOUT)
+        start = time.perf_counter()
+        print(f"发现正在运行的旧进程，开始接管 ({self.handoff_path})")
+        channel.sendall(HANDOFF_REQUEST)
+        state, fds = recv_handoff(channel)
+        if state.get('format') != HANDOFF_FORMAT:
+            for fd in fds:
+                os.close(fd)
+            channel.close()
+            raise RuntimeError(f"不支持的交接格式: {state.get('format')}")
+        if state.get('version') != SERVER_VERSION:
+            print(f"旧进程版本 v{state.get('version')}，已连接的客户端保持原有会话")
+
+        inherited_frames = self.import_handoff(state, [socket.socket(fileno=fd) for fd in fds])
+        channel.sendall(HANDOFF_DONE)
+        try:
+            channel.recv(1)  # 等待旧进程释放管理端口和状态目录
+        except OSError:
+            pass
+        channel.close()
+
+        self.setup_loop()
+        self.server_socket.setblocking(False)
+        self.selector.register(self.server_socket, selectors.EVENT_READ, self.accept_ready)
+        for client_socket, conn in self.connections.items():
+            if conn['outbox'].has_pending():
+                conn['events'] = selectors.EVENT_READ | selectors.EVENT_WRITE
+            self.selector.register(client_socket, conn['events'], self.client_ready)
+        for room in list(self.rooms.values()):
+            with room.lock:
+                if self.journal:
+                    room.journal_writer = self.journal
+                    room.journal = self.journal.open_room(room.room_id)
+                self.persist_room(room)
+        for client_socket, frames in inherited_frames:
+            conn = self.connections.get(client_socket)
+            if conn is not None:
+                self.handle_frames(client_socket, conn, frames)
+
+        print(f"服务器启动在 {self.host}:{self.port} (事件循环模式，从旧进程接管 "
+              f"{len(self.connections)} 个连接、{len(self.rooms)} 个房间，"
+              f"用时 {(time.perf_counter() - start) * 1000:.0f} 毫秒)")
+
+    def import_handoff(self, state: dict, sockets: List[socket.socket]) -> list:
+        """
+        按交接状态重建连接、房间、会话和定时器（尚未注册到selector）
+
+        Returns:
+            list: (socket, 帧列表)，旧进程缓冲区中已完整但尚未处理的帧
+        """
+        self.server_socket = sockets[0]
+        self.discovery_id = state.get('discovery_id', self.discovery_id)
+        now = time.monotonic()
+
+        inherited_frames = []
+        for saved in state['clients']:
+            client_socket = sockets[saved['socket']]
+            client_socket.setblocking(False)
+            player_id = saved['player_id']
+            address = tuple(saved['address'])
+            outbox = OutboundQueue(saved['high_water'])
+            self.clients[client_socket] = {
+                'player_id': player_id,
+                'address': address,
+                'socket': client_socket,
+                'last_seen': now,
+                'codec': saved['codec'],
+                'outbox': outbox,
+                'slow': saved['slow'],
+                'spectating': saved['spectating'],
+                'limiter': self.rate_limits.create_limiter()
+            }
+            decoder = FrameDecoder()
+            frames = decoder.feed(base64.b64decode(saved['buffered']))
+            if frames:
+                inherited_frames.append((client_socket, frames))
+            self.connections[client_socket] = {
+                'player_id': player_id,
+                'address': address,
+                'decoder': decoder,
+                'outbox': outbox,
+                'events': selectors.EVENT_READ
+            }
+            unsent = base64.b64decode(saved['unsent'])
+            if unsent:
+                try:
+                    outbox.push(client_socket, unsent)
+                except OSError as e:
+                    outbox.close()
+                    self.handle_send_error(client_socket, e)
+            self.scheduler.schedule(('heartbeat', client_socket), now + self.heartbeat_timeout,
+                                    self.on_heartbeat_timeout, client_socket, player_id)
+
+        for record in state['rooms']:
+            self.import_room(record, sockets, now)
+
+        for player_id, remaining in state.get('operation_timers', {}).items():
+            self.scheduler.schedule(('operation', player_id), now + remaining,
+                                    self.on_operation_timeout, player_id)
+        for session_token, remaining in state.get('session_timers', {}).items():
+            self.scheduler.schedule(('session', session_token), now + remaining,
+                                    self.on_session_expired, session_token)
+        return inherited_frames
+
+    def import_room(self, record: dict, sockets: List[socket.socket], now: float):
+        """重建一个房间，玩家和观战者直接使用接管的连接"""
+        room_id = record['room_id']
+        room = GameRoom(room_id, record.get('max_players', 4),
+                        lock=self.metrics.timed_lock(threading.RLock(), 'room'))
+        room.host_id = record['host_id']
+        room.game_started = record['game_started']
+        room.current_player = record.get('current_player', 0)
+        room.next_seq = record.get('next_seq', 1)
+        for seq, text, exclude in record.get('outbound_log', []):
+            message = NetworkMessage.from_json(text)
+            if message is not None:
+                room.outbound_log.append((seq, message, exclude))
+
+        if record.get('game'):
+            room.game = ServerGameLogic.from_state(record['game'])
+            tracker = room.state_tracker = StateTracker()
+            saved_tracker = record.get('tracker')
+            if saved_tracker:
+                tracker.version = saved_tracker['version']
+                for version, saved in saved_tracker['history']:
+                    tracker.history[version] = saved
+                tracker.acked = dict(saved_tracker['acked'])
+            else:
+                tracker.version = record.get('state_version', 0)
+                tracker.commit(room.game.get_game_state())
+
+        player_sockets = record.get('sockets', {})
+        with self.lock:
+            self.rooms[room_id] = room
+            for saved in record['players']:
+                player_id = saved['id']
+                index = player_sockets.get(player_id)
+                room.players[player_id] = {
+                    'id': player_id,
+                    'name': saved['name'],
+                    'socket': sockets[index] if index is not None else None,
+                    'slot': saved['slot'],
+                    'version': saved.get('version'),
+                    'authoritative': saved.get('authoritative', False),
+                    'session_token': saved.get('session_token')
+                }
+                self.player_rooms[player_id] = room_id
+                if saved.get('session_token'):
+                    self.sessions[saved['session_token']] = player_id
+
+        for saved in record.get('spectators', []):
+            room.spectators[saved['id']] = {
+                'id': saved['id'],
+                'name': saved['name'],
+                'socket': sockets[saved['socket']],
+                'codec': saved['codec']
+            }
+        room.rebuild_spectator_targets()
+
+        timers = record.get('timers', {})
+        if timers.get('ai') is not None:
+            self.scheduler.schedule(('ai', room), now + timers['ai'], self.on_ai_turn, room)
+        if timers.get('restore') is not None:
+            self.scheduler.schedule(('restore', room), now + timers['restore'], self.on_restore_grace, room)
+
+    def restore_room(self, room_id: str, record: dict):
+        """状态日志中的房间已随交接状态接管时不再按持久化记录重建"""
+        if room_id in self.rooms:
+            return
+        super().restore_room(room_id, record)
+
+    def close_all(self):
+        """关闭交接socket；路径已被新进程替换时不删除"""
+        if self.handoff_socket:
+            self.handoff_socket.close()
+            self.handoff_socket = None
+            try:
+                if os.stat(self.handoff_path).st_ino == self.handoff_inode:
+                    os.unlink(self.handoff_path)
+            except OSError:
+                pass
+        super().close_all()
@@ -0,0 +1,343 @@
+"""
+房间消息日志
+按房间把服务器收发的每一条消息追加写入紧凑的二进制日志，用于联机不同步问题的事后分析，
+以及把真实流量回放到压力测试和基准测试中。
+
+文件格式（小端）：
+- 文件头：魔数 b'FMJ1'
+- 每条记录：RECORD_HEADER（负载长度、时间戳、回合号、方向、槽位）+ 负载（线上传输的原始帧）
+- 稀疏索引（同名 .idx 文件）：每个回合第一条记录的 (回合号, 偏移)
+
+写入方只把帧的引用放进内存队列（O(1)），由单独的写入线程分批写盘，
+事件循环和房间锁从不等待磁盘。读取方用 mmap 映射日志文件，可以按回合随机定位。
+"""
+
+import bisect
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .framing import decode_message
+
+JOURNAL_MAGIC = b'FMJ1'
+JOURNAL_SUFFIX = '.fmj'
+INDEX_SUFFIX = '.idx'
+RECORD_HEADER = struct.Struct('<IdIBB')  # 负载长度, 时间戳, 回合号, 方向, 槽位
+INDEX_ENTRY = struct.Struct('<IQ')  # 回合号, 偏移
+
+DIRECTION_IN = 0  # 客户端发给服务器
+DIRECTION_OUT = 1  # 服务器发给客户端
+SLOT_ROOM = 0xFF  # 房间广播（发给所有玩家）
+SLOT_NONE = 0xFE  # 尚未分配槽位的连接
+
+FLUSH_INTERVAL = 0.2  # 写入线程的最长写盘间隔（秒）
+FLUSH_BYTES = 256 * 1024  # 积压超过该字节数时立即唤醒写入线程
+
+def journal_file_name(room_id: str) -> str:
+    """日志文件名：房间ID（去掉不能用于文件名的字符）+ 创建时间 + 进程号"""
+    safe_room_id = re.sub(r'[^0-9A-Za-z_.-]', '_', room_id)[:64] or 'room'
+    return f"{safe_room_id}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}{JOURNAL_SUFFIX}"
+
+class RoomJournal:
+    """单个房间的日志：pending 由写入方追加，文件只由写入线程访问"""
+
+    def __init__(self, room_id: str, path: str):
+        self.room_id = room_id
+        self.path = path
+        self.pending: List[Tuple[float, int, int, int, bytes]] = []  # (时间戳, 回合, 方向, 槽位, 帧)
+        self.closed = False
+        self.file = None
+        self.index_file = None
+        self.offset = 0
+        self.last_indexed_turn = -1
+
+class JournalWriter:
+    """所有房间共用的日志写入线程"""
+
+    def __init__(self, directory: str, flush_interval: float = FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.journals: Dict[str, RoomJournal] = {}  # 文件路径 -> 日志（含已关闭待写完的）
+        self.pending_bytes = 0
+        self.bytes_written = 0
+        self.records_written = 0
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+
+    def open_room(self, room_id: str) -> RoomJournal:
+        """为新房间创建日志（文件由写入线程在第一次写盘时创建）"""
+        path = os.path.join(self.directory, journal_file_name(room_id))
+        with self.lock:
+            base, suffix = path[:-len(JOURNAL_SUFFIX)], 1
+            while path in self.journals or os.path.exists(path):
+                # 同一秒内重新创建的同名房间
+                path = f"{base}.{suffix}{JOURNAL_SUFFIX}"
+                suffix += 1
+            journal = self.journals[path] = RoomJournal(room_id, path)
+        return journal
+
+    def append(self, journal: RoomJournal, direction: int, slot: int, turn: int, frame: bytes):
+        """追加一条记录（只放入内存队列，不访问磁盘）"""
+        with self.lock:
+            if journal.closed:
+                return
+            journal.pending.append((time.time(), turn, direction, slot, frame))
+            self.pending_bytes += len(frame)
+            if self.pending_bytes >= FLUSH_BYTES:
+                self.ready.notify()
+
+    def close_room(self, journal: RoomJournal):
+        """房间关闭：写完剩余记录后关闭文件"""
+        with self.lock:
+            journal.closed = True
+
+    def start(self):
+        """创建日志目录并启动写入线程"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        print(f"房间消息日志写入目录: {self.directory}")
+
+    def run(self):
+        """写入线程主循环"""
+        while self.running:
+            with self.lock:
+                if self.running and self.pending_bytes < FLUSH_BYTES:
+                    self.ready.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"写入房间消息日志错误: {e}")
+
+    def flush(self):
+        """把所有积压的记录写盘"""
+        with self.lock:
+            batches = []
+            for journal in list(self.journals.values()):
+                if journal.pending or journal.closed:
+                    batches.append((journal, journal.pending, journal.closed))
+                    journal.pending = []
+                if journal.closed:
+                    del self.journals[journal.path]
+            self.pending_bytes = 0
+
+        # 写盘时不持有锁，写入方可以继续追加
+        for journal, records, closed in batches:
+            try:
+                if records:
+                    self.write_records(journal, records)
+            except OSError as e:
+                print(f"写入房间 {journal.room_id} 的消息日志失败: {e}")
+            if closed:
+                self.close_files(journal)
+
+    def write_records(self, journal: RoomJournal, records: List[Tuple[float, int, int, int, bytes]]):
+        """把一批记录追加到日志文件，并为新回合写入索引"""
+        if journal.file is None:
+            journal.file = open(journal.path, 'wb')
+            journal.index_file = open(journal.path + INDEX_SUFFIX, 'wb')
+            journal.file.write(JOURNAL_MAGIC)
+            journal.offset = len(JOURNAL_MAGIC)
+
+        chunks = []
+        index_chunks = []
+        offset = journal.offset
+        pack_header = RECORD_HEADER.pack
+        for timestamp, turn, direction, slot, frame in records:
+            if turn > journal.last_indexed_turn:
+                index_chunks.append(INDEX_ENTRY.pack(turn, offset))
+                journal.last_indexed_turn = turn
+            chunks.append(pack_header(len(frame), timestamp, turn, direction, slot))
+            chunks.append(frame)
+            offset += RECORD_HEADER.size + len(frame)
+
+        journal.file.write(b''.join(chunks))
+        journal.file.flush()
+        # 索引在记录之后写入，读取方看到的索引项总是指向已写入的记录
+        if index_chunks:
+            journal.index_file.write(b''.join(index_chunks))
+            journal.index_file.flush()
+        self.bytes_written += offset - journal.offset
+        self.records_written += len(records)
+        journal.offset = offset
+
+    def close_files(self, journal: RoomJournal):
+        """关闭房间的日志文件"""
+        for f in (journal.file, journal.index_file):
+            if f:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+        journal.file = journal.index_file = None
+
+    def stop(self):
+        """写完所有积压的记录并关闭文件"""
+        with self.lock:
+            self.running = False
+            for journal in self.journals.values():
+                journal.closed = True
+            self.ready.notify_all()
+        if self.thread and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5.0)
+        self.flush()
+
+class JournalRecord(NamedTuple):
+    """日志中的一条记录"""
+    offset: int
+    timestamp: float
+    turn: int
+    direction: int
+    slot: Optional[int]  # None 表示房间广播；SLOT_NONE 表示尚未分配槽位
+    frame: bytes
+
+    def message(self):
+        """解码为 NetworkMessage（格式错误时返回None）"""
+        return decode_message(self.frame)
+
+class JournalReader:
+    """
+    用 mmap 读取房间消息日志
+
+    用法：
+        with JournalReader(path) as reader:
+            for record in reader.records(start_turn=10):
+                print(record.turn, record.message().type)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < len(JOURNAL_MAGIC):
+            self.file.close()
+            raise ValueError(f"{path} 不是房间消息日志（文件过短）")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+            self.close()
+            raise ValueError(f"{path} 不是房间消息日志")
+        self.index_turns: List[int] = []
+        self.index_offsets: List[int] = []
+        self.load_index()
+
+    def load_index(self):
+        """读取稀疏索引，并扫描最后一个索引项之后的记录补全（索引文件缺失时扫描整个日志）"""
+        turns, offsets = [], []
+        try:
+            with open(self.path + INDEX_SUFFIX, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            raw = b''
+        usable = len(raw) - len(raw) % INDEX_ENTRY.size
+        for turn, offset in INDEX_ENTRY.iter_unpack(raw[:usable]):
+            if offset >= len(self.data) or (turns and turn <= turns[-1]):
+                break
+            turns.append(turn)
+            offsets.append(offset)
+        self.index_turns, self.index_offsets = turns, offsets
+        self.extend_index(offsets[-1] if offsets else len(JOURNAL_MAGIC))
+
+    def extend_index(self, offset: int):
+        """从 offset 开始扫描，为尚未索引的回合添加索引项"""
+        turns, offsets = self.index_turns, self.index_offsets
+        for record in self.iter_from(offset):
+            if not turns or record.turn > turns[-1]:
+                turns.append(record.turn)
+                offsets.append(record.offset)
+
+    def turns(self) -> List[int]:
+        """日志中出现的回合号"""
+        return list(self.index_turns)
+
+    def seek_turn(self, turn: int) -> int:
+        """返回回合号不小于 turn 的第一条记录的偏移"""
+        position = bisect.bisect_left(self.index_turns, turn)
+        if position < len(self.index_offsets):
+            return self.index_offsets[position]
+        return len(self.data)
+
+    def read_at(self, offset: int) -> Optional[JournalRecord]:
+        """读取指定偏移处的记录；末尾或写了一半的记录返回None"""
+        end = offset + RECORD_HEADER.size
+        if end > len(self.data):
+            return None
+        length, timestamp, turn, direction, slot = RECORD_HEADER.unpack_from(self.data, offset)
+        if end + length > len(self.data):
+            return None
+        return JournalRecord(offset, timestamp, turn, direction, None if slot == SLOT_ROOM else slot,
+                             self.data[end:end + length])
+
+    def records(self, start_turn: Optional[int] = None, end_turn: Optional[int] = None) -> Iterator[JournalRecord]:
+        """
+        按顺序遍历记录
+
+        Args:
+            start_turn: 从该回合开始（经索引直接定位，不扫描之前的记录）
+            end_turn: 到该回合为止（包含）
+        """
+        offset = len(JOURNAL_MAGIC) if start_turn is None else self.seek_turn(start_turn)
+        for record in self.iter_from(offset):
+            if end_turn is not None and record.turn > end_turn:
+                return
+            yield record
+
+    def iter_from(self, offset: int) -> Iterator[JournalRecord]:
+        """从指定偏移开始遍历记录，遇到文件末尾或写了一半的记录时停止"""
+        while True:
+            record = self.read_at(offset)
+            if record is None:
+                return
+            yield record
+            offset += RECORD_HEADER.size + len(record.frame)
+
+    def close(self):
+        """关闭映射和文件"""
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def list_journals(directory: str, room_id: Optional[str] = None) -> List[str]:
+    """列出目录中的日志文件（按文件名排序，即按房间和创建时间）"""
+    paths = []
+    prefix = re.sub(r'[^0-9A-Za-z_.-]', '_', room_id) + '-' if room_id else ''
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(JOURNAL_SUFFIX) and name.startswith(prefix):
+            paths.append(os.path.join(directory, name))
+    return paths
+
+def main():
+    """打印日志内容：python -m network.journal <日志文件> [--turn N] [--end-turn M]"""
+    import argparse
+    parser = argparse.ArgumentParser(description="查看房间消息日志")
+    parser.add_argument('path', help="日志文件（.fmj）")
+    parser.add_argument('--turn', type=int, default=None, help="从该回合开始")
+    parser.add_argument('--end-turn', type=int, default=None, help="到该回合为止")
+    args = parser.parse_args()
+
+    with JournalReader(args.path) as reader:
+        turns = reader.turns()
+        print(f"{args.path}: 回合 {turns[0] if turns else '-'} ~ {turns[-1] if turns else '-'}")
+        for record in reader.records(args.turn, args.end_turn):
+            message = record.message()
+            arrow = '->' if record.direction == DIRECTION_IN else '<-'
+            target = '房间' if record.slot is None else ('-' if record.slot == SLOT_NONE else f"玩家{record.slot + 1}")
+            msg_type = message.type.value if message else '无效'
+            data = message.data if message else bytes(record.frame[:32])
+            print(f"{time.strftime('%H:%M:%S', time.localtime(record.timestamp))} "
+                  f"回合{record.turn} {target} {arrow} {msg_type} {data}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+往返延迟和时钟偏差估计
+PING 携带客户端发送时刻 t0，PONG 回带 t0 以及服务器收到 PING 的时刻 t1 和发出 PONG 的时刻 t2，
+客户端收到 PONG 的时刻为 t3（都是各自进程的 time.monotonic()）：
+- 往返延迟 rtt = (t3 - t0) - (t2 - t1)，扣除服务器的处理时间
+- 时钟偏差 offset = ((t1 - t0) + (t2 - t3)) / 2，即服务器时钟减客户端时钟
+  （假设上下行延迟相同；往返延迟越小的样本越准确，因此取最近几个样本中往返延迟最小的一个）
+- 平滑往返延迟按 RFC 6298 计算，抖动按 RFC 3550 计算（相邻两次往返延迟之差的平滑值）
+"""
+
+from collections import deque
+from typing import Optional
+
+OFFSET_WINDOW = 8  # 时钟偏差取最近多少个样本中往返延迟最小的一个
+
+class LatencyEstimator:
+    """根据带时间戳的 PING/PONG 估计往返延迟、抖动和时钟偏差（单位均为秒）"""
+
+    def __init__(self, window: int = OFFSET_WINDOW):
+        self.samples = 0
+        self.rtt: Optional[float] = None  # 最近一次的往返延迟
+        self.srtt: Optional[float] = None  # 平滑往返延迟
+        self.rttvar: Optional[float] = None  # 往返延迟的平均偏差
+        self.jitter = 0.0
+        self.min_rtt: Optional[float] = None
+        self.offset: Optional[float] = None
+        self.recent = deque(maxlen=window)  # (rtt, offset)
+
+    def add_sample(self, t0: float, t1: float, t2: float, t3: float):
+        """记录一次 PING/PONG 的四个时刻"""
+        rtt = max(0.0, (t3 - t0) - (t2 - t1))
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        if self.rtt is not None:
+            self.jitter += (abs(rtt - self.rtt) - self.jitter) / 16
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += (abs(self.srtt - rtt) - self.rttvar) / 4
+            self.srtt += (rtt - self.srtt) / 8
+        self.rtt = rtt
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        self.recent.append((rtt, offset))
+        self.offset = min(self.recent)[1]
+        self.samples += 1
+
+    def server_time(self, local_time: float) -> Optional[float]:
+        """把本地 time.monotonic() 换算为服务器的 time.monotonic()（尚无样本时返回None）"""
+        if self.offset is None:
+            return None
+        return local_time + self.offset
+
+    def snapshot(self) -> dict:
+        """获取当前的估计值"""
+        return {
+            'samples': self.samples,
+            'rtt': self.rtt,
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'jitter': self.jitter,
+            'min_rtt': self.min_rtt,
+            'offset': self.offset
+        }
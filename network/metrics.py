@@ -0,0 +1,327 @@
+"""
+服务器运行指标
+进程内的指标注册表：计数器、直方图、每秒速率和按需计算的瞬时值。
+通过本地管理端口以纯文本（GET /metrics）或JSON（GET /metrics.json）查看，
+也可以定期把JSON快照写入文件，用于在压力测试中发现性能回退。
+
+所有指标都可以带标签，例如 messages_in{type="dice_roll"}。
+"""
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+RATE_WINDOW = 10  # 每秒速率按最近多少秒计算
+
+def _label_key(labels: dict) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+def _format_name(name: str, labels: Tuple) -> str:
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+class Histogram:
+    """固定分桶的直方图"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'total', 'lock')
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶是 +Inf
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        """记录一个观测值"""
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+
+    def quantile(self, q: float) -> float:
+        """按桶估算分位数（返回所在桶的上限）"""
+        with self.lock:
+            if not self.count:
+                return 0.0
+            target = q * self.count
+            seen = 0
+            for bound, n in zip(self.buckets, self.counts):
+                seen += n
+                if seen >= target:
+                    return bound
+        return float('inf')
+
+    def snapshot(self) -> dict:
+        """获取直方图数据"""
+        with self.lock:
+            counts = list(self.counts)
+            count, total = self.count, self.total
+        cumulative = 0
+        buckets = {}
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            buckets[str(bound)] = cumulative
+        buckets['+Inf'] = count
+        return {
+            'count': count,
+            'sum': total,
+            'avg': total / count if count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': buckets
+        }
+
+class RateMeter:
+    """按秒分桶统计最近 RATE_WINDOW 秒的平均每秒数量"""
+
+    __slots__ = ('window', 'slots', 'total', 'lock')
+
+    def __init__(self, window: int = RATE_WINDOW):
+        self.window = window
+        self.slots = [(0, 0)] * window  # (秒, 数量)
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def add(self, amount: int, now: Optional[float] = None):
+        """累加数量"""
+        second = int(time.monotonic() if now is None else now)
+        index = second % self.window
+        with self.lock:
+            slot_second, value = self.slots[index]
+            self.slots[index] = (second, value + amount if slot_second == second else amount)
+            self.total += amount
+
+    def rate(self, now: Optional[float] = None) -> float:
+        """最近完整的 window 秒内的平均每秒数量（不含当前这一秒）"""
+        second = int(time.monotonic() if now is None else now)
+        with self.lock:
+            amount = sum(value for slot_second, value in self.slots
+                         if second - self.window <= slot_second < second)
+        return amount / self.window
+
+class TimedLock:
+    """记录等待时间的锁包装：无竞争时只计数，发生竞争才计时"""
+
+    __slots__ = ('lock', 'wait', 'contended')
+
+    def __init__(self, lock, wait: Histogram, contended: Callable[[], None]):
+        self.lock = lock
+        self.wait = wait  # 发生竞争时的等待时间
+        self.contended = contended  # 发生竞争时调用（计数）
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self.lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        self.contended()
+        start = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        self.wait.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.lock.release()
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters: Dict[Tuple[str, Tuple], int] = {}
+        self.histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self.rates: Dict[Tuple[str, Tuple], RateMeter] = {}
+        self.gauges: Dict[Tuple[str, Tuple], Callable[[], float]] = {}
+
+    def inc(self, name: str, amount: int = 1, **labels):
+        """计数器加 amount"""
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def counter(self, name: str, **labels) -> Callable[..., None]:
+        """返回标签已预先计算好的计数函数 inc(amount=1)，热点路径保存返回值而不是每次拼接标签"""
+        key = (name, _label_key(labels))
+        counters, lock = self.counters, self.lock
+
+        def inc(amount: int = 1):
+            with lock:
+                counters[key] = counters.get(key, 0) + amount
+        return inc
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        """获取（或创建）直方图，热点路径应保存返回值而不是每次查找"""
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            return histogram
+
+    def observe(self, name: str, value: float, **labels):
+        """记录直方图观测值"""
+        self.histogram(name, **labels).observe(value)
+
+    def rate(self, name: str, **labels) -> RateMeter:
+        """获取（或创建）每秒速率"""
+        key = (name, _label_key(labels))
+        with self.lock:
+            meter = self.rates.get(key)
+            if meter is None:
+                meter = self.rates[key] = RateMeter()
+            return meter
+
+    def gauge(self, name: str, callback: Callable[[], float], **labels):
+        """注册瞬时值，在读取指标时调用 callback 计算"""
+        with self.lock:
+            self.gauges[(name, _label_key(labels))] = callback
+
+    def timed_lock(self, lock, name: str) -> TimedLock:
+        """用等待时间统计包装锁"""
+        return TimedLock(lock, self.histogram('lock_wait_seconds', lock=name),
+                         lambda: self.inc('lock_contended', lock=name))
+
+    def get_counter(self, name: str, **labels) -> int:
+        """读取计数器"""
+        with self.lock:
+            return self.counters.get((name, _label_key(labels)), 0)
+
+    def snapshot(self) -> dict:
+        """获取所有指标（可直接序列化为JSON）"""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+            rates = dict(self.rates)
+            gauges = dict(self.gauges)
+
+        result = {'timestamp': time.time(), 'uptime': time.time() - self.started,
+                  'counters': {}, 'rates': {}, 'gauges': {}, 'histograms': {}}
+        for (name, labels), value in sorted(counters.items()):
+            result['counters'][_format_name(name, labels)] = value
+        for (name, labels), meter in sorted(rates.items()):
+            result['rates'][_format_name(name + '_per_second', labels)] = meter.rate()
+            result['counters'][_format_name(name + '_total', labels)] = meter.total
+        for (name, labels), callback in sorted(gauges.items(), key=lambda item: item[0]):
+            try:
+                result['gauges'][_format_name(name, labels)] = callback()
+            except Exception as e:
+                result['gauges'][_format_name(name, labels)] = f'error: {e}'
+        for (name, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+            result['histograms'][_format_name(name, labels)] = histogram.snapshot()
+        return result
+
+    def render_text(self) -> str:
+        """以纯文本格式输出所有指标（每行一个 名称 值）"""
+        snapshot = self.snapshot()
+        lines = [f"uptime_seconds {snapshot['uptime']:.1f}"]
+        for section in ('counters', 'rates', 'gauges'):
+            for name, value in snapshot[section].items():
+                lines.append(f"{name} {value}")
+        for name, data in snapshot['histograms'].items():
+            base, _, labels = name.partition('{')
+            labels = ('{' + labels) if labels else ''
+            lines.append(f"{base}_count{labels} {data['count']}")
+            lines.append(f"{base}_sum{labels} {data['sum']:.6f}")
+            lines.append(f"{base}_p50{labels} {data['p50']}")
+            lines.append(f"{base}_p99{labels} {data['p99']}")
+        return '\n'.join(lines) + '\n'
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """管理端口的请求处理：/metrics 纯文本，/metrics.json JSON"""
+
+    registry: MetricsRegistry = None
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('', '/metrics'):
+            body = self.registry.render_text().encode('utf-8')
+            content_type = 'text/plain; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body = json.dumps(self.registry.snapshot(), ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 不为每次查询打印日志
+
+class MetricsServer:
+    """本地管理端口和定期JSON快照"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = '127.0.0.1', port: Optional[int] = None,
+                 dump_path: Optional[str] = None, dump_interval: float = 10.0):
+        self.registry = registry
+        self.host = host
+        self.port = port  # None 表示不开放管理端口
+        self.dump_path = dump_path  # None 表示不写快照文件
+        self.dump_interval = dump_interval
+        self.http_server: Optional[ThreadingHTTPServer] = None
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        """启动管理端口和快照线程"""
+        if self.port is not None:
+            handler = type('MetricsRequestHandler', (_MetricsRequestHandler,), {'registry': self.registry})
+            self.http_server = ThreadingHTTPServer((self.host, self.port), handler)
+            self.http_server.daemon_threads = True
+            self.port = self.http_server.server_address[1]  # 端口为0时使用系统分配的端口
+            self._spawn(self.http_server.serve_forever)
+            print(f"指标管理端口: http://{self.host}:{self.port}/metrics")
+        if self.dump_path:
+            self._spawn(self.dump_loop)
+
+    def _spawn(self, target: Callable):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def dump_loop(self):
+        """定期写入JSON快照"""
+        while not self.stop_event.wait(self.dump_interval):
+            self.dump()
+
+    def dump(self):
+        """写入一次JSON快照（先写临时文件再替换，读取方不会读到半个文件）"""
+        temp_path = f"{self.dump_path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.registry.snapshot(), f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.dump_path)
+        except OSError as e:
+            print(f"写入指标快照失败: {e}")
+
+    def stop(self):
+        """停止管理端口和快照线程"""
+        self.stop_event.set()
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+        if self.dump_path:
+            self.dump()
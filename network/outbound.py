@@ -0,0 +1,224 @@
+"""
+连接发送队列
+每个连接拥有一个有界的发送队列，写socket永不阻塞调用者：
+发送方先尝试非阻塞写出，写不完的部分留在队列中，
+由事件循环或共享的后台写线程在socket可写时继续发送。
+队列积压超过高水位线的慢速客户端会被标记或断开，只影响它自己。
+"""
+
+import selectors
+import socket
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional
+
+# push 的返回值
+SEND_DONE = 'done'  # 已全部写入内核缓冲区
+SEND_PENDING = 'pending'  # 还有数据积压，需要等待socket可写
+SEND_OVERFLOW = 'overflow'  # 积压超过高水位线，帧已被丢弃
+SEND_CLOSED = 'closed'  # 队列已关闭
+
+DEFAULT_HIGH_WATER = 256 * 1024  # 默认每个连接最多积压256KB
+
+class OutboundQueue:
+    """单个连接的有界发送队列"""
+
+    def __init__(self, high_water: int = DEFAULT_HIGH_WATER):
+        self.lock = threading.Lock()
+        self.frames = deque()
+        self.offset = 0  # 队首帧已发送的字节数
+        self.pending_bytes = 0
+        self.high_water = high_water
+        self.overflowed = False
+        self.closed = False
+
+    def push(self, sock: socket.socket, frame: bytes) -> str:
+        """
+        将帧加入队列并立即尝试非阻塞写出
+
+        Returns:
+            str: SEND_DONE / SEND_PENDING / SEND_OVERFLOW / SEND_CLOSED
+        """
+        with self.lock:
+            if self.closed:
+                return SEND_CLOSED
+            if self.pending_bytes + len(frame) > self.high_water:
+                self.overflowed = True
+                return SEND_OVERFLOW
+
+            self.frames.append(frame)
+            self.pending_bytes += len(frame)
+            if len(self.frames) > 1:
+                # 前面已有积压，等待可写事件按顺序发送
+                return SEND_PENDING
+            return SEND_DONE if self._write(sock) else SEND_PENDING
+
+    def flush(self, sock: socket.socket) -> bool:
+        """socket可写时继续发送，返回是否已全部发送"""
+        with self.lock:
+            if self.closed:
+                return True
+            return self._write(sock)
+
+    def _write(self, sock: socket.socket) -> bool:
+        """非阻塞写出队列（需持有锁），部分写入时记录偏移量保证完整写出"""
+        frames = self.frames
+        while frames:
+            frame = frames[0]
+            try:
+                if self.offset:
+                    sent = sock.send(memoryview(frame)[self.offset:])
+                else:
+                    sent = sock.send(frame)
+            except (BlockingIOError, InterruptedError):
+                return False
+            self.pending_bytes -= sent
+            if self.offset + sent < len(frame):
+                self.offset += sent
+            else:
+                frames.popleft()
+                self.offset = 0
+        return True
+
+    def has_pending(self) -> bool:
+        """是否还有未发送的数据"""
+        return self.pending_bytes > 0
+
+    def unsent(self) -> bytes:
+        """所有尚未写出的字节（队首帧只取未发送的部分），不修改队列"""
+        with self.lock:
+            if not self.frames:
+                return b''
+            chunks = list(self.frames)
+            chunks[0] = chunks[0][self.offset:]
+            return b''.join(chunks)
+
+    def close(self):
+        """关闭队列并丢弃所有积压数据"""
+        with self.lock:
+            self.closed = True
+            self.frames.clear()
+            self.offset = 0
+            self.pending_bytes = 0
+
+class OutboundWriter:
+    """共享后台写线程：等待有积压数据的连接可写并继续发送（线程模式使用）"""
+
+    def __init__(self, on_error: Optional[Callable[[socket.socket, Exception], None]] = None):
+        self.selector = selectors.DefaultSelector()
+        self.on_error = on_error
+        self.lock = threading.Lock()
+        self.requests = []  # (操作, socket, 队列)，只在写线程中修改selector
+        self.watched: Dict[socket.socket, OutboundQueue] = {}
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+
+    def start(self):
+        """启动写线程"""
+        self.running = True
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def watch(self, sock: socket.socket, queue: OutboundQueue):
+        """请求在socket可写时继续发送该队列"""
+        self._request('watch', sock, queue)
+
+    def discard(self, sock: socket.socket):
+        """停止关注socket并关闭它（由写线程在注销后关闭，避免select使用已关闭的socket）"""
+        if not self.running:
+            self._close(sock)
+            return
+        self._request('discard', sock, None)
+
+    def _request(self, action: str, sock: socket.socket, queue: Optional[OutboundQueue]):
+        with self.lock:
+            self.requests.append((action, sock, queue))
+        try:
+            self._wakeup_send.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass  # 唤醒缓冲区已满说明写线程必然会被唤醒
+        except OSError:
+            pass
+
+    def run(self):
+        """写线程主循环"""
+        while self.running:
+            try:
+                events = self.selector.select()
+            except OSError as e:
+                if self.running:
+                    print(f"发送线程select错误: {e}")
+                break
+
+            self._apply_requests()
+
+            for key, mask in events:
+                sock = key.fileobj
+                if sock is self._wakeup_recv:
+                    try:
+                        self._wakeup_recv.recv(4096)
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    continue
+
+                queue = self.watched.get(sock)
+                if queue is None:
+                    continue
+                try:
+                    drained = queue.flush(sock)
+                except OSError as e:
+                    queue.close()
+                    drained = True
+                    if self.on_error:
+                        self.on_error(sock, e)
+                if drained:
+                    self._unwatch(sock)
+
+    def _apply_requests(self):
+        with self.lock:
+            requests, self.requests = self.requests, []
+
+        for action, sock, queue in requests:
+            if action == 'watch':
+                if sock not in self.watched:
+                    try:
+                        self.selector.register(sock, selectors.EVENT_WRITE)
+                    except (KeyError, ValueError, OSError):
+                        continue
+                    self.watched[sock] = queue
+            else:
+                self._unwatch(sock)
+                self._close(sock)
+
+    def _unwatch(self, sock: socket.socket):
+        if self.watched.pop(sock, None) is not None:
+            try:
+                self.selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+
+    def _close(self, sock: socket.socket):
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def stop(self):
+        """停止写线程"""
+        self.running = False
+        try:
+            self._wakeup_send.send(b'\0')
+        except OSError:
+            pass
+        if self.thread and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2.0)
+        for sock in list(self.watched):
+            self._unwatch(sock)
+        self.selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
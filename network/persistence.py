@@ -0,0 +1,228 @@
+"""
+房间状态持久化
+服务器进程崩溃或重启后从磁盘恢复所有房间（名单、槽位、房主、是否已开始以及服务器权威模式下的游戏状态），
+重连的客户端凭会话令牌回到原来的游戏。
+
+- 预写日志（rooms.wal）：每次房间变化追加一条记录（长度 + CRC32 + JSON），记录的是房间的完整状态，
+  重放时后写的记录直接覆盖先写的，重复重放也不会出错
+- 成组提交：写入方只把记录放入内存（同一房间尚未写盘的旧记录直接被替换），
+  写入线程每隔 commit_interval 把积压的记录一次写入并只调用一次 fsync，房间锁和事件循环从不等待磁盘；
+  崩溃时最多丢失最后 commit_interval 秒内的变化
+- 快照（rooms.snapshot）：日志超过 snapshot_bytes 或距上次快照超过 snapshot_interval 秒时，
+  把所有房间的最新状态写入快照并清空日志，恢复时只需读取快照和一段有限长度的日志
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional
+
+WAL_FILE = 'rooms.wal'
+SNAPSHOT_FILE = 'rooms.snapshot'
+WAL_HEADER = struct.Struct('<II')  # 记录长度, CRC32
+SNAPSHOT_FORMAT = 1
+
+COMMIT_INTERVAL = 0.05  # 成组提交间隔（秒）
+SNAPSHOT_BYTES = 4 * 1024 * 1024  # 日志超过该大小时压缩为快照
+SNAPSHOT_INTERVAL = 60.0  # 有新记录时最长多久做一次快照（秒）
+
+def _fsync_directory(directory: str):
+    """同步目录项，保证 os.replace 后的新文件名在断电后仍然存在（Windows不支持，跳过）"""
+    if os.name != 'posix':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class RoomStore:
+    """房间状态的预写日志和快照"""
+
+    def __init__(self, directory: str, commit_interval: float = COMMIT_INTERVAL,
+                 snapshot_bytes: int = SNAPSHOT_BYTES, snapshot_interval: float = SNAPSHOT_INTERVAL):
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.snapshot_bytes = snapshot_bytes
+        self.snapshot_interval = snapshot_interval
+        self.wal_path = os.path.join(directory, WAL_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.pending: "OrderedDict[str, Optional[dict]]" = OrderedDict()  # room_id -> 房间状态（None表示删除）
+        self.rooms: Dict[str, dict] = {}  # 已写盘的最新状态（只由写入线程修改），快照据此生成
+        self.wal = None
+        self.wal_size = 0
+        self.last_snapshot = time.monotonic()
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+
+        # 统计
+        self.commits = 0
+        self.records_written = 0
+        self.snapshots = 0
+        self.last_fsync_seconds = 0.0
+
+    def recover(self) -> Dict[str, dict]:
+        """
+        读取快照并重放日志，返回 room_id -> 房间状态
+
+        日志末尾写了一半或校验失败的记录（崩溃时正在写入）被丢弃，之后的内容不再读取。
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        rooms: Dict[str, dict] = {}
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get('format') == SNAPSHOT_FORMAT:
+                rooms.update(snapshot.get('rooms', {}))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"读取房间状态快照失败: {e}")
+
+        replayed = 0
+        valid_size = 0
+        try:
+            with open(self.wal_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        offset = 0
+        while offset + WAL_HEADER.size <= len(data):
+            length, checksum = WAL_HEADER.unpack_from(data, offset)
+            start = offset + WAL_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            try:
+                record = json.loads(payload.decode('utf-8'))
+            except ValueError:
+                break
+            if record.get('room') is None:
+                rooms.pop(record.get('room_id'), None)
+            else:
+                rooms[record['room_id']] = record['room']
+            replayed += 1
+            offset = valid_size = start + length
+        if valid_size < len(data):
+            print(f"房间状态日志末尾有 {len(data) - valid_size} 字节不完整的记录，已丢弃")
+
+        self.rooms = dict(rooms)
+        # 截掉不完整的尾部后继续追加
+        self.wal = open(self.wal_path, 'r+b' if data else 'wb')
+        self.wal.truncate(valid_size)
+        self.wal.seek(valid_size)
+        self.wal_size = valid_size
+        print(f"房间状态恢复：重放 {replayed} 条日志记录，共 {len(rooms)} 个房间")
+        return rooms
+
+    def put(self, room_id: str, room: dict):
+        """记录房间的最新状态（room 交出后调用方不得再修改）"""
+        with self.lock:
+            self.pending[room_id] = room
+            self.pending.move_to_end(room_id)
+
+    def delete(self, room_id: str):
+        """记录房间已关闭"""
+        with self.lock:
+            self.pending[room_id] = None
+            self.pending.move_to_end(room_id)
+
+    def start(self):
+        """启动写入线程（需先调用 recover）"""
+        if self.wal is None:
+            self.recover()
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """写入线程：成组提交，必要时压缩为快照"""
+        while self.running:
+            with self.lock:
+                self.ready.wait(self.commit_interval)
+            try:
+                self.commit()
+                if self.snapshot_due():
+                    self.write_snapshot()
+            except Exception as e:
+                print(f"写入房间状态错误: {e}")
+
+    def commit(self) -> int:
+        """把积压的记录写入日志并 fsync 一次，返回写入的记录数"""
+        with self.lock:
+            if not self.pending:
+                return 0
+            batch = self.pending
+            self.pending = OrderedDict()
+
+        chunks = []
+        for room_id, room in batch.items():
+            payload = json.dumps({'room_id': room_id, 'room': room}, separators=(',', ':'),
+                                 ensure_ascii=False).encode('utf-8')
+            chunks.append(WAL_HEADER.pack(len(payload), zlib.crc32(payload)))
+            chunks.append(payload)
+        data = b''.join(chunks)
+        self.wal.write(data)
+        self.wal.flush()
+        start = time.perf_counter()
+        os.fsync(self.wal.fileno())
+        self.last_fsync_seconds = time.perf_counter() - start
+        self.wal_size += len(data)
+
+        for room_id, room in batch.items():
+            if room is None:
+                self.rooms.pop(room_id, None)
+            else:
+                self.rooms[room_id] = room
+        self.commits += 1
+        self.records_written += len(batch)
+        return len(batch)
+
+    def snapshot_due(self) -> bool:
+        """日志过大，或有新记录且距上次快照已超过 snapshot_interval"""
+        if self.wal_size >= self.snapshot_bytes:
+            return True
+        return self.wal_size > 0 and time.monotonic() - self.last_snapshot >= self.snapshot_interval
+
+    def write_snapshot(self):
+        """把所有房间的最新状态写入快照，然后清空日志"""
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': SNAPSHOT_FORMAT, 'created': time.time(), 'rooms': self.rooms},
+                      f, separators=(',', ':'), ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        _fsync_directory(self.directory)
+        # 快照已落盘后才清空日志；两步之间崩溃时日志中的记录会被再次重放，结果不变
+        self.wal.seek(0)
+        self.wal.truncate()
+        os.fsync(self.wal.fileno())
+        self.wal_size = 0
+        self.last_snapshot = time.monotonic()
+        self.snapshots += 1
+
+    def stop(self):
+        """提交剩余记录，写入最终快照并关闭日志"""
+        with self.lock:
+            self.running = False
+            self.ready.notify_all()
+        if self.thread and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5.0)
+        if self.wal is None:
+            return
+        try:
+            self.commit()
+            self.write_snapshot()
+        except OSError as e:
+            print(f"写入房间状态错误: {e}")
+        self.wal.close()
+        self.wal = None
@@ -14,6 +14,7 @@ class MessageType(Enum):
     PLAYER_LEFT = "player_left"
     PLAYER_DISCONNECTED = "player_disconnected"  # 玩家掉线
     AI_TAKEOVER = "ai_takeover"  # AI接管
+    PLAYER_RESUMED = "player_resumed"  # 掉线玩家凭会话令牌重连，从AI手中收回槽位
     AI_TURN_START = "AI_TURN_START" # AI回合开始，由房主触发AI行动
     
     # 游戏控制
@@ -22,6 +23,7 @@ class MessageType(Enum):
     
     # 游戏状态同步
     GAME_STATE = "game_state"
+    STATE_ACK = "state_ack"  # 客户端确认已收到的状态版本
     PLAYER_MOVE = "player_move"
     DICE_ROLL = "dice_roll"
     EFFECT_DICE_ROLL = "effect_dice_roll"
@@ -32,30 +34,68 @@ class MessageType(Enum):
     PING = "ping"
     PONG = "pong"
 
+# 消息类型的数字编号（用于二进制编码，已分配的编号不可修改）
+MESSAGE_TYPE_IDS = {
+    MessageType.JOIN_ROOM: 1,
+    MessageType.JOIN_SUCCESS: 2,
+    MessageType.JOIN_FAILED: 3,
+    MessageType.PLAYER_JOINED: 4,
+    MessageType.PLAYER_LEFT: 5,
+    MessageType.PLAYER_DISCONNECTED: 6,
+    MessageType.AI_TAKEOVER: 7,
+    MessageType.AI_TURN_START: 8,
+    MessageType.START_GAME: 9,
+    MessageType.GAME_STARTED: 10,
+    MessageType.GAME_STATE: 11,
+    MessageType.PLAYER_MOVE: 12,
+    MessageType.DICE_ROLL: 13,
+    MessageType.EFFECT_DICE_ROLL: 14,
+    MessageType.TURN_CHANGE: 15,
+    MessageType.GAME_OVER: 16,
+    MessageType.PING: 17,
+    MessageType.PONG: 18,
+    MessageType.STATE_ACK: 19,
+    MessageType.PLAYER_RESUMED: 20,
+}
+MESSAGE_TYPES_BY_ID = {type_id: msg_type for msg_type, type_id in MESSAGE_TYPE_IDS.items()}
+# 每个消息类型直接携带自己的编号：分发表按编号索引列表，不经过枚举的 __hash__
+for _msg_type, _type_id in MESSAGE_TYPE_IDS.items():
+    _msg_type.type_id = _type_id
+# 按字符串值查找消息类型（比 MessageType(value) 经过枚举元类的查找快）
+MESSAGE_TYPES_BY_VALUE = {msg_type.value: msg_type for msg_type in MessageType}
+
+# 紧凑分隔符、不转义非ASCII字符：消息更短，编码更快；解码端的JSON解析不受影响
+_JSON_ENCODER = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
 class NetworkMessage:
     """网络消息类"""
     
-    def __init__(self, msg_type: MessageType, data=None, player_id=None):
+    def __init__(self, msg_type: MessageType, data=None, player_id=None, seq=None):
         self.type = msg_type
         self.data = data or {}
         self.player_id = player_id
+        self.seq = seq  # 房间广播的序号（断线重连时据此补发错过的消息）
     
     def to_json(self):
         """转换为JSON字符串"""
-        return json.dumps({
+        message = {
             'type': self.type.value,
             'data': self.data,
             'player_id': self.player_id
-        })
+        }
+        if self.seq is not None:
+            message['seq'] = self.seq
+        return _JSON_ENCODER.encode(message)
     
     @classmethod
     def from_json(cls, json_str):
         """从JSON字符串创建消息"""
         try:
             data = json.loads(json_str)
-            msg_type = MessageType(data['type'])
-            return cls(msg_type, data.get('data', {}), data.get('player_id'))
-        except (json.JSONDecodeError, ValueError, KeyError):
+            msg_type = MESSAGE_TYPES_BY_VALUE[data['type']]
+            return cls(msg_type, data.get('data', {}), data.get('player_id'), data.get('seq'))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            # 格式错误或未知的消息类型（JSONDecodeError 是 ValueError 的子类）
             return None
 
 def create_join_message(player_name):
@@ -0,0 +1,179 @@
+"""
+限流和准入控制
+每条连接有一个总的消息令牌桶、一个字节令牌桶，以及按消息类型的令牌桶：
+刷 PING 或 DICE_ROLL 的客户端只会耗尽自己的令牌，超出的消息在解码后、
+获取任何锁之前就被丢弃（或按策略断开该连接），不会占用房间锁和广播带宽。
+准入控制限制同时在线的连接数和新连接的速率，服务器饱和时新连接被拒绝，已有房间不受影响。
+"""
+
+import time
+from typing import Dict, Optional, Tuple
+
+from .protocol import MessageType
+
+# 每种消息类型的 (每秒速率, 突发容量)；未列出的类型只受连接总速率限制
+DEFAULT_TYPE_LIMITS: Dict[MessageType, Tuple[float, float]] = {
+    MessageType.PING: (5, 20),
+    MessageType.JOIN_ROOM: (2, 5),
+    MessageType.START_GAME: (1, 3),
+    MessageType.DICE_ROLL: (5, 10),
+    MessageType.EFFECT_DICE_ROLL: (5, 10),
+    MessageType.AI_TURN_START: (5, 10),
+    MessageType.STATE_ACK: (50, 100),
+}
+DEFAULT_MESSAGE_RATE = (100, 200)  # 每条连接所有消息合计
+DEFAULT_BYTE_RATE = (256 * 1024, 1024 * 1024)  # 每条连接每秒接收的字节数
+
+POLICY_DROP = 'drop'  # 丢弃超出的消息
+POLICY_DISCONNECT = 'disconnect'  # 断开超限的连接
+
+class TokenBucket:
+    """令牌桶：以 rate 的速率补充令牌，最多积累 burst 个"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def consume(self, amount: float = 1, now: Optional[float] = None) -> bool:
+        """取出 amount 个令牌，令牌不足时返回False（不扣除）"""
+        if now is None:
+            now = time.monotonic()
+        tokens = self.tokens + (now - self.updated) * self.rate
+        self.updated = now
+        if tokens > self.burst:
+            tokens = self.burst
+        if tokens < amount:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - amount
+        return True
+
+    def refund(self, amount: float = 1):
+        """退回 consume 取出的令牌（同一条消息后续的检查未通过时）"""
+        self.tokens = min(self.burst, self.tokens + amount)
+
+class ClientRateLimiter:
+    """单条连接的令牌桶（只由处理该连接的线程访问，不需要锁）"""
+
+    __slots__ = ('limits', 'messages', 'bytes', 'types', 'dropped')
+
+    def __init__(self, limits: 'RateLimits'):
+        now = time.monotonic()
+        self.limits = limits
+        self.messages = TokenBucket(*limits.message_rate, now) if limits.message_rate else None
+        self.bytes = TokenBucket(*limits.byte_rate, now) if limits.byte_rate else None
+        self.types: Dict[MessageType, TokenBucket] = {}  # 按需创建
+        self.dropped = 0
+
+    def allow(self, msg_type: MessageType, size: int) -> bool:
+        """检查一条消息是否在限额内，超出时计入 dropped（被拒绝的消息不消耗任何令牌）"""
+        now = time.monotonic()
+        bucket = self.types.get(msg_type)
+        if bucket is None:
+            limit = self.limits.type_limits.get(msg_type)
+            if limit is not None:
+                bucket = self.types[msg_type] = TokenBucket(*limit, now)
+        if bucket is not None and not bucket.consume(1, now):
+            self.dropped += 1
+            return False
+        if self.messages is not None and not self.messages.consume(1, now):
+            if bucket is not None:
+                bucket.refund(1)
+            self.dropped += 1
+            return False
+        if self.bytes is not None and not self.bytes.consume(size, now):
+            if self.messages is not None:
+                self.messages.refund(1)
+            if bucket is not None:
+                bucket.refund(1)
+            self.dropped += 1
+            return False
+        return True
+
+class RateLimits:
+    """限流配置（所有连接共用）"""
+
+    def __init__(self, message_rate: Optional[Tuple[float, float]] = DEFAULT_MESSAGE_RATE,
+                 byte_rate: Optional[Tuple[float, float]] = DEFAULT_BYTE_RATE,
+                 type_limits: Optional[Dict[MessageType, Tuple[float, float]]] = None,
+                 policy: str = POLICY_DROP):
+        """
+        Args:
+            message_rate: 每条连接的 (消息数/秒, 突发容量)，None 表示不限
+            byte_rate: 每条连接的 (字节数/秒, 突发容量)，None 表示不限
+            type_limits: 按消息类型覆盖默认限额，值为 None 表示该类型不限
+            policy: 超限时 'drop' 丢弃消息；'disconnect' 断开连接
+        """
+        self.message_rate = message_rate
+        self.byte_rate = byte_rate
+        self.type_limits = dict(DEFAULT_TYPE_LIMITS)
+        for msg_type, limit in (type_limits or {}).items():
+            if limit is None:
+                self.type_limits.pop(msg_type, None)
+            else:
+                self.type_limits[msg_type] = limit
+        self.policy = policy
+
+    @classmethod
+    def unlimited(cls) -> 'RateLimits':
+        """不做任何限流的配置"""
+        return cls(None, None, {msg_type: None for msg_type in MessageType})
+
+    def create_limiter(self) -> ClientRateLimiter:
+        """为新连接创建令牌桶"""
+        return ClientRateLimiter(self)
+
+class AdmissionControl:
+    """新连接的准入控制：在线连接数上限和全局的新连接速率"""
+
+    def __init__(self, max_clients: Optional[int] = None,
+                 accept_rate: Optional[Tuple[float, float]] = (50, 200)):
+        """
+        Args:
+            max_clients: 同时在线的连接数上限，None 表示不限
+            accept_rate: 全局的 (新连接数/秒, 突发容量)，None 表示不限
+        """
+        self.max_clients = max_clients
+        self.accept_rate = accept_rate
+        self.bucket = TokenBucket(*accept_rate) if accept_rate else None
+
+    def split(self, parts: int) -> 'AdmissionControl':
+        """
+        按份数平分限额（多进程分片时每个工作进程各自准入，合计不超过原来的限额）：
+        连接数上限向上取整，新连接速率和突发容量按比例缩小
+        """
+        max_clients = None if self.max_clients is None else -(-self.max_clients // parts)
+        accept_rate = None
+        if self.accept_rate:
+            rate, burst = self.accept_rate
+            accept_rate = (rate / parts, max(1.0, burst / parts))
+        return AdmissionControl(max_clients, accept_rate)
+
+    def admit(self, current_clients: int) -> Optional[str]:
+        """检查是否接受新连接，拒绝时返回原因"""
+        if self.max_clients is not None and current_clients >= self.max_clients:
+            return '服务器已满，请稍后再试'
+        if self.bucket is not None and not self.bucket.consume():
+            return '服务器繁忙，请稍后再试'
+        return None
+
+def parse_rate(text: str) -> Optional[Tuple[float, float]]:
+    """解析 "速率[:突发容量]"，省略突发容量时取速率的两倍；off 表示不限（返回None）"""
+    if text.strip().lower() == 'off':
+        return None
+    rate, _, burst = text.partition(':')
+    rate = float(rate)
+    return rate, float(burst) if burst else rate * 2
+
+def parse_type_limit(text: str) -> Tuple[MessageType, Optional[Tuple[float, float]]]:
+    """解析 "消息类型=速率[:突发容量]"（如 ping=2:5，类型名不区分大小写），速率为 off 时该类型不限"""
+    name, _, value = text.partition('=')
+    types = {msg_type.value.lower(): msg_type for msg_type in MessageType}
+    msg_type = types.get(name.strip().lower())
+    if msg_type is None:
+        raise ValueError(f"未知的消息类型: {name}")
+    return msg_type, parse_rate(value)
@@ -0,0 +1,106 @@
+"""
+消息路由
+服务器和客户端共用的分发表：按消息类型编号（MessageType.type_id）直接索引列表，
+取得处理器只需一次列表下标访问，不经过 if/elif 链，也不经过枚举的 __hash__。
+
+每种消息类型可以挂接前置钩子和后置钩子（用于指标统计和消息校验），
+钩子在注册时就合并到该类型的路由中，分发时不再查找。
+分发时可以附带一个上下文（服务器传入该连接的 client_info），钩子和处理器按固定的参数个数调用：
+- 前置钩子 hook(message, context)：返回 False 时丢弃该消息，不再调用处理器和后置钩子
+- 处理器 handler(message.data, context)；不带上下文分发时为 handler(message.data)
+- 后置钩子 hook(message, elapsed, context)：elapsed 为处理器耗时（秒），只在有后置钩子时才计时
+"""
+
+import time
+from typing import Callable, List, Optional
+
+from .protocol import NetworkMessage, MessageType, MESSAGE_TYPE_IDS
+
+class Route:
+    """一种消息类型的处理器和钩子"""
+
+    __slots__ = ('msg_type', 'handler', 'pre_hooks', 'post_hooks', 'type_pre_hooks', 'type_post_hooks')
+
+    def __init__(self, msg_type: MessageType):
+        self.msg_type = msg_type
+        self.handler: Optional[Callable] = None
+        self.pre_hooks = ()  # 合并后的钩子（通用钩子在前）
+        self.post_hooks = ()
+        self.type_pre_hooks: List[Callable] = []  # 只针对该类型注册的钩子
+        self.type_post_hooks: List[Callable] = []
+
+class MessageRouter:
+    """按消息类型编号索引的分发表"""
+
+    def __init__(self):
+        self.routes: List[Optional[Route]] = [None] * (max(MESSAGE_TYPE_IDS.values()) + 1)
+        for msg_type in MessageType:
+            self.routes[msg_type.type_id] = Route(msg_type)
+        self.pre_hooks: List[Callable] = []  # 对所有消息类型生效的钩子
+        self.post_hooks: List[Callable] = []
+
+    def register(self, msg_type: MessageType, handler: Optional[Callable]):
+        """设置消息类型的处理器（替换已有的处理器，None 表示不处理）"""
+        self.routes[msg_type.type_id].handler = handler
+
+    def handler_for(self, msg_type: MessageType) -> Optional[Callable]:
+        """获取消息类型的处理器"""
+        return self.routes[msg_type.type_id].handler
+
+    def add_pre_hook(self, hook: Callable, msg_type: Optional[MessageType] = None):
+        """添加前置钩子，msg_type 为 None 时对所有类型生效"""
+        if msg_type is None:
+            self.pre_hooks.append(hook)
+        else:
+            self.routes[msg_type.type_id].type_pre_hooks.append(hook)
+        self.rebuild()
+
+    def add_post_hook(self, hook: Callable, msg_type: Optional[MessageType] = None):
+        """添加后置钩子，msg_type 为 None 时对所有类型生效"""
+        if msg_type is None:
+            self.post_hooks.append(hook)
+        else:
+            self.routes[msg_type.type_id].type_post_hooks.append(hook)
+        self.rebuild()
+
+    def rebuild(self):
+        """把通用钩子和各类型的钩子合并为元组，分发时直接遍历"""
+        for route in self.routes:
+            if route is not None:
+                route.pre_hooks = tuple(self.pre_hooks + route.type_pre_hooks)
+                route.post_hooks = tuple(self.post_hooks + route.type_post_hooks)
+
+    def dispatch(self, message: NetworkMessage, context=None) -> bool:
+        """
+        分发一条消息
+
+        Returns:
+            bool: 是否调用了处理器（被前置钩子丢弃或没有处理器时为False）
+        """
+        route = self.routes[message.type.type_id]
+        handler = route.handler
+        if route.pre_hooks:
+            for hook in route.pre_hooks:
+                if hook(message, context) is False:
+                    return False
+        if not route.post_hooks:
+            if handler is None:
+                return False
+            if context is None:
+                handler(message.data)
+            else:
+                handler(message.data, context)
+            return True
+
+        start = time.perf_counter()
+        try:
+            if handler is not None:
+                if context is None:
+                    handler(message.data)
+                else:
+                    handler(message.data, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in route.post_hooks:
+                hook(message, elapsed, context)
+        return handler is not None
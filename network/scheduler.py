@@ -0,0 +1,154 @@
+"""
+截止时间调度器
+基于最小堆的定时器：每个键对应一个截止时间和回调。
+重新设定截止时间（例如收到心跳）只修改定时器记录，是O(1)操作；
+堆中的旧条目到期弹出时发现截止时间已被推后，才按新时间重新入堆。
+因此每次检查只处理真正到期的定时器，而不是遍历所有连接。
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Hashable, List, Optional, Tuple
+
+class _Timer:
+    """单个定时器"""
+
+    __slots__ = ('key', 'deadline', 'queued', 'callback', 'args')
+
+    def __init__(self, key: Hashable, deadline: float, callback: Callable, args: tuple):
+        self.key = key
+        self.deadline = deadline  # 当前生效的截止时间
+        self.queued = deadline  # 堆中有效条目的截止时间
+        self.callback = callback
+        self.args = args
+
+class DeadlineScheduler:
+    """基于最小堆的截止时间调度器（时间使用 time.monotonic）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.heap = []  # (截止时间, 序号, 定时器)
+        self.timers = {}  # key -> _Timer
+        self.sequence = itertools.count()
+
+    def schedule(self, key: Hashable, deadline: float, callback: Callable, *args):
+        """设置（或替换）键对应的定时器"""
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = _Timer(key, deadline, callback, args)
+                self._push(timer, deadline)
+            else:
+                timer.callback = callback
+                timer.args = args
+                self._rearm(timer, deadline)
+
+    def reschedule(self, key: Hashable, deadline: float) -> bool:
+        """只修改已有定时器的截止时间，定时器不存在时返回False"""
+        if key not in self.timers:  # 大多数调用没有对应的定时器，不必取锁
+            return False
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                return False
+            self._rearm(timer, deadline)
+            return True
+
+    def cancel(self, key: Hashable):
+        """取消定时器（堆中的条目在弹出时被忽略）"""
+        with self.lock:
+            self.timers.pop(key, None)
+
+    def remaining(self, key: Hashable, now: Optional[float] = None) -> Optional[float]:
+        """定时器距截止时间的秒数，定时器不存在时返回None"""
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                return None
+            deadline = timer.deadline
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, deadline - now)
+
+    def clear(self):
+        """取消所有定时器"""
+        with self.lock:
+            self.timers.clear()
+            self.heap.clear()
+
+    def _rearm(self, timer: _Timer, deadline: float):
+        timer.deadline = deadline
+        if deadline < timer.queued:
+            # 提前的截止时间需要新的堆条目，旧条目会被视为过期条目
+            self._push(timer, deadline)
+
+    def _push(self, timer: _Timer, deadline: float):
+        timer.queued = deadline
+        if not self.heap or deadline < self.heap[0][0]:
+            self.wakeup.notify()
+        heapq.heappush(self.heap, (deadline, next(self.sequence), timer))
+
+    def pop_expired(self, now: Optional[float] = None) -> List[Tuple[Callable, tuple]]:
+        """弹出所有已到期的定时器，返回 (回调, 参数) 列表"""
+        if now is None:
+            now = time.monotonic()
+        due = []
+        with self.lock:
+            heap = self.heap
+            while heap and heap[0][0] <= now:
+                queued, _, timer = heapq.heappop(heap)
+                if self.timers.get(timer.key) is not timer or timer.queued != queued:
+                    continue  # 已取消或已有更新的堆条目
+                if timer.deadline > now:
+                    # 截止时间已被推后，按新时间重新入堆
+                    timer.queued = timer.deadline
+                    heapq.heappush(heap, (timer.deadline, next(self.sequence), timer))
+                    continue
+                del self.timers[timer.key]
+                due.append((timer.callback, timer.args))
+        return due
+
+    def run_expired(self, now: Optional[float] = None) -> int:
+        """执行所有已到期的回调（不持有调度器的锁），返回执行的数量"""
+        due = self.pop_expired(now)
+        for callback, args in due:
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"定时任务执行错误: {e}")
+        return len(due)
+
+    def next_deadline(self) -> Optional[float]:
+        """最近的截止时间（可能属于已失效的条目，提前醒来是无害的）"""
+        with self.lock:
+            return self.heap[0][0] if self.heap else None
+
+    def time_until_next(self, now: Optional[float] = None) -> Optional[float]:
+        """距最近截止时间的秒数，没有定时器时返回None"""
+        deadline = self.next_deadline()
+        if deadline is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, deadline - now)
+
+    def wait(self, max_timeout: Optional[float] = None):
+        """阻塞直到最近的截止时间、有更早的定时器加入或被 notify_all 唤醒"""
+        with self.lock:
+            timeout = max_timeout
+            if self.heap:
+                until_next = max(0.0, self.heap[0][0] - time.monotonic())
+                timeout = until_next if timeout is None else min(timeout, until_next)
+            if timeout is None or timeout > 0:
+                self.wakeup.wait(timeout)
+
+    def notify_all(self):
+        """唤醒所有等待中的线程（例如停止服务器时）"""
+        with self.lock:
+            self.wakeup.notify_all()
+
+    def __len__(self):
+        return len(self.timers)
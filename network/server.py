@@ -4,20 +4,39 @@
 """
 
 import socket
+import select
 import threading
 import json
 import time
+import secrets
+from collections import deque
 from typing import Dict, List, Optional
 
-from .protocol import NetworkMessage, MessageType, create_game_state_message
+from .protocol import NetworkMessage, MessageType, MESSAGE_TYPES_BY_ID, create_game_state_message
+from .framing import FrameDecoder, encode_message, decode_message
+from .codec import CODEC_JSON, choose_codec
+from .outbound import (OutboundQueue, OutboundWriter, DEFAULT_HIGH_WATER,
+                       SEND_PENDING, SEND_OVERFLOW)
+from .scheduler import DeadlineScheduler
+from .state_sync import StateTracker
+from .spectators import SpectatorFanout
+from .metrics import MetricsRegistry, MetricsServer
+from .discovery import DiscoveryResponder, DISCOVERY_PORT
+from .journal import JournalWriter, RoomJournal, DIRECTION_IN, DIRECTION_OUT, SLOT_ROOM, SLOT_NONE
+from .persistence import RoomStore
+from .routing import MessageRouter
+from .ratelimit import RateLimits, AdmissionControl, POLICY_DISCONNECT
+from game.server_game_logic import ServerGameLogic, ai_delay_after_move, ai_delay_after_effect, AI_THINK_DELAY
 
 # 服务器版本号（应与客户端保持一致）
 SERVER_VERSION = "1.0.0"
 
+OUTBOUND_LOG_SIZE = 1024  # 每个房间保留的最近广播消息数量（用于断线重连补发）
+
 class GameRoom:
     """游戏房间类"""
     
-    def __init__(self, room_id: str, max_players: int = 4):
+    def __init__(self, room_id: str, max_players: int = 4, lock=None):
         self.room_id = room_id
         self.max_players = max_players
         self.players = {}  # player_id -> player_info
@@ -25,6 +44,24 @@ class GameRoom:
         self.game_started = False
         self.current_player = 0
         self.game_state = None
+        self.game: Optional[ServerGameLogic] = None  # 服务器权威模式下的游戏逻辑
+        self.state_tracker: Optional[StateTracker] = None  # 状态版本和各客户端已确认的版本
+        
+        # 房间广播按序号记录，断线重连的玩家只补发错过的消息
+        self.next_seq = 1
+        self.outbound_log = deque(maxlen=OUTBOUND_LOG_SIZE)  # (序号, 消息, 排除的玩家)
+        
+        # 观战者只读接收房间广播，不占用玩家槽位
+        self.spectators = {}  # spectator_id -> spectator_info
+        self.spectator_targets = ()  # (socket, codec) 元组，广播时直接交给分发队列
+        self.spectator_codecs = frozenset()  # 观战者使用的编码
+        
+        # 房间级锁：同一房间内的操作串行执行，不同房间互不阻塞
+        self.lock = lock or threading.RLock()
+        self.closed = False  # 房间已从服务器移除（持有旧引用的线程需要放弃操作）
+        
+        self.journal: Optional[RoomJournal] = None  # 房间消息日志，未启用时为None
+        self.journal_writer: Optional[JournalWriter] = None
         
     def add_player(self, player_id: str, player_info: dict) -> bool:
         """添加玩家到房间"""
@@ -51,6 +88,57 @@ class GameRoom:
     def can_start(self) -> bool:
         """检查是否可以开始游戏"""
         return len(self.players) >= 1 and not self.game_started
+    
+    def supports_authoritative(self) -> bool:
+        """房间内所有玩家的客户端是否都支持服务器权威模式"""
+        return all(pinfo.get('authoritative') for pinfo in self.players.values())
+    
+    def get_player_slot(self, player_id: str) -> Optional[int]:
+        """获取玩家槽位"""
+        player_info = self.players.get(player_id)
+        return player_info['slot'] if player_info else None
+    
+    def has_connected_players(self) -> bool:
+        """是否还有在线的玩家（掉线等待重连的玩家socket为None）"""
+        return any(pinfo['socket'] is not None for pinfo in self.players.values())
+    
+    def add_spectator(self, spectator_id: str, spectator_info: dict, max_spectators: Optional[int]) -> bool:
+        """添加观战者"""
+        if max_spectators is not None and len(self.spectators) >= max_spectators:
+            return False
+        self.spectators[spectator_id] = spectator_info
+        self.rebuild_spectator_targets()
+        return True
+    
+    def remove_spectator(self, spectator_id: str) -> bool:
+        """移除观战者"""
+        if self.spectators.pop(spectator_id, None) is None:
+            return False
+        self.rebuild_spectator_targets()
+        return True
+    
+    def rebuild_spectator_targets(self):
+        """观战者变化时重建分发列表（已提交到分发队列的旧元组不受影响）"""
+        self.spectator_targets = tuple((info['socket'], info['codec']) for info in self.spectators.values())
+        self.spectator_codecs = frozenset(info['codec'] for info in self.spectators.values())
+    
+    def record_frame(self, direction: int, slot: Optional[int], frame: bytes):
+        """把收发的一帧追加到房间消息日志（非权威模式的房间没有回合号，记为0）"""
+        turn = self.game.turn if self.game else 0
+        self.journal_writer.append(self.journal, direction, SLOT_NONE if slot is None else slot, turn, frame)
+    
+    def get_missed_messages(self, player_id: str, last_seq: int):
+        """
+        获取玩家错过的广播消息
+        
+        Returns:
+            tuple: (消息列表, 是否完整)；记录已被覆盖或随崩溃丢失时不完整
+        """
+        complete = last_seq >= self.next_seq - 1 or \
+            (bool(self.outbound_log) and self.outbound_log[0][0] <= last_seq + 1)
+        missed = [message for seq, message, exclude in self.outbound_log
+                  if seq > last_seq and exclude != player_id]
+        return missed, complete
 
 class GameServer:
     """游戏服务器类"""
@@ -63,33 +151,318 @@ class GameServer:
         self.rooms = {}  # room_id -> GameRoom
         self.player_rooms = {}  # player_id -> room_id
         self.running = False
-        self.lock = threading.Lock()
+        # 运行指标（消息数、流量、处理延迟、锁等待时间等）
+        self.metrics = MetricsRegistry()
+        self.admin_port: Optional[int] = None  # 本地管理端口，None表示不开放
+        self.metrics_dump_path: Optional[str] = None  # 定期写入JSON快照的文件
+        self.metrics_dump_interval = 10.0
+        self.metrics_server: Optional[MetricsServer] = None
+        self.bytes_in = self.metrics.rate('bytes_in')
+        self.bytes_out = self.metrics.rate('bytes_out')
+        self.message_counters = [None] * (max(MESSAGE_TYPES_BY_ID) + 1)  # 类型编号 -> 接收计数函数
+        self.handler_latency = [None] * (max(MESSAGE_TYPES_BY_ID) + 1)  # 类型编号 -> 处理延迟直方图
         
-        # 心跳检测相关
-        self.heartbeat_timeout = 15  # 15秒没有心跳则认为掉线
-        self.check_interval = 5  # 每5秒检查一次
+        # 局域网发现：应答UDP广播/组播探测，客户端无需输入IP即可找到服务器和房间
+        self.discovery_port: Optional[int] = DISCOVERY_PORT  # None 表示不应答发现探测
+        self.discovery_id = secrets.token_hex(8)  # 客户端据此合并同一服务器的多条回复
+        self.discovery: Optional[DiscoveryResponder] = None
+        
+        # 房间消息日志：每个房间收发的所有消息按回合写入二进制日志，用于事后分析和流量回放
+        self.journal_dir: Optional[str] = None  # None 表示不记录
+        self.journal: Optional[JournalWriter] = None
+        
+        # 房间状态持久化：重启后恢复房间，掉线的玩家凭会话令牌回到原来的游戏
+        self.state_dir: Optional[str] = None  # None 表示不持久化
+        self.store: Optional[RoomStore] = None
+        self.restore_grace = 15  # 恢复的游戏中，未重连玩家的槽位在该时间后才由AI接管
+        
+        # 全局锁只保护 clients / rooms / player_rooms 等路由表，持有时间应尽量短；
+        # 房间状态由各房间自己的锁保护。加锁顺序：先房间锁，后全局锁
+        self.lock = self.metrics.timed_lock(threading.Lock(), 'global')
+        
+        # 心跳检测相关：收到任何一帧都算作心跳，客户端只在连接空闲时才发送 PING
+        self.heartbeat_timeout = 15  # 15秒没有收到任何数据则认为掉线
+        self.idle_ping_interval = 5  # 客户端连接空闲多久后发送 PING（加入房间时告知客户端，应小于 heartbeat_timeout）
         self.heartbeat_checker_thread = None
         
         # 玩家操作超时检测
         self.operation_timeout = 90  # 90秒未操作则认为掉线
-        self.player_last_operation = {}  # player_id -> last_operation_time
+        
+        # 会话：游戏开始后掉线的玩家在该时间内可凭令牌重连并收回槽位
+        self.sessions = {}  # session_token -> player_id
+        self.session_timeout = 120
+        
+        # 观战者：发送走低优先级的分发队列，不影响玩家收到消息的延迟
+        self.max_spectators = None  # 每个房间的观战人数上限，None表示不限
+        self.spectator_high_water = 64 * 1024  # 观战者连接的积压上限，慢速观战者更早被断开
+        self.fanout = SpectatorFanout(self.send_frame_to_client)
+        
+        # 超时定时器：('heartbeat', client_socket) 和 ('operation', player_id)。
+        # 收到数据时只记录 client_info['last_seen']，定时器到期时才按它推后截止时间，收到每一帧时不必取调度器的锁
+        self.scheduler = DeadlineScheduler()
+        
+        # 发送队列：每个连接积压超过高水位线后按策略处理
+        self.outbound_high_water = DEFAULT_HIGH_WATER
+        self.slow_client_policy = 'disconnect'  # 'disconnect' 断开慢速客户端；'flag' 仅标记并丢弃超出的消息
+        self.writer: Optional[OutboundWriter] = None  # 线程模式下的共享发送线程
+        
+        # 限流和准入控制
+        self.rate_limits = RateLimits()  # 每条连接按消息数、字节数和消息类型限流
+        self.admission = AdmissionControl()  # 在线连接数上限和新连接速率
+        
+        self.router = self.build_router()  # 按消息类型编号索引的处理器表
+        self.register_gauges()
+        
+    def register_gauges(self):
+        """注册读取指标时计算的瞬时值"""
+        metrics = self.metrics
+        metrics.gauge('rooms', lambda: len(self.rooms))
+        metrics.gauge('clients', lambda: len(self.clients))
+        metrics.gauge('players', lambda: len(self.player_rooms))
+        metrics.gauge('spectators', lambda: sum(len(room.spectators) for room in list(self.rooms.values())))
+        metrics.gauge('sessions', lambda: len(self.sessions))
+        metrics.gauge('threads', threading.active_count)
+        metrics.gauge('timers', lambda: len(self.scheduler))
+        metrics.gauge('spectator_fanout_pending', lambda: len(self.fanout.items))
+        
+    def start_metrics(self):
+        """按配置开放管理端口和定期快照"""
+        if self.admin_port is None and not self.metrics_dump_path:
+            return
+        self.metrics_server = MetricsServer(self.metrics, port=self.admin_port,
+                                            dump_path=self.metrics_dump_path,
+                                            dump_interval=self.metrics_dump_interval)
+        try:
+            self.metrics_server.start()
+        except OSError as e:
+            print(f"指标管理端口启动失败: {e}")
+    
+    def stop_metrics(self):
+        """关闭管理端口并写入最后一次快照"""
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        
+    def get_discovery_info(self) -> dict:
+        """发现探测的回复内容：端口、版本和各房间的占用情况"""
+        with self.lock:
+            rooms = list(self.rooms.values())
+        return {
+            'server_id': self.discovery_id,
+            'shard': getattr(self, 'worker_index', 0),
+            'name': socket.gethostname(),
+            'version': SERVER_VERSION,
+            'port': self.port,
+            'rooms': [{
+                'room_id': room.room_id,
+                'players': len(room.players),
+                'max_players': room.max_players,
+                'started': room.game_started,
+                'spectators': len(room.spectators)
+            } for room in rooms if not room.closed]
+        }
+    
+    def create_discovery(self) -> Optional[DiscoveryResponder]:
+        """按配置创建发现服务应答方（端口被占用等错误不影响游戏服务器启动）"""
+        if self.discovery_port is None:
+            return None
+        discovery = DiscoveryResponder(self.get_discovery_info, port=self.discovery_port)
+        self.metrics.gauge('discovery_probes', lambda: discovery.probes)
+        return discovery
+    
+    def start_discovery(self):
+        """在独立线程中应答发现探测"""
+        self.discovery = self.create_discovery()
+        if self.discovery is None:
+            return
+        try:
+            self.discovery.start()
+        except OSError as e:
+            print(f"局域网发现服务启动失败: {e}")
+            self.discovery = None
+    
+    def stop_discovery(self):
+        """关闭发现服务"""
+        if self.discovery:
+            self.discovery.stop()
+            self.discovery = None
+        
+    def start_journal(self):
+        """按配置启动房间消息日志的写入线程"""
+        if not self.journal_dir:
+            return
+        self.journal = JournalWriter(self.journal_dir)
+        try:
+            self.journal.start()
+        except OSError as e:
+            print(f"房间消息日志启动失败: {e}")
+            self.journal = None
+            return
+        journal = self.journal
+        self.metrics.gauge('journal_bytes_written', lambda: journal.bytes_written)
+        self.metrics.gauge('journal_pending_bytes', lambda: journal.pending_bytes)
+    
+    def stop_journal(self):
+        """写完剩余的日志记录并关闭文件"""
+        if self.journal:
+            self.journal.stop()
+            self.journal = None
+    
+    def start_store(self):
+        """按配置恢复持久化的房间并启动状态日志的写入线程（在接受连接之前调用）"""
+        if not self.state_dir:
+            return
+        store = RoomStore(self.state_dir)
+        try:
+            records = store.recover()
+        except OSError as e:
+            print(f"房间状态目录不可用，不持久化房间: {e}")
+            return
+        for room_id, record in records.items():
+            try:
+                self.restore_room(room_id, record)
+            except (KeyError, TypeError, ValueError, IndexError) as e:
+                print(f"恢复房间 {room_id} 失败: {e}")
+                store.delete(room_id)
+        self.store = store
+        store.start()
+        self.metrics.gauge('state_wal_bytes', lambda: store.wal_size)
+        self.metrics.gauge('state_commits', lambda: store.commits)
+        self.metrics.gauge('state_fsync_seconds', lambda: store.last_fsync_seconds)
+    
+    def stop_store(self):
+        """提交剩余的状态记录并写入最终快照"""
+        if self.store:
+            self.store.stop()
+            self.store = None
+    
+    def export_room(self, room: GameRoom) -> dict:
+        """房间需要持久化的状态（需持有房间锁）"""
+        return {
+            'max_players': room.max_players,
+            'host_id': room.host_id,
+            'game_started': room.game_started,
+            'next_seq': room.next_seq,
+            'players': [{
+                'id': pid,
+                'name': pinfo['name'],
+                'slot': pinfo['slot'],
+                'version': pinfo.get('version'),
+                'authoritative': pinfo.get('authoritative', False),
+                'session_token': pinfo.get('session_token')
+            } for pid, pinfo in room.players.items()],
+            'game': room.game.export_state() if room.game else None,
+            'state_version': room.state_tracker.version if room.state_tracker else 0
+        }
+    
+    def persist_room(self, room: GameRoom):
+        """把房间的最新状态交给状态日志（需持有房间锁，不等待写盘）"""
+        if self.store and not room.closed:
+            self.store.put(room.room_id, self.export_room(room))
+    
+    def restore_room(self, room_id: str, record: dict):
+        """
+        按持久化的状态重建房间：所有玩家都处于掉线状态，保留会话等待重连；
+        已开始的游戏在 restore_grace 秒后由AI接管仍未重连的玩家
+        """
+        room = GameRoom(room_id, record.get('max_players', 4),
+                        lock=self.metrics.timed_lock(threading.RLock(), 'room'))
+        room.host_id = record['host_id']
+        room.game_started = record['game_started']
+        # next_seq 只随房间状态持久化，之后的广播（掉线、恢复等）可能已用掉更大的序号；
+        # 跳过一段序号避免重复分配，重连玩家错过的消息已无记录，补发不完整，改发关键帧
+        room.next_seq = record.get('next_seq', 1) + OUTBOUND_LOG_SIZE
+        if record.get('game'):
+            room.game = ServerGameLogic.from_state(record['game'])
+            room.state_tracker = StateTracker()
+            # 版本号接着崩溃前继续递增，重连的客户端收到关键帧
+            room.state_tracker.version = record.get('state_version', 0)
+            room.state_tracker.commit(room.game.get_game_state())
+        if self.journal:
+            room.journal_writer = self.journal
+            room.journal = self.journal.open_room(room_id)
+        
+        with self.lock:
+            self.rooms[room_id] = room
+            for saved in record['players']:
+                player_id = saved['id']
+                room.players[player_id] = {
+                    'id': player_id,
+                    'name': saved['name'],
+                    'socket': None,
+                    'slot': saved['slot'],
+                    'version': saved.get('version'),
+                    'authoritative': saved.get('authoritative', False),
+                    'session_token': saved.get('session_token')
+                }
+                self.player_rooms[player_id] = room_id
+                if saved.get('session_token'):
+                    self.sessions[saved['session_token']] = player_id
+        
+        session_deadline = time.monotonic() + self.session_timeout
+        for player_info in room.players.values():
+            if player_info['session_token']:
+                self.scheduler.schedule(('session', player_info['session_token']), session_deadline,
+                                        self.on_session_expired, player_info['session_token'])
+        if room.game:
+            self.scheduler.schedule(('restore', room), time.monotonic() + self.restore_grace,
+                                    self.on_restore_grace, room)
+        print(f"已恢复房间 {room_id}：{len(room.players)} 名玩家，"
+              f"{'游戏进行中' if room.game_started else '等待开始'}")
+    
+    def on_restore_grace(self, room: GameRoom):
+        """恢复等待期结束：仍未重连的玩家由AI接管，游戏继续"""
+        with room.lock:
+            if room.closed or not room.game:
+                return
+            for player_info in room.players.values():
+                slot = player_info['slot']
+                if player_info['socket'] is None and not room.game.players[slot].is_ai:
+                    takeover_msg = NetworkMessage(MessageType.AI_TAKEOVER, {
+                        'player_slot': slot,
+                        'player_name': player_info['name']
+                    })
+                    self.broadcast_to_room(room.room_id, takeover_msg)
+                    self.hand_over_to_ai(room, slot)
+            self.schedule_ai_turn(room, AI_THINK_DELAY)
+    
+    def journal_client_frame(self, client_socket: socket.socket, direction: int, frame: bytes):
+        """把玩家连接收发的一帧记录到其所在房间的日志（观战者和未进入房间的连接不记录）"""
+        client_info = self.clients.get(client_socket)
+        if not client_info or client_info['spectating']:
+            return
+        player_id = client_info['player_id']
+        room = self.rooms.get(self.player_rooms.get(player_id))
+        if room is not None and room.journal is not None:
+            room.record_frame(direction, room.get_player_slot(player_id), frame)
         
     def start(self):
         """启动服务器"""
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
+        self.server_socket.listen(128)
         self.running = True
         
         print(f"服务器启动在 {self.host}:{self.port}")
+        self.start_metrics()
+        self.start_journal()
+        self.start_store()
+        self.start_discovery()
+        
+        # 启动共享发送线程，负责写完积压的数据
+        self.writer = OutboundWriter(on_error=self.handle_send_error)
+        self.writer.start()
+        
+        # 启动观战者分发线程
+        self.fanout.start()
         
         # 启动接受连接的线程
         accept_thread = threading.Thread(target=self.accept_connections)
         accept_thread.daemon = True
         accept_thread.start()
         
-        # 启动心跳检测线程
+        # 启动超时定时器线程
         self.heartbeat_checker_thread = threading.Thread(target=self.check_heartbeats)
         self.heartbeat_checker_thread.daemon = True
         self.heartbeat_checker_thread.start()
@@ -100,6 +473,10 @@ class GameServer:
             try:
                 if self.server_socket:
                     client_socket, address = self.server_socket.accept()
+                    reason = self.admission.admit(len(self.clients))
+                    if reason:
+                        self.reject_connection(client_socket, address, reason)
+                        continue
                     print(f"新连接来自: {address}")
                     
                     # 为每个客户端创建处理线程
@@ -114,29 +491,66 @@ class GameServer:
                 if self.running:
                     print(f"接受连接错误: {e}")
     
-    def handle_client(self, client_socket: socket.socket, address):
-        """处理客户端消息"""
-        player_id = f"player_{address[0]}_{address[1]}_{int(time.time())}"
+    def register_client(self, client_socket: socket.socket, address) -> str:
+        """登记新连接，返回分配的玩家ID"""
+        # 随机ID：不泄露客户端地址，也不会因同一秒内的重连而重复
+        player_id = f"player_{secrets.token_hex(8)}"
+        # 所有写操作都是非阻塞的，读取前先用select等待数据
+        client_socket.setblocking(False)
         
         with self.lock:
             self.clients[client_socket] = {
                 'player_id': player_id,
                 'address': address,
                 'socket': client_socket,
-                'last_heartbeat': time.time()  # 记录最后心跳时间
+                'last_seen': time.monotonic(),  # 最后收到数据的时间
+                'codec': CODEC_JSON,  # 加入房间时协商，默认JSON兼容旧客户端
+                'outbox': OutboundQueue(self.outbound_high_water),  # 有界发送队列
+                'slow': False,  # 是否被标记为慢速客户端
+                'spectating': None,  # 观战的房间ID（玩家连接为None）
+                'limiter': self.rate_limits.create_limiter()  # 该连接的令牌桶
             }
+        self.scheduler.schedule(('heartbeat', client_socket), time.monotonic() + self.heartbeat_timeout,
+                                self.on_heartbeat_timeout, client_socket, player_id)
+        return player_id
+    
+    def reject_connection(self, client_socket: socket.socket, address, reason: str):
+        """拒绝新连接：尽力发送失败原因后立即关闭"""
+        self.metrics.inc('connections_rejected')
+        print(f"拒绝连接 {address}: {reason}")
+        try:
+            client_socket.setblocking(False)
+            client_socket.send(encode_message(NetworkMessage(MessageType.JOIN_FAILED, {'reason': reason})))
+        except OSError:
+            pass
+        client_socket.close()
+    
+    def handle_client(self, client_socket: socket.socket, address):
+        """处理客户端消息"""
+        player_id = self.register_client(client_socket, address)
+        decoder = FrameDecoder()
+        # socket为非阻塞模式，读取前先等待数据（poll不受select的文件描述符数量限制）
+        poller = select.poll() if hasattr(select, 'poll') else None
+        if poller:
+            poller.register(client_socket, select.POLLIN)
         
         try:
             while self.running:
-                # 接收消息
-                data = client_socket.recv(4096).decode('utf-8')
-                if not data:
+                # 等待数据到达后接收并重组为完整的消息帧
+                if poller:
+                    poller.poll()
+                else:
+                    select.select([client_socket], [], [])
+                try:
+                    frames = decoder.recv_from(client_socket)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                if frames is None:
                     break
                 
                 # 处理消息
-                message = NetworkMessage.from_json(data)
-                if message:
-                    self.process_message(client_socket, player_id, message)
+                for frame in frames:
+                    self.dispatch_frame(client_socket, player_id, frame)
                     
         except Exception as e:
             print(f"客户端处理错误 {address}: {e}")
@@ -144,31 +558,151 @@ class GameServer:
             # 清理断开的连接
             self.disconnect_client(client_socket, player_id)
     
-    def process_message(self, client_socket: socket.socket, player_id: str, message: NetworkMessage):
-        """处理接收到的消息"""
+    def dispatch_frame(self, client_socket: socket.socket, player_id: str, frame: bytes):
+        """解码并处理一帧，记录接收流量（消息数和处理延迟由分发表的钩子记录）"""
+        self.bytes_in.add(len(frame))
+        # 任何一帧都算作心跳（只写该连接自己的记录，不取锁）
+        client_info = self.clients.get(client_socket)
+        if client_info:
+            client_info['last_seen'] = time.monotonic()
+        message = decode_message(frame)
+        if not message:
+            self.metrics.inc('messages_invalid')
+            return
+        
         msg_type = message.type
-        data = message.data
-        
-        # 更新玩家最后操作时间
-        current_time = time.time()
-        self.player_last_operation[player_id] = current_time
-        
-        if msg_type == MessageType.JOIN_ROOM:
-            self.handle_join_room(client_socket, player_id, data)
-        elif msg_type == MessageType.START_GAME:
-            self.handle_start_game(player_id)
-        elif msg_type == MessageType.DICE_ROLL:
-            self.handle_dice_roll(player_id, data)
-        elif msg_type == MessageType.EFFECT_DICE_ROLL:
-            self.handle_effect_dice_roll(player_id, data)
-        elif msg_type == MessageType.AI_TURN_START:
-            self.handle_ai_turn_start(player_id, data)
-        elif msg_type == MessageType.PING:
-            # 更新心跳时间
-            with self.lock:
-                if client_socket in self.clients:
-                    self.clients[client_socket]['last_heartbeat'] = time.time()
-            self.send_to_client(client_socket, NetworkMessage(MessageType.PONG))
+        # 限流在获取任何锁之前进行，超限的消息不会占用房间锁和广播带宽
+        if client_info and not client_info['limiter'].allow(msg_type, len(frame)):
+            self.handle_rate_limited(client_socket, client_info, msg_type)
+            return
+        # JOIN_ROOM 在处理后才知道房间，记录在加入结果之后；其余消息在处理前记录
+        journal_after = msg_type == MessageType.JOIN_ROOM
+        if self.journal and not journal_after:
+            self.journal_client_frame(client_socket, DIRECTION_IN, frame)
+        self.process_message(client_socket, player_id, message)
+        if self.journal and journal_after:
+            self.journal_client_frame(client_socket, DIRECTION_IN, frame)
+    
+    def handle_rate_limited(self, client_socket: socket.socket, client_info: dict, msg_type: MessageType):
+        """丢弃超出限额的消息；策略为 disconnect 时断开该连接"""
+        self.metrics.inc('messages_rate_limited', type=msg_type.value)
+        limiter = client_info['limiter']
+        if self.rate_limits.policy == POLICY_DISCONNECT:
+            print(f"客户端 {client_info['player_id']} 超出 {msg_type.value} 消息的速率限制，断开连接")
+            # 关闭读写，接收端随后走正常的断开流程
+            self.shutdown_client_socket(client_socket)
+        elif limiter.dropped == 1:
+            print(f"客户端 {client_info['player_id']} 超出 {msg_type.value} 消息的速率限制，丢弃超出的消息")
+    
+    def build_router(self) -> MessageRouter:
+        """建立玩家消息的分发表：指标和校验钩子，以及各消息类型的处理器"""
+        router = MessageRouter()
+        router.add_pre_hook(self.count_message)
+        router.add_pre_hook(self.validate_message)
+        router.add_pre_hook(self.divert_spectator_message)
+        router.add_post_hook(self.observe_handler_latency)
+        
+        # 处理器的参数为 (data, client_info)，client_info['player_id'] 是连接当前对应的玩家ID
+        router.register(MessageType.JOIN_ROOM,
+                        lambda data, client: self.handle_join_room(client['socket'], client['player_id'], data))
+        router.register(MessageType.START_GAME,
+                        lambda data, client: self.handle_start_game(client['player_id']))
+        router.register(MessageType.DICE_ROLL,
+                        lambda data, client: self.handle_dice_roll(client['player_id'], data))
+        router.register(MessageType.EFFECT_DICE_ROLL,
+                        lambda data, client: self.handle_effect_dice_roll(client['player_id'], data))
+        router.register(MessageType.AI_TURN_START,
+                        lambda data, client: self.handle_ai_turn_start(client['player_id'], data))
+        router.register(MessageType.STATE_ACK,
+                        lambda data, client: self.handle_state_ack(client['socket'], client['player_id'], data))
+        router.register(MessageType.PING,
+                        lambda data, client: self.handle_ping(client['socket'], data))
+        return router
+    
+    def process_message(self, client_socket: socket.socket, player_id: str, message: NetworkMessage):
+        """处理接收到的消息：以该连接的 client_info 为上下文查表分发（见 build_router）"""
+        client_info = self.clients.get(client_socket)
+        if client_info is None:
+            # 连接已被移除（正在断开），只保留处理器需要的字段
+            client_info = {'socket': client_socket, 'player_id': player_id, 'spectating': None}
+        self.router.dispatch(message, client_info)
+    
+    def count_message(self, message: NetworkMessage, client_info: dict):
+        """前置钩子：按类型统计接收的消息数（计数函数按需创建，之后按编号直接取用）"""
+        type_id = message.type.type_id
+        count = self.message_counters[type_id]
+        if count is None:
+            count = self.message_counters[type_id] = self.metrics.counter('messages_in', type=message.type.value)
+        count()
+    
+    def validate_message(self, message: NetworkMessage, client_info: dict):
+        """前置钩子：丢弃数据部分不是对象的消息，处理器可以直接调用 data.get"""
+        if not isinstance(message.data, dict):
+            self.metrics.inc('messages_invalid')
+            return False
+    
+    def divert_spectator_message(self, message: NetworkMessage, client_info: dict):
+        """前置钩子：观战者的消息交给 process_spectator_message，不进入玩家的处理器"""
+        if client_info['spectating']:
+            self.process_spectator_message(client_info['socket'], client_info, message)
+            return False
+    
+    def observe_handler_latency(self, message: NetworkMessage, elapsed: float, client_info: dict):
+        """后置钩子：按类型记录处理延迟"""
+        type_id = message.type.type_id
+        latency = self.handler_latency[type_id]
+        if latency is None:
+            latency = self.handler_latency[type_id] = self.metrics.histogram(
+                'handler_latency_seconds', type=message.type.value)
+        latency.observe(elapsed)
+    
+    def process_spectator_message(self, client_socket: socket.socket, client_info: dict, message: NetworkMessage):
+        """观战者是只读的：只处理心跳和关键帧请求，其余消息忽略"""
+        if message.type == MessageType.PING:
+            self.handle_ping(client_socket, message.data)
+        elif message.type == MessageType.STATE_ACK and message.data.get('version') is None:
+            self.send_spectator_keyframe(client_socket, client_info)
+    
+    def handle_ping(self, client_socket: socket.socket, data: dict):
+        """
+        回复 PONG（心跳时间已在 dispatch_frame 中随每一帧更新）
+
+        PING 带客户端发送时刻 t0 时，PONG 回带 t0 以及本机收到 PING 和发出 PONG 的时刻 t1、t2，
+        客户端据此计算往返延迟和时钟偏差（见 network/latency.py）
+        """
+        received = time.monotonic()
+        t0 = data.get('t0')
+        pong = {'t0': t0, 't1': received, 't2': time.monotonic()} if isinstance(t0, (int, float)) else {}
+        self.send_to_client(client_socket, NetworkMessage(MessageType.PONG, pong))
+    
+    def resolve_player_id(self, client_socket: socket.socket, player_id: str) -> str:
+        """获取连接当前对应的玩家ID"""
+        client_info = self.clients.get(client_socket)
+        return client_info['player_id'] if client_info else player_id
+    
+    def get_player_room(self, player_id: str) -> Optional[GameRoom]:
+        """查找玩家所在的房间"""
+        with self.lock:
+            room_id = self.player_rooms.get(player_id)
+            return self.rooms.get(room_id) if room_id else None
+    
+    def close_room_if_empty(self, room: GameRoom):
+        """房间没有玩家时将其移除（需持有房间锁）"""
+        if room.players or room.closed:
+            return
+        room.closed = True
+        self.scheduler.cancel(('ai', room))
+        self.scheduler.cancel(('restore', room))
+        if self.store:
+            self.store.delete(room.room_id)
+        if room.journal is not None:
+            room.journal_writer.close_room(room.journal)
+        with self.lock:
+            if self.rooms.get(room.room_id) is room:
+                del self.rooms[room.room_id]
+        # 房间已不存在，断开观战者（由接收端完成清理）
+        for spectator_info in room.spectators.values():
+            self.shutdown_client_socket(spectator_info['socket'])
     
     def handle_join_room(self, client_socket: socket.socket, player_id: str, data: dict):
         """处理加入房间请求"""
@@ -184,141 +718,468 @@ class GameServer:
             self.send_to_client(client_socket, fail_msg)
             return
         
-        with self.lock:
-            # 创建或获取房间
-            if room_id not in self.rooms:
-                self.rooms[room_id] = GameRoom(room_id)
-            
-            room = self.rooms[room_id]
+        if data.get('spectate'):
+            self.handle_spectate_room(client_socket, player_id, room_id, player_name, data)
+            return
+        
+        while True:
+            with self.lock:
+                # 创建或获取房间
+                room = self.rooms.get(room_id)
+                if room is None:
+                    room = self.rooms[room_id] = GameRoom(room_id, lock=self.metrics.timed_lock(
+                        threading.RLock(), 'room'))
+                    if self.journal:
+                        room.journal_writer = self.journal
+                        room.journal = self.journal.open_room(room_id)
             
-            # 检查游戏是否已经开始
-            if room.game_started:
-                fail_msg = NetworkMessage(MessageType.JOIN_FAILED, {
-                    'reason': '游戏已经开始，无法加入'
-                })
-                self.send_to_client(client_socket, fail_msg)
+            with room.lock:
+                if room.closed:
+                    # 房间在获取后被并发移除，重新获取
+                    continue
+                self.join_room_locked(room, client_socket, player_id, player_name, client_version, data)
+                return
+    
+    def handle_spectate_room(self, client_socket: socket.socket, spectator_id: str, room_id: str,
+                             spectator_name: str, data: dict):
+        """以观战者身份进入已存在的房间：先发送状态快照，之后接收与玩家相同的广播"""
+        with self.lock:
+            room = self.rooms.get(room_id)
+        if room is None:
+            self.send_to_client(client_socket, NetworkMessage(MessageType.JOIN_FAILED, {
+                'reason': '房间不存在'
+            }))
+            return
+        
+        with room.lock:
+            if room.closed:
+                self.send_to_client(client_socket, NetworkMessage(MessageType.JOIN_FAILED, {
+                    'reason': '房间不存在'
+                }))
                 return
             
-            # 尝试加入房间
-            player_info = {
-                'id': player_id,
-                'name': player_name,
+            codec = choose_codec(data.get('codecs'))
+            spectator_info = {
+                'id': spectator_id,
+                'name': spectator_name,
                 'socket': client_socket,
-                'slot': len(room.players),  # 玩家槽位
-                'version': client_version
+                'codec': codec
             }
+            if not room.add_spectator(spectator_id, spectator_info, self.max_spectators):
+                self.send_to_client(client_socket, NetworkMessage(MessageType.JOIN_FAILED, {
+                    'reason': '观战人数已满'
+                }))
+                return
             
-            if room.add_player(player_id, player_info):
-                self.player_rooms[player_id] = room_id
-                
-                # 发送加入成功消息
-                success_msg = NetworkMessage(MessageType.JOIN_SUCCESS, {
-                    'player_id': player_id,
-                    'slot': player_info['slot'],
-                    'is_host': room.is_host(player_id),
-                    'players': self.get_room_players_info(room)
-                })
-                self.send_to_client(client_socket, success_msg)
-                
-                # 通知房间内其他玩家
-                join_msg = NetworkMessage(MessageType.PLAYER_JOINED, {
-                    'player_id': player_id,
-                    'player_name': player_name,
-                    'slot': player_info['slot']
-                })
-                self.broadcast_to_room(room_id, join_msg, exclude_player=player_id)
-            else:
-                # 房间已满
-                fail_msg = NetworkMessage(MessageType.JOIN_FAILED, {
-                    'reason': '房间已满'
-                })
-                self.send_to_client(client_socket, fail_msg)
+            # 持有房间锁时不会有新的广播，快照之后的消息都经分发队列按顺序到达
+            success_msg = NetworkMessage(MessageType.JOIN_SUCCESS, {
+                'player_id': spectator_id,
+                'slot': None,
+                'is_host': False,
+                'players': self.get_room_players_info(room),
+                'codec': codec,
+                'seq': room.next_seq - 1,
+                'ping_interval': self.idle_ping_interval,
+                'spectator': True,
+                'game_started': room.game_started,
+                'authoritative': room.game is not None
+            })
+            self.send_to_client(client_socket, success_msg)
+            client_info = self.clients.get(client_socket)
+            if client_info:
+                client_info['codec'] = codec
+                client_info['spectating'] = room.room_id
+                client_info['outbox'].high_water = self.spectator_high_water
+            
+            if room.state_tracker and room.state_tracker.history:
+                keyframe = NetworkMessage(MessageType.GAME_STATE, room.state_tracker.build_update(None))
+                self.send_to_client(client_socket, keyframe)
+            print(f"观战者 {spectator_name} 进入房间 {room.room_id}（共 {len(room.spectators)} 人观战）")
     
-    def handle_start_game(self, player_id: str):
-        """处理开始游戏请求"""
+    def send_spectator_keyframe(self, client_socket: socket.socket, client_info: dict):
+        """观战者缺少基准版本时补发关键帧（经分发队列，保证与之前的增量顺序一致）"""
         with self.lock:
-            room_id = self.player_rooms.get(player_id)
-            if not room_id:
+            room = self.rooms.get(client_info['spectating'])
+        if not room:
+            return
+        with room.lock:
+            tracker = room.state_tracker
+            if not tracker or not tracker.history:
                 return
+            codec = client_info['codec']
+            keyframe = NetworkMessage(MessageType.GAME_STATE, tracker.build_update(None))
+            self.fanout.submit(((client_socket, codec),), {codec: encode_message(keyframe, codec)})
+            self.record_sent(MessageType.GAME_STATE, 1, 1)
+    
+    def join_room_locked(self, room: GameRoom, client_socket: socket.socket, player_id: str,
+                         player_name: str, client_version: str, data: dict):
+        """在持有房间锁的情况下把玩家加入房间"""
+        # 携带会话令牌的客户端是在断线重连
+        session_token = data.get('session_token')
+        if session_token and self.resume_session_locked(room, client_socket, session_token, data):
+            return
+        
+        # 检查游戏是否已经开始
+        if room.game_started:
+            fail_msg = NetworkMessage(MessageType.JOIN_FAILED, {
+                'reason': '游戏已经开始，无法加入'
+            })
+            self.send_to_client(client_socket, fail_msg)
+            return
+        
+        # 尝试加入房间
+        player_info = {
+            'id': player_id,
+            'name': player_name,
+            'socket': client_socket,
+            'slot': len(room.players),  # 玩家槽位
+            'version': client_version,
+            'authoritative': bool(data.get('authoritative'))  # 旧客户端不支持服务器权威模式
+        }
+        
+        if room.add_player(player_id, player_info):
+            session_token = player_info['session_token'] = secrets.token_urlsafe(16)
+            with self.lock:
+                self.player_rooms[player_id] = room.room_id
+                self.sessions[session_token] = player_id
+            self.persist_room(room)
             
-            room = self.rooms.get(room_id)
-            if not room or not room.is_host(player_id) or not room.can_start():
+            # 协商消息编码：旧客户端不发送codecs字段，继续使用JSON
+            codec = choose_codec(data.get('codecs'))
+            
+            # 发送加入成功消息
+            success_msg = NetworkMessage(MessageType.JOIN_SUCCESS, {
+                'player_id': player_id,
+                'slot': player_info['slot'],
+                'is_host': room.is_host(player_id),
+                'players': self.get_room_players_info(room),
+                'codec': codec,
+                'session_token': session_token,
+                'seq': room.next_seq - 1,  # 加入时房间广播的最新序号
+                'ping_interval': self.idle_ping_interval
+            })
+            self.send_to_client(client_socket, success_msg)
+            client_info = self.clients.get(client_socket)
+            if client_info:
+                client_info['codec'] = codec
+            
+            # 通知房间内其他玩家
+            join_msg = NetworkMessage(MessageType.PLAYER_JOINED, {
+                'player_id': player_id,
+                'player_name': player_name,
+                'slot': player_info['slot']
+            })
+            self.broadcast_to_room(room.room_id, join_msg, exclude_player=player_id)
+        else:
+            # 房间已满
+            fail_msg = NetworkMessage(MessageType.JOIN_FAILED, {
+                'reason': '房间已满'
+            })
+            self.send_to_client(client_socket, fail_msg)
+    
+    def resume_session_locked(self, room: GameRoom, client_socket: socket.socket,
+                              session_token: str, data: dict) -> bool:
+        """凭会话令牌恢复玩家（需持有房间锁），令牌无效时返回False"""
+        with self.lock:
+            player_id = self.sessions.get(session_token)
+        player_info = room.players.get(player_id) if player_id else None
+        if not player_info:
+            return False
+        
+        # 服务器可能还没发现旧连接已断开，由新连接取代
+        old_socket = player_info['socket']
+        if old_socket is not None and old_socket is not client_socket:
+            self.detach_client(old_socket)
+        
+        codec = choose_codec(data.get('codecs'))
+        with self.lock:
+            client_info = self.clients.get(client_socket)
+            if client_info:
+                client_info['player_id'] = player_id
+                client_info['codec'] = codec
+            self.player_rooms[player_id] = room.room_id
+        player_info['socket'] = client_socket
+        self.scheduler.cancel(('session', session_token))
+        if room.game_started:
+            self.scheduler.schedule(('operation', player_id), time.monotonic() + self.operation_timeout,
+                                    self.on_operation_timeout, player_id)
+        
+        last_seq = data.get('last_seq')
+        missed, complete = room.get_missed_messages(player_id, last_seq if isinstance(last_seq, int) else 0)
+        print(f"玩家 {player_id} 恢复会话，补发 {len(missed)} 条消息")
+        self.metrics.inc('sessions_resumed')
+        
+        success_msg = NetworkMessage(MessageType.JOIN_SUCCESS, {
+            'player_id': player_id,
+            'slot': player_info['slot'],
+            'is_host': room.is_host(player_id),
+            'players': self.get_room_players_info(room),
+            'codec': codec,
+            'session_token': session_token,
+            'seq': room.next_seq - 1,
+            'ping_interval': self.idle_ping_interval,
+            'resumed': True,
+            'replay_complete': complete
+        })
+        self.send_to_client(client_socket, success_msg)
+        for message in missed:
+            self.send_to_client(client_socket, message)
+        
+        # 从AI手中收回槽位
+        slot = player_info['slot']
+        if room.game:
+            room.game.set_player_human(slot)
+        resumed_msg = NetworkMessage(MessageType.PLAYER_RESUMED, {
+            'player_id': player_id,
+            'player_slot': slot,
+            'player_name': player_info['name']
+        })
+        self.broadcast_to_room(room.room_id, resumed_msg, exclude_player=player_id)
+        
+        # 重连的客户端从关键帧开始同步状态
+        if room.state_tracker:
+            room.state_tracker.acknowledge(player_id, None)
+            if not self.publish_state(room):
+                keyframe = NetworkMessage(MessageType.GAME_STATE, room.state_tracker.build_update(None))
+                self.send_to_client(client_socket, keyframe)
+        self.schedule_ai_turn(room, AI_THINK_DELAY)
+        return True
+    
+    def handle_start_game(self, player_id: str):
+        """处理开始游戏请求"""
+        room = self.get_player_room(player_id)
+        if not room:
+            return
+        
+        with room.lock:
+            if room.closed or not room.is_host(player_id) or not room.can_start():
                 return
             
             # 标记游戏开始
             room.game_started = True
             
+            # 游戏开始后才检查操作超时
+            deadline = time.monotonic() + self.operation_timeout
+            for pid in room.players:
+                self.scheduler.schedule(('operation', pid), deadline, self.on_operation_timeout, pid)
+            
+            # 所有客户端都支持时由服务器运行游戏规则，否则沿用房主转发AI回合的方式
+            players_info = self.get_room_players_info(room)
+            if room.supports_authoritative():
+                room.game = ServerGameLogic()
+                room.game.setup_players(players_info)
+                room.state_tracker = StateTracker()
+            
             # 发送游戏开始消息给所有玩家
             start_msg = NetworkMessage(MessageType.GAME_STARTED, {
-                'players': self.get_room_players_info(room)
+                'players': players_info,
+                'authoritative': room.game is not None
             })
-            self.broadcast_to_room(room_id, start_msg)
+            self.broadcast_to_room(room.room_id, start_msg)
+            
+            self.persist_room(room)
+            if room.game:
+                self.publish_state(room)
+                self.schedule_ai_turn(room, AI_THINK_DELAY)
     
     def handle_dice_roll(self, player_id: str, data: dict):
         """处理骰子投掷"""
-        room_id = self.player_rooms.get(player_id)
-        if not room_id:
+        room = self.get_player_room(player_id)
+        if not room:
             return
         
-        # 如果客户端没有发送player_slot，才根据player_id查找
-        if 'player_slot' not in data:
-            room = self.rooms.get(room_id)
-            if room and player_id in room.players:
-                player_slot = room.players[player_id]['slot']
-                data['player_slot'] = player_slot
-        
-        # 广播骰子结果给房间内所有玩家
-        dice_msg = NetworkMessage(MessageType.DICE_ROLL, data)
-        # 排除发送者，避免重复处理
-        self.broadcast_to_room(room_id, dice_msg, exclude_player=player_id)
+        with room.lock:
+            if room.game:
+                self.handle_move_intent(room, player_id)
+                return
+            
+            # 如果客户端没有发送player_slot，才根据player_id查找
+            if 'player_slot' not in data and player_id in room.players:
+                data['player_slot'] = room.players[player_id]['slot']
+            
+            # 广播骰子结果给房间内所有玩家
+            dice_msg = NetworkMessage(MessageType.DICE_ROLL, data)
+            # 排除发送者，避免重复处理
+            self.broadcast_to_room(room.room_id, dice_msg, exclude_player=player_id)
     
     def handle_effect_dice_roll(self, player_id: str, data: dict):
         """处理效果骰子投掷"""
-        room_id = self.player_rooms.get(player_id)
-        if not room_id:
+        room = self.get_player_room(player_id)
+        if not room:
             return
         
-        # 如果客户端没有发送player_slot，才根据player_id查找
-        if 'player_slot' not in data:
-            room = self.rooms.get(room_id)
-            if room and player_id in room.players:
-                player_slot = room.players[player_id]['slot']
-                data['player_slot'] = player_slot
-        
-        # 广播效果骰子结果给房间内所有玩家
-        effect_msg = NetworkMessage(MessageType.EFFECT_DICE_ROLL, data)
-        # 排除发送者，避免重复处理
-        self.broadcast_to_room(room_id, effect_msg, exclude_player=player_id)
+        with room.lock:
+            if room.game:
+                self.handle_effect_intent(room, player_id)
+                return
+            
+            # 如果客户端没有发送player_slot，才根据player_id查找
+            if 'player_slot' not in data and player_id in room.players:
+                data['player_slot'] = room.players[player_id]['slot']
+            
+            # 广播效果骰子结果给房间内所有玩家
+            effect_msg = NetworkMessage(MessageType.EFFECT_DICE_ROLL, data)
+            # 排除发送者，避免重复处理
+            self.broadcast_to_room(room.room_id, effect_msg, exclude_player=player_id)
     
     def handle_ai_turn_start(self, player_id: str, data: dict):
         """处理AI回合开始消息（由房主发送）"""
         print(f"\n[服务器] 收到AI_TURN_START消息: player_id={player_id}, data={data}")
         
-        room_id = self.player_rooms.get(player_id)
-        if not room_id:
+        room = self.get_player_room(player_id)
+        if not room:
             print(f"[服务器] 错误: 未找到player_id={player_id}所在的房间")
             return
         
-        room = self.rooms.get(room_id)
-        if not room:
-            print(f"[服务器] 错误: 未找到房间room_id={room_id}")
+        with room.lock:
+            if room.game:
+                # 服务器权威模式下AI回合由服务器执行
+                return
+            if not room.is_host(player_id):
+                print(f"[服务器] 错误: 非房主 {player_id} 尝试发送AI_TURN_START消息")
+                return
+                
+            # 打印房间信息
+            player_info = []
+            for pid, pdata in room.players.items():
+                player_info.append(f"{pid}(slot={pdata.get('slot')})")
+            player_str = ", ".join(player_info)
+            print(f"[服务器] 房间信息: room_id={room.room_id}, 玩家列表: {player_str}")
+                
+            # 广播AI回合开始消息给房间内所有玩家
+            ai_turn_msg = NetworkMessage(MessageType.AI_TURN_START, data)
+            self.broadcast_to_room(room.room_id, ai_turn_msg)
+            print(f"[服务器] 已广播AI回合开始消息，player_slot={data.get('player_slot')}")
+    
+    def handle_move_intent(self, room: GameRoom, player_id: str):
+        """服务器权威模式：玩家请求投移动骰子（需持有房间锁）"""
+        slot = room.get_player_slot(player_id)
+        if slot is None or not room.game.is_waiting_for_move(slot):
+            return  # 不是该玩家的回合，忽略
+        self.play_move(room, player_id)
+    
+    def handle_effect_intent(self, room: GameRoom, player_id: str):
+        """服务器权威模式：玩家请求投效果骰子（需持有房间锁）"""
+        slot = room.get_player_slot(player_id)
+        if slot is None or not room.game.is_waiting_for_effect(slot):
             return
-            
-        if not room.is_host(player_id):
-            print(f"[服务器] 错误: 非房主 {player_id} 尝试发送AI_TURN_START消息")
+        self.play_effect(room, player_id)
+    
+    def play_move(self, room: GameRoom, player_id: Optional[str]):
+        """服务器投移动骰子并广播结果（需持有房间锁）"""
+        game = room.game
+        slot = game.current_player
+        dice_result, effect_type = game.roll_move()
+        
+        # 发送者也需要收到服务器决定的点数
+        dice_msg = NetworkMessage(MessageType.DICE_ROLL, {
+            'dice_result': dice_result,
+            'player_id': player_id,
+            'player_slot': slot
+        })
+        self.broadcast_to_room(room.room_id, dice_msg)
+        self.publish_state(room)
+        self.schedule_ai_turn(room, ai_delay_after_move(dice_result, effect_type))
+    
+    def play_effect(self, room: GameRoom, player_id: Optional[str]):
+        """服务器投效果骰子并广播结果（需持有房间锁）"""
+        game = room.game
+        slot = game.current_player
+        effect_result = game.roll_effect()
+        
+        effect_msg = NetworkMessage(MessageType.EFFECT_DICE_ROLL, {
+            'effect_result': effect_result,
+            'player_id': player_id,
+            'player_slot': slot
+        })
+        self.broadcast_to_room(room.room_id, effect_msg)
+        self.publish_state(room)
+        self.schedule_ai_turn(room, ai_delay_after_effect())
+    
+    def schedule_ai_turn(self, room: GameRoom, delay: float):
+        """当前回合由AI操作时，安排服务器在客户端动画结束后代为行动（需持有房间锁）"""
+        if room.game and room.game.is_ai_turn():
+            self.scheduler.schedule(('ai', room), time.monotonic() + delay, self.on_ai_turn, room)
+    
+    def on_ai_turn(self, room: GameRoom):
+        """执行AI回合的下一步操作"""
+        with room.lock:
+            game = room.game
+            if room.closed or not game or not game.is_ai_turn():
+                return
+            if not room.has_connected_players():
+                return  # 所有玩家都在等待重连，恢复会话时再继续
+            if game.effect_type:
+                self.play_effect(room, None)
+            else:
+                self.play_move(room, None)
+    
+    def hand_over_to_ai(self, room: GameRoom, slot: int):
+        """服务器权威模式下由AI接管掉线玩家（需持有房间锁）"""
+        if not room.game:
             return
-            
-        # 打印房间信息
-        player_info = []
-        for pid, pdata in room.players.items():
-            player_info.append(f"{pid}(slot={pdata.get('slot')})")
-        player_str = ", ".join(player_info)
-        print(f"[服务器] 房间信息: room_id={room_id}, 玩家列表: {player_str}")
-            
-        # 广播AI回合开始消息给房间内所有玩家
-        ai_turn_msg = NetworkMessage(MessageType.AI_TURN_START, data)
-        self.broadcast_to_room(room_id, ai_turn_msg)
-        print(f"[服务器] 已广播AI回合开始消息，player_slot={data.get('player_slot')}")
+        room.game.set_player_ai(slot)
+        self.publish_state(room)
+        if room.game.current_player == slot:
+            self.schedule_ai_turn(room, AI_THINK_DELAY)
+    
+    def publish_state(self, room: GameRoom) -> bool:
+        """记录新的状态版本，并向每个玩家发送相对于其已确认版本的增量（需持有房间锁）"""
+        tracker = room.state_tracker
+        if not room.game or not tracker or not tracker.commit(room.game.get_game_state()):
+            return False
+        self.persist_room(room)
+        
+        # 基准版本相同的客户端共享同一帧
+        frames = {}  # (base, codec) -> 已编码的帧
+        frames_sent = 0
+        for pid, pinfo in room.players.items():
+            client_socket = pinfo['socket']
+            if client_socket not in self.clients:
+                continue  # 已超时由AI接管的玩家
+            base = tracker.base_for(pid)
+            codec = self.get_client_codec(client_socket)
+            frame = frames.get((base, codec))
+            if frame is None:
+                state_msg = NetworkMessage(MessageType.GAME_STATE, tracker.build_update(base))
+                frame = frames[(base, codec)] = encode_message(state_msg, codec)
+            self.send_frame_to_client(client_socket, frame)
+            frames_sent += 1
+            if room.journal is not None:
+                room.record_frame(DIRECTION_OUT, pinfo['slot'], frame)
+        
+        if room.spectator_targets:
+            # 观战者不逐个确认版本，共享相对于上一版本的同一帧
+            base = tracker.spectator_base()
+            spectator_frames = {}
+            for codec in room.spectator_codecs:
+                frame = frames.get((base, codec))
+                if frame is None:
+                    state_msg = NetworkMessage(MessageType.GAME_STATE, tracker.build_update(base))
+                    frame = frames[(base, codec)] = encode_message(state_msg, codec)
+                spectator_frames[codec] = frame
+            self.fanout.submit(room.spectator_targets, spectator_frames)
+            frames_sent += len(room.spectator_targets)
+        
+        if frames_sent:
+            self.record_sent(MessageType.GAME_STATE, len(frames), frames_sent)
+        return True
+    
+    def handle_state_ack(self, client_socket: socket.socket, player_id: str, data: dict):
+        """客户端确认状态版本；确认None表示缺少基准版本，立即补发关键帧"""
+        room = self.get_player_room(player_id)
+        if not room:
+            return
+        
+        with room.lock:
+            tracker = room.state_tracker
+            if not tracker or not tracker.history:
+                return
+            version = data.get('version')
+            tracker.acknowledge(player_id, version)
+            if version is None:
+                keyframe = NetworkMessage(MessageType.GAME_STATE, tracker.build_update(None))
+                self.send_to_client(client_socket, keyframe)
     
     def get_room_players_info(self, room: GameRoom) -> list:
         """获取房间内玩家信息"""
@@ -332,140 +1193,343 @@ class GameServer:
             })
         return players_info
     
+    def get_client_codec(self, client_socket: socket.socket) -> str:
+        """获取客户端协商好的消息编码"""
+        client_info = self.clients.get(client_socket)
+        return client_info['codec'] if client_info else CODEC_JSON
+    
+    def record_sent(self, msg_type: MessageType, encodes: int, frames_sent: int):
+        """记录发出的消息数和序列化次数（广播时每种编码只序列化一次）"""
+        metrics = self.metrics
+        metrics.inc('messages_out', frames_sent, type=msg_type.value)
+        metrics.inc('encodes', encodes)
+        metrics.inc('frames_sent', frames_sent)
+    
+    def get_encode_stats(self) -> dict:
+        """获取编码统计"""
+        encodes = self.metrics.get_counter('encodes')
+        frames_sent = self.metrics.get_counter('frames_sent')
+        return {
+            'encodes': encodes,  # 实际执行的序列化次数
+            'frames_sent': frames_sent,  # 发出的帧数
+            'encodes_saved': frames_sent - encodes  # 广播复用已编码帧而省下的序列化次数
+        }
+    
+    def send_frame_to_client(self, client_socket: socket.socket, frame: bytes):
+        """发送已编码的帧给客户端（放入该连接的发送队列，不阻塞调用者）"""
+        client_info = self.clients.get(client_socket)
+        if not client_info:
+            return
+        
+        outbox = client_info['outbox']
+        self.bytes_out.add(len(frame))
+        try:
+            result = outbox.push(client_socket, frame)
+        except OSError as e:
+            outbox.close()
+            self.handle_send_error(client_socket, e)
+            return
+        
+        if result == SEND_PENDING:
+            self.watch_writable(client_socket, outbox)
+        elif result == SEND_OVERFLOW:
+            self.handle_slow_client(client_socket, client_info)
+    
+    def watch_writable(self, client_socket: socket.socket, outbox: OutboundQueue):
+        """发送队列有积压时，等待socket可写后继续发送"""
+        if self.writer:
+            self.writer.watch(client_socket, outbox)
+    
+    def handle_slow_client(self, client_socket: socket.socket, client_info: dict):
+        """处理发送队列超过高水位线的慢速客户端"""
+        if not client_info['slow']:
+            client_info['slow'] = True
+            self.metrics.inc('slow_clients')
+            print(f"客户端 {client_info['player_id']} 发送积压超过 {self.outbound_high_water} 字节"
+                  f"（策略: {self.slow_client_policy}）")
+        
+        if self.slow_client_policy == 'disconnect':
+            # 丢弃积压并关闭读写，接收端随后走正常的断开流程
+            client_info['outbox'].close()
+            self.shutdown_client_socket(client_socket)
+    
+    def handle_send_error(self, client_socket: socket.socket, error: Exception):
+        """发送失败：关闭连接读写，由接收端完成清理"""
+        print(f"发送消息失败: {error}")
+        self.shutdown_client_socket(client_socket)
+    
+    def shutdown_client_socket(self, client_socket: socket.socket):
+        """关闭socket读写（不释放socket），唤醒阻塞在该连接上的接收处理"""
+        try:
+            client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def close_client_socket(self, client_socket: socket.socket, client_info: Optional[dict]):
+        """释放客户端socket及其发送队列"""
+        if client_info:
+            client_info['outbox'].close()
+        # 先关闭读写以唤醒仍在等待该socket的接收线程
+        self.shutdown_client_socket(client_socket)
+        if self.writer:
+            self.writer.discard(client_socket)
+        else:
+            try:
+                client_socket.close()
+            except OSError:
+                pass
+    
     def send_to_client(self, client_socket: socket.socket, message: NetworkMessage):
         """发送消息给客户端"""
-        try:
-            client_socket.send((message.to_json() + '\n').encode('utf-8'))
-        except Exception as e:
-            print(f"发送消息失败: {e}")
+        frame = encode_message(message, self.get_client_codec(client_socket))
+        self.record_sent(message.type, 1, 1)
+        self.send_frame_to_client(client_socket, frame)
+        if self.journal:
+            self.journal_client_frame(client_socket, DIRECTION_OUT, frame)
     
     def broadcast_to_room(self, room_id: str, message: NetworkMessage, exclude_player: Optional[str] = None):
-        """广播消息给房间内所有玩家"""
+        """广播消息给房间内所有玩家（每种编码只序列化一次，所有接收者共享同一帧）"""
         room = self.rooms.get(room_id)
         if not room:
             return
         
-        for player_id, player_info in room.players.items():
-            if player_id != exclude_player:
-                self.send_to_client(player_info['socket'], message)
+        frames = {}  # codec -> 已编码的帧（bytes不可变，可安全共享）
+        frames_sent = 0
+        with room.lock:
+            # 记录带序号的消息，掉线的玩家重连后补发
+            message.seq = room.next_seq
+            room.next_seq += 1
+            room.outbound_log.append((message.seq, message, exclude_player))
+            
+            for player_id, player_info in room.players.items():
+                if player_id == exclude_player:
+                    continue
+                client_socket = player_info['socket']
+                if client_socket is None:
+                    continue  # 等待重连的玩家
+                codec = self.get_client_codec(client_socket)
+                frame = frames.get(codec)
+                if frame is None:
+                    frame = frames[codec] = encode_message(message, codec)
+                self.send_frame_to_client(client_socket, frame)
+                frames_sent += 1
+            
+            if room.spectator_targets:
+                # 观战者复用同一帧，交给低优先级分发队列，不在房间锁内逐个写socket
+                for codec in room.spectator_codecs:
+                    if codec not in frames:
+                        frames[codec] = encode_message(message, codec)
+                self.fanout.submit(room.spectator_targets, frames)
+                frames_sent += len(room.spectator_targets)
+            
+            if room.journal is not None:
+                # 广播只记录一次，槽位记为整个房间
+                frame = next(iter(frames.values()), None) or encode_message(message)
+                room.record_frame(DIRECTION_OUT, SLOT_ROOM, frame)
+        
+        if frames_sent:
+            self.record_sent(message.type, len(frames), frames_sent)
     
     def disconnect_client(self, client_socket: socket.socket, player_id: str):
         """断开客户端连接"""
+        player_id = self.resolve_player_id(client_socket, player_id)
+        self.release_player(client_socket, player_id, '连接断开')
+    
+    def release_spectator(self, client_socket: socket.socket) -> bool:
+        """观战者断开：移出房间并释放连接，不是观战者时返回False"""
+        client_info = self.clients.get(client_socket)
+        if not client_info or not client_info['spectating']:
+            return False
         with self.lock:
-            # 从房间移除玩家
-            room_id = self.player_rooms.get(player_id)
-            if room_id and room_id in self.rooms:
-                room = self.rooms[room_id]
-                room.remove_player(player_id)
-                
-                # 通知其他玩家
-                leave_msg = NetworkMessage(MessageType.PLAYER_LEFT, {
-                    'player_id': player_id
-                })
-                self.broadcast_to_room(room_id, leave_msg)
-                
-                # 如果房间空了，删除房间
-                if not room.players:
-                    del self.rooms[room_id]
-            
-            # 清理连接信息
-            if player_id in self.player_rooms:
-                del self.player_rooms[player_id]
-            if client_socket in self.clients:
-                del self.clients[client_socket]
+            room = self.rooms.get(client_info['spectating'])
+        if room:
+            with room.lock:
+                room.remove_spectator(client_info['player_id'])
+        with self.lock:
+            self.clients.pop(client_socket, None)
+        self.scheduler.cancel(('heartbeat', client_socket))
+        self.close_client_socket(client_socket, client_info)
+        return True
+    
+    def release_player(self, client_socket: socket.socket, player_id: str, reason: str,
+                       announce: bool = False):
+        """
+        释放连接对应的玩家：游戏未开始时移出房间；游戏已开始时由AI接管并保留会话等待重连
         
-        try:
-            client_socket.close()
-        except:
-            pass
+        Args:
+            reason: 断线原因
+            announce: 游戏未开始时是否也发送断线通知
+        """
+        if self.release_spectator(client_socket):
+            return
+        
+        replaced = False  # 玩家已在新连接上恢复会话，旧连接只需释放
+        suspended = False
+        room = self.get_player_room(player_id)
+        if room:
+            with room.lock:
+                player_info = room.players.get(player_id)
+                if player_info is not None and player_info['socket'] is not client_socket:
+                    replaced = True
+                elif player_info is not None and room.game_started:
+                    self.suspend_player_locked(room, player_id, reason)
+                    suspended = True
+                elif player_info is not None:
+                    if announce:
+                        disconnected_msg = NetworkMessage(MessageType.PLAYER_DISCONNECTED, {
+                            'player_id': player_id,
+                            'player_slot': player_info['slot'],
+                            'player_name': player_info['name'],
+                            'reason': reason
+                        })
+                        self.broadcast_to_room(room.room_id, disconnected_msg, exclude_player=player_id)
+                    self.remove_player_locked(room, player_id)
+        
+        # 清理连接信息
+        with self.lock:
+            if not replaced and not suspended:
+                self.player_rooms.pop(player_id, None)
+            client_info = self.clients.pop(client_socket, None)
+        self.scheduler.cancel(('heartbeat', client_socket))
+        if not replaced:
+            self.scheduler.cancel(('operation', player_id))
+        
+        self.close_client_socket(client_socket, client_info)
+    
+    def detach_client(self, client_socket: socket.socket):
+        """释放已被新连接取代的旧连接（玩家仍留在房间中）"""
+        with self.lock:
+            client_info = self.clients.pop(client_socket, None)
+        self.scheduler.cancel(('heartbeat', client_socket))
+        self.close_client_socket(client_socket, client_info)
+    
+    def suspend_player_locked(self, room: GameRoom, player_id: str, reason: str):
+        """游戏中掉线：由AI接管槽位，会话保留 session_timeout 秒（需持有房间锁）"""
+        player_info = room.players[player_id]
+        player_info['socket'] = None
+        
+        # 发送断线通知给其他玩家
+        disconnected_msg = NetworkMessage(MessageType.PLAYER_DISCONNECTED, {
+            'player_id': player_id,
+            'player_slot': player_info['slot'],
+            'player_name': player_info['name'],
+            'reason': reason
+        })
+        self.broadcast_to_room(room.room_id, disconnected_msg, exclude_player=player_id)
+        
+        # 通知AI接管
+        takeover_msg = NetworkMessage(MessageType.AI_TAKEOVER, {
+            'player_slot': player_info['slot'],
+            'player_name': player_info['name']
+        })
+        self.broadcast_to_room(room.room_id, takeover_msg)
+        self.hand_over_to_ai(room, player_info['slot'])
+        
+        session_token = player_info.get('session_token')
+        if session_token:
+            self.scheduler.schedule(('session', session_token), time.monotonic() + self.session_timeout,
+                                    self.on_session_expired, session_token)
+    
+    def remove_player_locked(self, room: GameRoom, player_id: str):
+        """把玩家移出房间并通知其他玩家（需持有房间锁）"""
+        player_info = room.players.get(player_id)
+        if player_info is None:
+            return
+        with self.lock:
+            self.sessions.pop(player_info.get('session_token'), None)
+        room.remove_player(player_id)
+        if room.state_tracker:
+            room.state_tracker.forget(player_id)
+        if room.players:
+            self.persist_room(room)
+        
+        # 通知其他玩家
+        leave_msg = NetworkMessage(MessageType.PLAYER_LEFT, {
+            'player_id': player_id
+        })
+        self.broadcast_to_room(room.room_id, leave_msg)
+        
+        # 如果房间空了，删除房间
+        self.close_room_if_empty(room)
+    
+    def on_session_expired(self, session_token: str):
+        """掉线玩家未在时限内重连，正式移出房间"""
+        with self.lock:
+            player_id = self.sessions.get(session_token)
+        if player_id is None:
+            return
+        room = self.get_player_room(player_id)
+        if room:
+            with room.lock:
+                player_info = room.players.get(player_id)
+                if player_info is None or player_info['socket'] is not None:
+                    return  # 已经重连
+                print(f"玩家 {player_id} 未在 {self.session_timeout} 秒内重连，会话失效")
+                self.metrics.inc('sessions_expired')
+                self.remove_player_locked(room, player_id)
+        with self.lock:
+            self.sessions.pop(session_token, None)
+            self.player_rooms.pop(player_id, None)
     
     def check_heartbeats(self):
-        """检查心跳超时和操作超时"""
+        """超时定时器线程：睡眠到最近的截止时间，只处理到期的定时器"""
         while self.running:
             try:
-                current_time = time.time()
-                with self.lock:
-                    # 检查所有客户端的心跳
-                    timeout_clients = []
-                    for client_socket, client_info in list(self.clients.items()):
-                        player_id = client_info['player_id']
-                        # 检查心跳超时
-                        if current_time - client_info['last_heartbeat'] > self.heartbeat_timeout:
-                            timeout_clients.append((client_socket, player_id))
-                            continue
-                        
-                        # 检查操作超时（仅在游戏已开始时）
-                        room_id = self.player_rooms.get(player_id)
-                        if room_id and room_id in self.rooms:
-                            room = self.rooms[room_id]
-                            # 只有在游戏已开始时才检查操作超时
-                            if room.game_started:
-                                # 获取玩家最后操作时间，如果没有记录则使用当前时间
-                                last_operation_time = self.player_last_operation.get(player_id, current_time)
-                                if current_time - last_operation_time > self.operation_timeout:
-                                    print(f"玩家 {player_id} 操作超时 ({self.operation_timeout}秒)")
-                                    timeout_clients.append((client_socket, player_id))
-                    
-                    # 处理超时的客户端
-                    for client_socket, player_id in timeout_clients:
-                        self.handle_player_timeout(client_socket, player_id)
-                
-                time.sleep(self.check_interval)
+                self.scheduler.wait()
+                self.scheduler.run_expired()
             except Exception as e:
                 print(f"心跳和操作超时检测错误: {e}")
     
+    def on_heartbeat_timeout(self, client_socket: socket.socket, player_id: str):
+        """心跳定时器到期：期间收到过数据时按最后收到数据的时间重新设置，否则认为掉线"""
+        client_info = self.clients.get(client_socket)
+        if client_info:
+            deadline = client_info['last_seen'] + self.heartbeat_timeout
+            if deadline > time.monotonic():
+                self.scheduler.schedule(('heartbeat', client_socket), deadline,
+                                        self.on_heartbeat_timeout, client_socket, player_id)
+                return
+            player_id = self.resolve_player_id(client_socket, player_id)
+            print(f"玩家 {player_id} 心跳超时 ({self.heartbeat_timeout}秒)")
+            self.metrics.inc('heartbeat_timeouts')
+            self.handle_player_timeout(client_socket, player_id)
+    
+    def on_operation_timeout(self, player_id: str):
+        """操作超时（仅在游戏已开始时设置）"""
+        room = self.get_player_room(player_id)
+        if not room or not room.game_started:
+            return
+        player_info = room.players.get(player_id)
+        client_info = self.clients.get(player_info['socket']) if player_info else None
+        if not client_info:
+            return
+        # 期间收到过该玩家的数据时按最后收到数据的时间重新设置
+        deadline = client_info['last_seen'] + self.operation_timeout
+        if deadline > time.monotonic():
+            self.scheduler.schedule(('operation', player_id), deadline, self.on_operation_timeout, player_id)
+            return
+        print(f"玩家 {player_id} 操作超时 ({self.operation_timeout}秒)")
+        self.metrics.inc('operation_timeouts')
+        self.handle_player_timeout(player_info['socket'], player_id)
+    
     def handle_player_timeout(self, client_socket: socket.socket, player_id: str):
         """处理玩家超时"""
         print(f"处理玩家超时: {player_id}")
-        # 获取玩家所在房间
-        room_id = self.player_rooms.get(player_id)
-        if room_id and room_id in self.rooms:
-            room = self.rooms[room_id]
-            if player_id in room.players:
-                player_info = room.players[player_id]
-                
-                # 发送断线通知给其他玩家
-                disconnected_msg = NetworkMessage(MessageType.PLAYER_DISCONNECTED, {
-                    'player_id': player_id,
-                    'player_slot': player_info['slot'],
-                    'player_name': player_info['name'],
-                    'reason': '操作超时'
-                })
-                self.broadcast_to_room(room_id, disconnected_msg, exclude_player=player_id)
-                
-                # 如果游戏已开始，通知AI接管
-                if room.game_started:
-                    takeover_msg = NetworkMessage(MessageType.AI_TAKEOVER, {
-                        'player_slot': player_info['slot'],
-                        'player_name': player_info['name']
-                    })
-                    self.broadcast_to_room(room_id, takeover_msg)
-                else:
-                    # 游戏未开始，直接移除玩家
-                    room.remove_player(player_id)
-                    leave_msg = NetworkMessage(MessageType.PLAYER_LEFT, {
-                        'player_id': player_id
-                    })
-                    self.broadcast_to_room(room_id, leave_msg)
-        
-        # 清理连接和操作时间记录
-        if player_id in self.player_rooms:
-            del self.player_rooms[player_id]
-        if player_id in self.player_last_operation:
-            del self.player_last_operation[player_id]
-        if client_socket in self.clients:
-            del self.clients[client_socket]
-        
-        try:
-            client_socket.close()
-        except:
-            pass
+        self.release_player(client_socket, player_id, '操作超时', announce=True)
     
     def stop(self):
         """停止服务器"""
         self.running = False
+        self.scheduler.notify_all()
         if self.server_socket:
             self.server_socket.close()
+        if self.writer:
+            self.writer.stop()
+        self.fanout.stop()
+        self.stop_metrics()
+        self.stop_discovery()
+        self.stop_journal()
+        self.stop_store()
 
 def main():
     """测试服务器"""
@@ -0,0 +1,288 @@
+"""
+多进程房间分片
+前端路由进程负责接受连接，读到客户端的 JOIN_ROOM 后按 room_id 选择工作进程，
+再通过 Unix 数据报socket把客户端连接的文件描述符连同已读取的数据一起交给该进程。
+同一房间的玩家总是落在同一个工作进程中，GameRoom 状态从不跨进程，
+每个工作进程都是独立的事件循环服务器，可以各自占满一个CPU核心。
+局域网发现探测也由各工作进程应答（共用发现端口），每个进程只报告自己的房间。
+
+没有使用 SO_REUSEPORT：内核按连接四元组分配连接，无法保证同一房间的玩家进入同一进程。
+需要 socket.send_fds（Unix 平台，Python 3.9+）；不支持的平台上 SHARDING_SUPPORTED 为 False。
+"""
+
+import json
+import multiprocessing
+import os
+import secrets
+import selectors
+import socket
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from .protocol import MessageType
+from .event_server import EventLoopGameServer
+from .framing import FrameDecoder, FrameError, decode_message
+
+SHARDING_SUPPORTED = hasattr(socket, 'send_fds') and hasattr(socket, 'AF_UNIX')
+
+MAX_HANDOFF_SIZE = 64 * 1024  # 交接前最多缓存的客户端数据
+JOIN_TIMEOUT = 15  # 连接后多少秒内必须发送 JOIN_ROOM
+
+def shard_for_room(room_id: str, workers: int) -> int:
+    """根据房间ID选择工作进程（稳定哈希，与进程的哈希随机化无关）"""
+    return zlib.crc32(room_id.encode('utf-8')) % workers
+
+class ShardWorkerServer(EventLoopGameServer):
+    """分片工作进程：没有监听socket，只接管路由进程交来的连接"""
+
+    def __init__(self, control_socket: socket.socket, worker_index: int,
+                 host: str = '0.0.0.0', port: int = 29188):
+        super().__init__(host, port)
+        self.control_socket = control_socket
+        self.worker_index = worker_index
+
+    def setup(self):
+        """创建selector并监听路由进程的控制socket"""
+        # 每个工作进程有独立的指标，管理端口和快照文件按工作进程编号区分
+        if self.admin_port:
+            self.admin_port += self.worker_index
+        if self.metrics_dump_path:
+            self.metrics_dump_path = f"{self.metrics_dump_path}.{self.worker_index}"
+        # 房间按 room_id 固定分到工作进程，各工作进程只持久化和恢复自己的房间（重启时工作进程数量需保持不变）
+        if self.state_dir:
+            self.state_dir = os.path.join(self.state_dir, f"worker{self.worker_index}")
+        self.setup_loop()
+        self.control_socket.setblocking(False)
+        self.selector.register(self.control_socket, selectors.EVENT_READ, self.control_ready)
+        print(f"分片工作进程 {self.worker_index} 已启动")
+
+    def control_ready(self, control_socket: socket.socket, mask: int):
+        """接收路由进程交来的连接"""
+        while True:
+            try:
+                packet, fds, _, _ = socket.recv_fds(control_socket, MAX_HANDOFF_SIZE + 4096, 1)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"分片工作进程 {self.worker_index} 控制通道错误: {e}")
+                self.running = False
+                return
+
+            header, _, initial_data = packet.partition(b'\n')
+            try:
+                request = json.loads(header)
+            except ValueError:
+                request = {}
+
+            if request.get('op') == 'stop':
+                self.running = False
+                return
+            if not fds:
+                continue
+
+            client_socket = socket.socket(fileno=fds[0])
+            address = tuple(request.get('address', ('unknown', 0)))
+            reason = self.admission.admit(len(self.clients))
+            if reason:
+                self.reject_connection(client_socket, address, reason)
+                continue
+            print(f"分片工作进程 {self.worker_index} 接管连接: {address}")
+            conn = self.adopt_connection(client_socket, address)
+            try:
+                frames = conn['decoder'].feed(initial_data)
+            except FrameError as e:
+                print(f"客户端处理错误 {address}: {e}")
+                self.disconnect_client(client_socket, conn['player_id'])
+                continue
+            self.handle_frames(client_socket, conn, frames)
+
+def run_shard_worker(control_socket: socket.socket, worker_index: int, options: dict):
+    """工作进程入口"""
+    server = ShardWorkerServer(control_socket, worker_index)
+    for name, value in options.items():
+        setattr(server, name, value)
+    server.setup()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+class ShardRouter:
+    """前端路由：接受连接，按房间把连接分配给工作进程"""
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 29188, workers: int = 2,
+                 server_options: Optional[dict] = None):
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        # 传给每个工作进程 GameServer 的属性；各工作进程应答发现探测时使用同一个服务器ID和对外端口，
+        # 客户端据此把它们各自的房间合并为一个服务器
+        self.server_options = dict(server_options or {})
+        self.server_options.setdefault('port', port)
+        self.server_options.setdefault('discovery_id', secrets.token_hex(8))
+        # 准入限额是整个服务器的，平分给各工作进程
+        if self.server_options.get('admission') is not None:
+            self.server_options['admission'] = self.server_options['admission'].split(workers)
+        self.server_socket: Optional[socket.socket] = None
+        self.selector: Optional[selectors.BaseSelector] = None
+        self.workers: List[multiprocessing.Process] = []
+        self.worker_sockets: List[socket.socket] = []
+        self.pending: Dict[socket.socket, dict] = {}  # 尚未发送 JOIN_ROOM 的连接
+        self.routed_counts: List[int] = []
+        self.running = False
+        self.router_thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """启动工作进程和路由线程"""
+        if not SHARDING_SUPPORTED:
+            raise RuntimeError("当前平台不支持在进程间传递socket，无法使用多进程分片")
+
+        # 先创建工作进程，避免它们继承监听socket
+        for index in range(self.worker_count):
+            router_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+            process = multiprocessing.Process(target=run_shard_worker,
+                                              args=(worker_end, index, self.server_options))
+            process.daemon = True
+            process.start()
+            worker_end.close()
+            self.workers.append(process)
+            self.worker_sockets.append(router_end)
+            self.routed_counts.append(0)
+
+        self.selector = selectors.DefaultSelector()
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(128)
+        self.server_socket.setblocking(False)
+        self.selector.register(self.server_socket, selectors.EVENT_READ, self.accept_ready)
+        self.running = True
+
+        print(f"服务器启动在 {self.host}:{self.port} (分片模式，{self.worker_count} 个工作进程)")
+
+        self.router_thread = threading.Thread(target=self.serve_forever)
+        self.router_thread.daemon = True
+        self.router_thread.start()
+
+    def serve_forever(self):
+        """路由事件循环"""
+        while self.running:
+            try:
+                events = self.selector.select(1.0)
+            except OSError:
+                break
+            for key, mask in events:
+                try:
+                    key.data(key.fileobj)
+                except Exception as e:
+                    print(f"路由处理错误: {e}")
+            self.expire_pending()
+
+    def accept_ready(self, server_socket: socket.socket):
+        """接受新连接，等待其 JOIN_ROOM 消息"""
+        while True:
+            try:
+                client_socket, address = server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if self.running:
+                    print(f"接受连接错误: {e}")
+                return
+            client_socket.setblocking(False)
+            self.pending[client_socket] = {
+                'address': address,
+                'data': bytearray(),
+                'decoder': FrameDecoder(),
+                'deadline': time.monotonic() + JOIN_TIMEOUT
+            }
+            self.selector.register(client_socket, selectors.EVENT_READ, self.pending_ready)
+
+    def pending_ready(self, client_socket: socket.socket):
+        """读取待分配连接的数据，找到 JOIN_ROOM 后交给对应的工作进程"""
+        info = self.pending.get(client_socket)
+        if info is None:
+            return
+        try:
+            chunk = client_socket.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            chunk = b''
+        if not chunk:
+            self.drop_pending(client_socket)
+            return
+
+        info['data'] += chunk
+        try:
+            frames = info['decoder'].feed(chunk)
+        except FrameError:
+            frames = None
+        if frames is None or len(info['data']) > MAX_HANDOFF_SIZE:
+            self.drop_pending(client_socket)
+            return
+
+        for frame in frames:
+            message = decode_message(frame)
+            if message and message.type == MessageType.JOIN_ROOM:
+                if not isinstance(message.data, dict):
+                    self.drop_pending(client_socket)
+                    return
+                room_id = str(message.data.get('room_id', 'default'))
+                self.hand_off(client_socket, info, shard_for_room(room_id, self.worker_count))
+                return
+
+    def hand_off(self, client_socket: socket.socket, info: dict, worker_index: int):
+        """把连接（以及已经读取的全部数据）交给工作进程"""
+        self.selector.unregister(client_socket)
+        del self.pending[client_socket]
+        header = json.dumps({'address': list(info['address'])}).encode('utf-8')
+        try:
+            socket.send_fds(self.worker_sockets[worker_index], [header + b'\n' + bytes(info['data'])],
+                            [client_socket.fileno()])
+            self.routed_counts[worker_index] += 1
+        except OSError as e:
+            print(f"交接连接到工作进程 {worker_index} 失败: {e}")
+        # 工作进程已持有文件描述符的副本，路由进程关闭自己的副本
+        client_socket.close()
+
+    def drop_pending(self, client_socket: socket.socket):
+        """关闭未完成分配的连接"""
+        self.pending.pop(client_socket, None)
+        try:
+            self.selector.unregister(client_socket)
+        except (KeyError, ValueError):
+            pass
+        client_socket.close()
+
+    def expire_pending(self):
+        """关闭超时仍未发送 JOIN_ROOM 的连接"""
+        now = time.monotonic()
+        for client_socket, info in list(self.pending.items()):
+            if now > info['deadline']:
+                self.drop_pending(client_socket)
+
+    def stop(self):
+        """停止路由和所有工作进程"""
+        self.running = False
+        if self.router_thread and self.router_thread.is_alive():
+            self.router_thread.join(timeout=2.0)
+        for client_socket in list(self.pending):
+            self.drop_pending(client_socket)
+        if self.server_socket:
+            self.server_socket.close()
+        for worker_socket in self.worker_sockets:
+            try:
+                worker_socket.send(json.dumps({'op': 'stop'}).encode('utf-8'))
+            except OSError:
+                pass
+        for process in self.workers:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        for worker_socket in self.worker_sockets:
+            worker_socket.close()
+        if self.selector:
+            self.selector.close()
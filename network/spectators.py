@@ -0,0 +1,100 @@
+"""
+观战者分发队列
+观战者接收与玩家相同的房间广播，但发送走单独的低优先级队列：
+持有房间锁的广播只把已编码的帧和观战者列表（不可变元组）放入队列，是O(1)操作；
+真正写入每个观战者连接由分发线程（线程模式）或事件循环空闲时（事件循环模式）分批完成。
+因此观战人数再多也不会增加四名玩家收到消息的延迟。
+"""
+
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional, Tuple
+
+SPECTATOR_BATCH = 256  # 每批最多写入的观战者连接数，批次之间让出给玩家的消息处理
+
+class SpectatorFanout:
+    """观战者低优先级分发队列：按提交顺序把帧写给观战者"""
+
+    def __init__(self, send_frame: Callable, batch_size: int = SPECTATOR_BATCH):
+        self.send_frame = send_frame  # (socket, frame) -> None，写入连接的发送队列
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.items = deque()  # [观战者元组, codec -> 帧, 下一个要发送的下标]
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+
+    def submit(self, targets: Tuple, frames: Dict[str, bytes]):
+        """
+        提交一帧给一组观战者
+
+        Args:
+            targets: (socket, codec) 元组，调用方不得再修改
+            frames: 各编码对应的已编码帧
+        """
+        if not targets:
+            return
+        with self.lock:
+            self.items.append([targets, frames, 0])
+            self.ready.notify()
+
+    def has_pending(self) -> bool:
+        """是否还有未分发的帧"""
+        return bool(self.items)
+
+    def drain(self, budget: Optional[int] = None) -> bool:
+        """
+        分发最多 budget 个连接的帧
+
+        Returns:
+            bool: 是否还有剩余
+        """
+        if budget is None:
+            budget = self.batch_size
+        batch = []
+        with self.lock:
+            while self.items and len(batch) < budget:
+                item = self.items[0]
+                targets, frames, index = item
+                end = min(len(targets), index + budget - len(batch))
+                for client_socket, codec in targets[index:end]:
+                    batch.append((client_socket, frames[codec]))
+                if end < len(targets):
+                    item[2] = end
+                else:
+                    self.items.popleft()
+            remaining = bool(self.items)
+
+        # 写连接时不持有队列锁，广播方可以继续提交
+        for client_socket, frame in batch:
+            self.send_frame(client_socket, frame)
+        return remaining
+
+    def start(self):
+        """启动分发线程（线程模式服务器使用）"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """分发线程主循环"""
+        while self.running:
+            with self.lock:
+                while self.running and not self.items:
+                    self.ready.wait()
+            if not self.running:
+                break
+            try:
+                self.drain()
+            except Exception as e:
+                print(f"观战者分发错误: {e}")
+
+    def stop(self):
+        """停止分发线程并丢弃未发送的帧"""
+        with self.lock:
+            self.running = False
+            self.items.clear()
+            self.ready.notify_all()
+        if self.thread and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2.0)
@@ -0,0 +1,151 @@
+"""
+游戏状态增量同步
+服务器为每个状态快照分配递增的版本号，发送给客户端的 GAME_STATE 只包含相对于
+该客户端已确认（STATE_ACK）版本发生变化的字段；客户端按基准版本还原出完整状态。
+定期发送完整的关键帧，基准版本已不在历史记录中的客户端也会收到关键帧，用于修复不同步。
+
+GAME_STATE 消息数据：
+    {'version': 版本号, 'base': 基准版本号（关键帧为None）, 'state': 变化的字段}
+状态中的 players 以槽位字符串为键，便于只发送单个玩家的单个字段。
+"""
+
+import copy
+from collections import OrderedDict
+from typing import Dict, Optional
+
+KEYFRAME_INTERVAL = 20  # 每隔多少个版本强制发送一次关键帧
+HISTORY_SIZE = 32  # 服务器保留的历史快照数量
+RECEIVER_HISTORY_SIZE = 8  # 客户端保留的快照数量（未确认的基准版本仍可能被使用）
+
+def diff_state(base: Optional[dict], current: dict) -> dict:
+    """计算从 base 到 current 变化的字段（base为None时返回完整状态）"""
+    if base is None:
+        return copy.deepcopy(current)
+
+    delta = {}
+    for key, value in current.items():
+        old = base.get(key)
+        if isinstance(value, dict) and isinstance(old, dict):
+            sub_delta = diff_state(old, value)
+            if sub_delta:
+                delta[key] = sub_delta
+        elif key not in base or old != value:
+            delta[key] = copy.deepcopy(value)
+    return delta
+
+def apply_delta(base: Optional[dict], delta: dict) -> dict:
+    """将增量应用到基准状态，返回新的完整状态（不修改 base）"""
+    state = copy.deepcopy(base) if base is not None else {}
+    _merge(state, delta)
+    return state
+
+def _merge(target: dict, delta: dict):
+    for key, value in delta.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+class StateTracker:
+    """服务器端：记录房间的状态版本和每个客户端已确认的版本"""
+
+    def __init__(self, keyframe_interval: int = KEYFRAME_INTERVAL, history_size: int = HISTORY_SIZE):
+        self.version = 0
+        self.keyframe_interval = keyframe_interval
+        self.history_size = history_size
+        self.history: "OrderedDict[int, dict]" = OrderedDict()  # version -> 完整状态
+        self.acked: Dict[str, Optional[int]] = {}  # player_id -> 已确认的版本
+
+    def commit(self, state: dict) -> bool:
+        """
+        记录新的状态快照
+
+        Returns:
+            bool: 状态是否有变化（没有变化时不产生新版本）
+        """
+        if self.history and self.history[self.version] == state:
+            return False
+        self.version += 1
+        self.history[self.version] = copy.deepcopy(state)
+        while len(self.history) > self.history_size:
+            self.history.popitem(last=False)
+        return True
+
+    def acknowledge(self, player_id: str, version: Optional[int]):
+        """记录客户端已确认的版本（None表示客户端请求关键帧）"""
+        if version is None or version not in self.history:
+            self.acked[player_id] = None
+            return
+        previous = self.acked.get(player_id)
+        if previous is None or version > previous:
+            self.acked[player_id] = version
+
+    def forget(self, player_id: str):
+        """客户端离开后清除其确认记录"""
+        self.acked.pop(player_id, None)
+
+    def base_for(self, player_id: str) -> Optional[int]:
+        """为客户端选择基准版本，需要关键帧时返回None"""
+        if self.version % self.keyframe_interval == 1:
+            return None  # 定期关键帧（包括第一个版本）
+        base = self.acked.get(player_id)
+        if base is None or base not in self.history:
+            return None
+        return base
+
+    def spectator_base(self) -> Optional[int]:
+        """
+        观战者共用的基准版本：上一个版本（定期关键帧时为None）
+        观战者按顺序收到每个版本，所有观战者因此可以共享同一帧，不需要逐个确认
+        """
+        if self.version % self.keyframe_interval == 1:
+            return None
+        base = self.version - 1
+        return base if base in self.history else None
+
+    def build_update(self, base: Optional[int]) -> dict:
+        """构建相对于 base 版本的 GAME_STATE 数据"""
+        current = self.history[self.version]
+        return {
+            'version': self.version,
+            'base': base,
+            'state': diff_state(self.history[base] if base is not None else None, current)
+        }
+
+class StateReceiver:
+    """客户端：按基准版本还原完整状态"""
+
+    def __init__(self, history_size: int = RECEIVER_HISTORY_SIZE):
+        self.history_size = history_size
+        self.history: "OrderedDict[int, dict]" = OrderedDict()
+        self.version: Optional[int] = None
+
+    def apply(self, update: dict) -> Optional[dict]:
+        """
+        应用 GAME_STATE 数据
+
+        Returns:
+            dict: 还原出的完整状态；缺少基准版本时返回None（需要请求关键帧）
+        """
+        version = update.get('version')
+        base = update.get('base')
+        if self.version is not None and version <= self.version:
+            # 版本号从头开始说明服务器开始了新的游戏
+            self.reset()
+        if base is None:
+            state = apply_delta(None, update.get('state', {}))
+        elif base in self.history:
+            state = apply_delta(self.history[base], update.get('state', {}))
+        else:
+            return None
+
+        self.history[version] = state
+        while len(self.history) > self.history_size:
+            self.history.popitem(last=False)
+        self.version = version
+        return copy.deepcopy(state)
+
+    def reset(self):
+        """清空记录（新游戏开始时）"""
+        self.history.clear()
+        self.version = None
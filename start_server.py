@@ -3,50 +3,141 @@
 """
 
 import sys
-import socket
+import argparse
 
-def get_local_ip():
-    """获取本机IP地址"""
-    try:
-        # 创建一个UDP socket
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        # 连接到一个外部地址（不会真正发送数据）
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except:
-        return "127.0.0.1"
+from network.discovery import get_local_ips, DISCOVERY_PORT
+from network.ratelimit import (RateLimits, AdmissionControl, parse_rate, parse_type_limit,
+                               DEFAULT_MESSAGE_RATE, DEFAULT_BYTE_RATE)
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="雾萌游戏服务器")
+    parser.add_argument('--mode', choices=['thread', 'eventloop'], default='thread',
+                        help="服务器模式：thread 每个客户端一个线程；eventloop 单线程事件循环")
+    parser.add_argument('--outbound-high-water', type=int, default=256 * 1024,
+                        help="每个连接发送队列的最大积压字节数")
+    parser.add_argument('--slow-client-policy', choices=['disconnect', 'flag'], default='disconnect',
+                        help="发送积压超过高水位线时：disconnect 断开该客户端；flag 仅标记并丢弃超出的消息")
+    parser.add_argument('--port', type=int, default=29188, help="服务器端口")
+    parser.add_argument('--admin-port', type=int, default=None,
+                        help="本地指标管理端口（仅监听127.0.0.1），分片模式下第N个工作进程使用该端口+N")
+    parser.add_argument('--metrics-dump', default=None,
+                        help="定期把指标以JSON写入该文件，分片模式下文件名追加工作进程编号")
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help="指标快照间隔（秒）")
+    parser.add_argument('--journal-dir', default=None,
+                        help="把每个房间收发的所有消息写入该目录下的二进制日志（用 python -m network.journal 查看）")
+    parser.add_argument('--state-dir', default=None,
+                        help="把房间状态持久化到该目录（预写日志+快照），服务器重启后恢复进行中的房间")
+    parser.add_argument('--message-rate', type=parse_rate, default=DEFAULT_MESSAGE_RATE,
+                        help="每条连接的消息速率限制，格式 速率[:突发容量]，off 表示不限（默认 100:200）")
+    parser.add_argument('--byte-rate', type=parse_rate, default=DEFAULT_BYTE_RATE,
+                        help="每条连接每秒接收的字节数限制，格式同上（默认 262144:1048576）")
+    parser.add_argument('--type-limit', type=parse_type_limit, action='append', default=[],
+                        help="按消息类型覆盖速率限制，格式 类型=速率[:突发容量]，如 ping=2:5 或 dice_roll=off（可重复）")
+    parser.add_argument('--rate-limit-policy', choices=['drop', 'disconnect'], default='drop',
+                        help="超出速率限制时：drop 丢弃超出的消息；disconnect 断开该客户端")
+    parser.add_argument('--no-rate-limit', action='store_true', help="不限制客户端的消息速率")
+    parser.add_argument('--max-clients', type=int, default=None,
+                        help="整个服务器同时在线的连接数上限，达到后拒绝新连接（默认不限）；"
+                             "多进程分片时平分给各工作进程（向上取整），每个工作进程只检查自己的份额")
+    parser.add_argument('--accept-rate', type=parse_rate, default=(50, 200),
+                        help="全局的新连接速率限制，格式 速率[:突发容量]，off 表示不限（默认 50:200）；"
+                             "多进程分片时平分给各工作进程")
+    parser.add_argument('--heartbeat-timeout', type=float, default=15,
+                        help="多少秒没有收到连接的任何数据则认为掉线（默认 15）")
+    parser.add_argument('--idle-ping-interval', type=float, default=5,
+                        help="客户端连接空闲多少秒后才发送心跳，加入房间时告知客户端（默认 5，应小于 --heartbeat-timeout）")
+    parser.add_argument('--max-spectators', type=int, default=None,
+                        help="每个房间的观战人数上限（默认不限）")
+    parser.add_argument('--discovery-port', type=int, default=DISCOVERY_PORT,
+                        help="局域网发现服务的UDP端口（客户端大厅据此自动列出服务器）")
+    parser.add_argument('--no-discovery', action='store_true', help="不应答局域网发现探测")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="工作进程数量，大于1时按房间分片到多个事件循环进程（仅限Unix）")
+    parser.add_argument('--handoff-socket', default=None,
+                        help="不停服升级的Unix socket路径：以相同参数启动新进程时，新进程接管旧进程的所有连接和房间"
+                             "（使用事件循环模式，仅限Unix单进程）")
+    return parser.parse_args(argv)
 
 def main():
     """启动服务器"""
     from network.server import GameServer, SERVER_VERSION
+    from network.event_server import EventLoopGameServer
+    from network.sharding import ShardRouter, SHARDING_SUPPORTED
+    from network.handoff import HandoffGameServer, HANDOFF_SUPPORTED
+    
+    args = parse_args()
     
-    # 获取本机IP
-    local_ip = get_local_ip()
+    # 获取本机IP（不依赖外网，离线时也能得到局域网地址）
+    local_ips = get_local_ips() or ['127.0.0.1']
     
     print("=" * 50)
     print("雾萌游戏服务器")
     print("=" * 50)
     print(f"版本: v{SERVER_VERSION}")
-    print(f"本机IP地址: {local_ip}")
-    print(f"服务器端口: 29188")
-    print("其他玩家可以使用上述IP地址连接到此服务器")
+    print(f"本机IP地址: {', '.join(local_ips)}")
+    print(f"服务器端口: {args.port}")
+    if not args.no_discovery:
+        print(f"局域网发现端口: {args.discovery_port} (UDP)")
+    print(f"服务器模式: {args.mode}")
+    print("同一局域网的玩家可以在大厅中直接看到此服务器，也可以使用上述IP地址连接")
     print("按 Ctrl+C 停止服务器")
     print("=" * 50)
     
+    if args.idle_ping_interval >= args.heartbeat_timeout:
+        print("警告: --idle-ping-interval 不小于 --heartbeat-timeout，空闲的客户端会被误判为掉线")
+    
+    server_options = {
+        'heartbeat_timeout': args.heartbeat_timeout,
+        'idle_ping_interval': args.idle_ping_interval,
+        'outbound_high_water': args.outbound_high_water,
+        'slow_client_policy': args.slow_client_policy,
+        'max_spectators': args.max_spectators,
+        'admin_port': args.admin_port,
+        'metrics_dump_path': args.metrics_dump,
+        'metrics_dump_interval': args.metrics_interval,
+        'discovery_port': None if args.no_discovery else args.discovery_port,
+        'journal_dir': args.journal_dir,
+        'state_dir': args.state_dir,
+        'rate_limits': RateLimits.unlimited() if args.no_rate_limit else RateLimits(
+            args.message_rate, args.byte_rate, dict(args.type_limit), args.rate_limit_policy),
+        'admission': AdmissionControl(args.max_clients, args.accept_rate)
+    }
+    if args.workers > 1 and not SHARDING_SUPPORTED:
+        print("当前平台不支持多进程分片，使用单进程模式")
+    handoff = args.handoff_socket and HANDOFF_SUPPORTED and not (args.workers > 1 and SHARDING_SUPPORTED)
+    if args.handoff_socket and not handoff:
+        print("不停服升级只支持Unix平台上的单进程服务器，已忽略 --handoff-socket")
+
     # 创建并启动服务器
-    server = GameServer(host='0.0.0.0', port=29188)
+    if args.workers > 1 and SHARDING_SUPPORTED:
+        server = ShardRouter(host='0.0.0.0', port=args.port, workers=args.workers,
+                             server_options=server_options)
+    else:
+        if handoff:
+            server = HandoffGameServer(args.handoff_socket, host='0.0.0.0', port=args.port)
+        elif args.mode == 'eventloop':
+            server = EventLoopGameServer(host='0.0.0.0', port=args.port)
+        else:
+            server = GameServer(host='0.0.0.0', port=args.port)
+        for name, value in server_options.items():
+            setattr(server, name, value)
     server.start()
     
     try:
         # 保持服务器运行
         import time
-        while True:
+        while server.running:
             time.sleep(1)
+        if getattr(server, 'handed_off', False):
+            print("所有连接已交给新进程，旧进程退出")
     except KeyboardInterrupt:
         print("\n正在关闭服务器...")
         server.stop()
+        if isinstance(server, GameServer):
+            stats = server.get_encode_stats()
+            print(f"消息编码统计: 序列化 {stats['encodes']} 次, 发送 {stats['frames_sent']} 帧, "
+                  f"广播复用节省 {stats['encodes_saved']} 次序列化")
         print("服务器已关闭")
 
 if __name__ == "__main__":